@@ -0,0 +1,396 @@
+import base64
+import binascii
+import os
+import tempfile
+import uuid
+from datetime import date
+from typing import Optional, Tuple
+
+from starlette.applications import Starlette
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import FileResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from . import changes, db, export, importer, metrics, odometer, settings_cache, storage, summaries, users, webhooks
+from .validation import TRIP_TYPES, normalize_plate
+
+# Clients may keep read responses but must revalidate them with If-None-Match
+READ_CACHE_CONTROL = 'private, no-cache'
+# Trips per page of GET /api/trips
+TRIPS_PAGE_SIZE = 100
+TRIPS_MAX_PAGE_SIZE = 1000
+
+class BadRequest(Exception):
+    """Invalid query parameter; reported to the client as a 400"""
+
+async def authorize(request: Request) -> Optional[users.Account]:
+    """Check HTTP Basic credentials like the web login, or a bearer token issued at login,
+    and use the account's database for this request"""
+    header = request.headers.get('authorization', '')
+    scheme, _, encoded = header.partition(' ')
+    if scheme.lower() == 'bearer':
+        account = await users.verify_token_async(encoded.strip())
+    elif scheme.lower() == 'basic':
+        try:
+            username, _, password = base64.b64decode(encoded).decode().partition(':')
+        except (binascii.Error, UnicodeDecodeError):
+            return None
+        account = await users.authenticate_async(username, password)
+    else:
+        return None
+    if account:
+        users.use_account(account.id)
+    return account
+
+def unauthorized() -> Response:
+    return Response(status_code=401, headers={'WWW-Authenticate': 'Basic realm="Mileway"'})
+
+def bad_request(message: str) -> Response:
+    return JSONResponse({'error': message}, status_code=400)
+
+def sqlite_only() -> Response:
+    """Exports, imports and reports still work on the SQLite files only"""
+    return JSONResponse({'error': 'not available with the configured db_url'}, status_code=501)
+
+def date_param(request: Request, name: str) -> Optional[str]:
+    """Read an optional ISO date query parameter"""
+    value = request.query_params.get(name)
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value).isoformat()
+    except ValueError:
+        raise BadRequest(f'{name} must be a date in YYYY-MM-DD format')
+
+def int_param(request: Request, name: str, default: int) -> int:
+    """Read an optional non-negative integer query parameter"""
+    value = request.query_params.get(name)
+    if not value:
+        return default
+    try:
+        number = int(value)
+    except ValueError:
+        number = -1
+    if number < 0:
+        raise BadRequest(f'{name} must be a non-negative integer')
+    return number
+
+def filter_params(request: Request) -> dict:
+    """Read the start/end/license_plate/trip_type query parameters as db.trip_filters arguments"""
+    trip_type = request.query_params.get('trip_type') or None
+    if trip_type and trip_type not in TRIP_TYPES:
+        raise BadRequest(f'trip_type must be one of {", ".join(TRIP_TYPES)}')
+    license_plate = request.query_params.get('license_plate') or None
+    return {
+        'start': date_param(request, 'start'),
+        'end': date_param(request, 'end'),
+        'license_plate': license_plate.upper() if license_plate else None,
+        'trip_type': trip_type,
+    }
+
+def trip_filters(request: Request):
+    """Translate start/end/license_plate/trip_type query parameters into a WHERE clause"""
+    return db.trip_filters(**filter_params(request))
+
+def cursor_param(request: Request) -> Optional[Tuple[str, int]]:
+    """Read the `after` keyset cursor (date:id of the last trip on the previous page)"""
+    value = request.query_params.get('after')
+    if not value:
+        return None
+    trip_date, _, trip_id = value.partition(':')
+    try:
+        return date.fromisoformat(trip_date).isoformat(), int(trip_id)
+    except ValueError:
+        raise BadRequest('after must be the next cursor of a previous page')
+
+async def data_version(account: users.Account,
+                       variant: str = '') -> Tuple[str, storage.Repository, settings_cache.Snapshot]:
+    """Strong ETag for everything the read endpoints return
+
+    The change log sequence moves on every trip and vehicle write and the config
+    generation on every settings change, so a matching tag means an unchanged answer.
+    `variant` covers inputs that aren't in the database, such as a default period.
+    """
+    repository = storage.get()
+    config = await repository.config()
+    latest = await repository.latest_change()
+    tag = f'{account.id or 0}-{latest}-{config.generation}'
+    return f'"{tag}-{variant}"' if variant else f'"{tag}"', repository, config
+
+def not_modified(request: Request, etag: str) -> Optional[Response]:
+    """A 304 when If-None-Match already names `etag`"""
+    tags = [tag.strip() for tag in request.headers.get('if-none-match', '').split(',')]
+    if etag in tags or '*' in tags:
+        return Response(status_code=304, headers={'ETag': etag, 'Cache-Control': READ_CACHE_CONTROL})
+    return None
+
+def cached_json(content: dict, etag: str) -> Response:
+    return JSONResponse(content, headers={'ETag': etag, 'Cache-Control': READ_CACHE_CONTROL})
+
+async def export_trips(request: Request) -> Response:
+    """Export trips as CSV (default) or XLSX, filtered by date range, vehicle and trip type"""
+    if not await authorize(request):
+        return unauthorized()
+    if not storage.is_sqlite():
+        return sqlite_only()
+    try:
+        where, params = trip_filters(request)
+    except BadRequest as e:
+        return bad_request(str(e))
+
+    fmt = request.query_params.get('format', 'csv')
+    if fmt == 'csv':
+        return StreamingResponse(
+            export.iter_csv(where, params),
+            media_type='text/csv; charset=utf-8',
+            headers={'Content-Disposition': 'attachment; filename="ritten.csv"'}
+        )
+    if fmt == 'xlsx':
+        try:
+            import openpyxl  # noqa: F401
+        except ImportError:
+            return bad_request('XLSX export requires the openpyxl package')
+        fd, path = tempfile.mkstemp(suffix='.xlsx')
+        os.close(fd)
+        try:
+            await run_in_threadpool(export.write_xlsx, path, where, params)
+        except BaseException:
+            os.unlink(path)
+            raise
+        return FileResponse(
+            path,
+            media_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+            filename='ritten.xlsx',
+            background=BackgroundTask(os.unlink, path)
+        )
+    return bad_request('format must be csv or xlsx')
+
+# Request bodies up to this size stay in memory while importing; larger ones spill to disk
+IMPORT_SPOOL_SIZE = 8 * 1024 * 1024
+
+IMPORT_CONTENT_TYPES = {
+    'text/csv': 'csv',
+    'application/json': 'json',
+    'application/x-ndjson': 'ndjson',
+    'application/ndjson': 'ndjson',
+}
+
+async def import_trips(request: Request) -> Response:
+    """Bulk import trips from a CSV, JSON array or NDJSON request body"""
+    if not await authorize(request):
+        return unauthorized()
+    if not storage.is_sqlite():
+        return sqlite_only()
+    content_type = request.headers.get('content-type', '').split(';')[0].strip()
+    fmt = request.query_params.get('format') or IMPORT_CONTENT_TYPES.get(content_type)
+    if fmt not in importer.IMPORT_FORMATS:
+        return bad_request('format must be csv, json or ndjson')
+
+    with tempfile.SpooledTemporaryFile(max_size=IMPORT_SPOOL_SIZE) as body:
+        async for chunk in request.stream():
+            body.write(chunk)
+        body.seek(0)
+        report = await run_in_threadpool(importer.import_trips, body, fmt)
+    if report['imported']:
+        changes.notify()
+    return JSONResponse(report)
+
+async def odometer_report(request: Request) -> Response:
+    """List odometer gaps, overlaps and rollbacks, optionally for one vehicle"""
+    if not await authorize(request):
+        return unauthorized()
+    if not storage.is_sqlite():
+        return sqlite_only()
+    license_plate = request.query_params.get('license_plate') or None
+    issues = await db.run(
+        lambda conn: list(odometer.iter_report(conn, license_plate.upper() if license_plate else None))
+    )
+    return JSONResponse({'issues': issues})
+
+# Trips accepted per sync request; the browser sends its outbox in batches of this size
+SYNC_MAX_TRIPS = int(os.getenv("SYNC_MAX_TRIPS", "500"))
+
+async def sync_trips(request: Request) -> Response:
+    """Store trips captured offline, keyed by the UUID the device gave them
+
+    Sending the same batch again is harmless: known trips are updated or left
+    alone and every trip keeps its server id.
+    """
+    if not await authorize(request):
+        return unauthorized()
+    try:
+        body = await request.json()
+    except ValueError:
+        return bad_request('body must be JSON')
+    records = body.get('trips') if isinstance(body, dict) else None
+    if not isinstance(records, list):
+        return bad_request('body must be an object with a trips array')
+    if len(records) > SYNC_MAX_TRIPS:
+        return bad_request(f'at most {SYNC_MAX_TRIPS} trips per request')
+
+    repository = storage.get()
+    config = await repository.config()
+    plates = {normalize_plate(vehicle[1]) for vehicle in config.vehicles}
+    trips, errors = [], []
+    for record in records:
+        client_id = record.get('client_id') if isinstance(record, dict) else None
+        try:
+            client_id = str(uuid.UUID(str(client_id)))
+        except ValueError:
+            errors.append({'client_id': client_id, 'error': 'client_id must be a UUID'})
+            continue
+        try:
+            trips.append((client_id, importer.validate_record(record, plates)))
+        except (TypeError, ValueError) as e:
+            errors.append({'client_id': client_id, 'error': str(e)})
+
+    webhook = None
+    settings = config.settings
+    if settings and settings[1] and settings[0]:
+        mileage_rate = settings[5]
+        webhook = (settings[0], lambda trip_id, values: webhooks.mileage_entry(trip_id, values, mileage_rate))
+
+    results = await repository.sync_trips(trips, webhook) if trips else []
+    if any(status == 'created' for _, status in results):
+        index = await repository.location_index()
+        for (_, values), (_, status) in zip(trips, results):
+            if status == 'created':
+                index.add(values[1], values[0])
+                index.add(values[2], values[0])
+    if any(status != 'unchanged' for _, status in results):
+        changes.notify()
+        if webhook:
+            webhooks.notify()
+    return JSONResponse({
+        'trips': [
+            {'client_id': client_id, 'id': trip_id, 'status': status}
+            for (client_id, _), (trip_id, status) in zip(trips, results)
+        ],
+        'errors': errors,
+    })
+
+async def list_changes(request: Request) -> Response:
+    """Trip and vehicle changes after sequence number `since`, oldest first
+
+    With `wait` (seconds, up to CHANGES_MAX_WAIT) the request is held until
+    there is a change, so consumers can long-poll instead of re-reading everything.
+    """
+    if not await authorize(request):
+        return unauthorized()
+    try:
+        since = int_param(request, 'since', 0)
+        wait = min(int_param(request, 'wait', 0), changes.CHANGES_MAX_WAIT)
+        limit = min(int_param(request, 'limit', changes.CHANGES_PAGE_SIZE) or 1, changes.CHANGES_PAGE_SIZE)
+    except BadRequest as e:
+        return bad_request(str(e))
+
+    if wait and await changes.wait_for_change(since, wait) <= since:
+        return JSONResponse({'changes': [], 'last_seq': since, 'more': False})
+    entries, trips, vehicles = await storage.get().changes_since(since, limit)
+    return JSONResponse({
+        'changes': changes.describe(entries, trips, vehicles),
+        # Pass this as `since` in the next request
+        'last_seq': entries[-1][0] if entries else since,
+        'more': len(entries) == limit,
+    })
+
+async def list_trips(request: Request) -> Response:
+    """Trips newest first, filtered like the export and paged with the `next` cursor"""
+    account = await authorize(request)
+    if not account:
+        return unauthorized()
+    try:
+        filters = filter_params(request)
+        after = cursor_param(request)
+        limit = min(int_param(request, 'limit', TRIPS_PAGE_SIZE) or 1, TRIPS_MAX_PAGE_SIZE)
+    except BadRequest as e:
+        return bad_request(str(e))
+
+    etag, repository, _ = await data_version(account)
+    response = not_modified(request, etag)
+    if response:
+        return response
+    rows = await repository.find_trips(filters, after, limit)
+    return cached_json({
+        'trips': [dict(zip(storage.TRIP_FIELDS, row)) for row in rows],
+        # Pass this as `after` for the next page
+        'next': f'{rows[-1][1]}:{rows[-1][0]}' if len(rows) == limit else None,
+    }, etag)
+
+async def list_vehicles(request: Request) -> Response:
+    """Active vehicles"""
+    account = await authorize(request)
+    if not account:
+        return unauthorized()
+    etag, _, config = await data_version(account)
+    response = not_modified(request, etag)
+    if response:
+        return response
+    return cached_json({
+        'vehicles': [dict(zip(storage.VEHICLE_FIELDS, row), active=bool(row[6])) for row in config.vehicles],
+    }, etag)
+
+async def trip_summary(request: Request) -> Response:
+    """Kilometres, costs and reimbursement for `month` (YYYY-MM, default this month) or `year`"""
+    account = await authorize(request)
+    if not account:
+        return unauthorized()
+    month = request.query_params.get('month')
+    year = request.query_params.get('year')
+    try:
+        if year and not month:
+            period = int(year)
+            if not 1 <= period <= 9999:
+                raise ValueError
+            period = f'{period:04d}'
+        else:
+            period = month or date.today().strftime('%Y-%m')
+            date.fromisoformat(f'{period}-01')
+    except ValueError:
+        return bad_request('month must be YYYY-MM or year must be YYYY')
+
+    # Without a month or year the period moves at midnight on the 1st, with no write to notice
+    etag, repository, config = await data_version(account, period)
+    response = not_modified(request, etag)
+    if response:
+        return response
+    if len(period) == 4:
+        rows = await repository.yearly_totals(int(period))
+    else:
+        rows = await repository.monthly_totals(int(period[:4]), int(period[5:]))
+    mileage_rate = (config.settings[5] if config.settings else None) or 0.23
+    return cached_json(dict(summaries.fold(rows, mileage_rate), period=period, mileage_rate=mileage_rate), etag)
+
+async def metrics_endpoint(request: Request) -> Response:
+    """Expose latency histograms and counters in the Prometheus text format"""
+    account = await authorize(request)
+    if not account or account.id is not None:
+        # Metrics cover every user, so only the administrator account may read them
+        return unauthorized()
+    return PlainTextResponse(metrics.render(), media_type='text/plain; version=0.0.4')
+
+# The PWA is served from the frontend origin and syncs against this backend
+CORS_ORIGINS = os.getenv("MILEWAY_CORS_ORIGINS", os.getenv("DEPLOY_URL", "http://localhost:3000")).split(',')
+
+api = Starlette(
+    routes=[
+        Route('/api/export/trips', export_trips, methods=['GET']),
+        Route('/api/import/trips', import_trips, methods=['POST']),
+        Route('/api/sync/trips', sync_trips, methods=['POST']),
+        Route('/api/changes', list_changes, methods=['GET']),
+        Route('/api/trips', list_trips, methods=['GET']),
+        Route('/api/vehicles', list_vehicles, methods=['GET']),
+        Route('/api/summary', trip_summary, methods=['GET']),
+        Route('/api/odometer/report', odometer_report, methods=['GET']),
+        Route('/metrics', metrics_endpoint, methods=['GET']),
+    ],
+    middleware=[
+        Middleware(CORSMiddleware, allow_origins=CORS_ORIGINS, allow_methods=['GET', 'POST'],
+                   allow_headers=['Authorization', 'Content-Type', 'If-None-Match'],
+                   expose_headers=['ETag']),
+    ]
+)
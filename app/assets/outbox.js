@@ -0,0 +1,243 @@
+// Offline trip capture. Without a connection the trip form's save button stores
+// the trip in IndexedDB under a random UUID instead of sending it to the backend;
+// the outbox is sent to /api/sync/trips in batches once the backend answers again.
+// Re-sending a batch is safe: the server recognises trips by their UUID.
+(function () {
+  'use strict';
+
+  var DB_NAME = 'mileway';
+  var STORE = 'outbox';
+  var BATCH_SIZE = 500;         // SYNC_MAX_TRIPS on the server
+  var RETRY_MS = 15000;
+  // Client errors that clear up by themselves: expired token, timeout, rate limit
+  var RETRY_STATUSES = [401, 403, 408, 429];
+  var CONFIG_KEY = 'mileway-outbox';
+
+  var FIELDS = {
+    date: 'trip-date',
+    start_location: 'trip-start-location',
+    end_location: 'trip-end-location',
+    start_odometer: 'trip-start-odometer',
+    end_odometer: 'trip-end-odometer',
+    distance_km: 'trip-distance-km',
+    purpose: 'trip-purpose',
+    client_project: 'trip-client-project',
+    notes: 'trip-notes',
+    fuel_cost: 'trip-fuel-cost',
+    parking_cost: 'trip-parking-cost',
+    toll_cost: 'trip-toll-cost'
+  };
+
+  var config = JSON.parse(localStorage.getItem(CONFIG_KEY) || 'null');
+  var reachable = true;
+  var flushing = false;
+
+  function openDb() {
+    return new Promise(function (resolve, reject) {
+      var request = indexedDB.open(DB_NAME, 1);
+      request.onupgradeneeded = function () {
+        request.result.createObjectStore(STORE, { keyPath: 'client_id' });
+      };
+      request.onsuccess = function () { resolve(request.result); };
+      request.onerror = function () { reject(request.error); };
+    });
+  }
+
+  // Run fn(store) in one transaction; resolves with the result of the request fn returns
+  function withStore(mode, fn) {
+    return openDb().then(function (db) {
+      return new Promise(function (resolve, reject) {
+        var transaction = db.transaction(STORE, mode);
+        var request = fn(transaction.objectStore(STORE));
+        transaction.oncomplete = function () { resolve(request ? request.result : undefined); };
+        transaction.onerror = function () { reject(transaction.error); };
+      });
+    });
+  }
+
+  function text(key, count) {
+    var texts = (config && config.texts) || {};
+    return (texts[key] || key).replace('{count}', count);
+  }
+
+  function showStatus(message) {
+    var element = document.getElementById('mileway-outbox-status');
+    if (!element) {
+      element = document.createElement('div');
+      element.id = 'mileway-outbox-status';
+      element.style.cssText = 'position:fixed;bottom:1rem;left:50%;transform:translateX(-50%);' +
+        'background:#1a365d;color:#fff;padding:.5rem 1rem;border-radius:.5rem;font:14px Inter,sans-serif;' +
+        'z-index:1000;display:none';
+      document.body.appendChild(element);
+    }
+    element.textContent = message || '';
+    element.style.display = message ? 'block' : 'none';
+  }
+
+  function refreshStatus() {
+    return withStore('readonly', function (store) { return store.getAll(); }).then(function (entries) {
+      var failed = entries.filter(function (entry) { return entry.error; }).length;
+      var pending = entries.length - failed;
+      var messages = [];
+      if (pending) messages.push(text('offline_pending', pending));
+      if (failed) messages.push(text('offline_failed', failed));
+      showStatus(messages.join(' • '));
+    });
+  }
+
+  function fieldValue(id) {
+    var element = document.getElementById(id);
+    return element ? element.value : '';
+  }
+
+  // The selects render their value as text, wrapped in a box carrying the id
+  function selectValue(id) {
+    var element = document.getElementById(id);
+    return element ? element.textContent.trim() : '';
+  }
+
+  function uuid() {
+    if (window.crypto && crypto.randomUUID) return crypto.randomUUID();
+    var bytes = crypto.getRandomValues(new Uint8Array(16));
+    bytes[6] = (bytes[6] & 0x0f) | 0x40;
+    bytes[8] = (bytes[8] & 0x3f) | 0x80;
+    var hex = Array.prototype.map.call(bytes, function (b) { return (b + 0x100).toString(16).slice(1); }).join('');
+    return hex.slice(0, 8) + '-' + hex.slice(8, 12) + '-' + hex.slice(12, 16) + '-' + hex.slice(16, 20) + '-' + hex.slice(20);
+  }
+
+  function capture() {
+    var trip = { client_id: uuid(), user: config.user, token: config.token, api_url: config.api_url };
+    Object.keys(FIELDS).forEach(function (name) { trip[name] = fieldValue(FIELDS[name]); });
+    trip.trip_type = selectValue('trip-type') || 'zakelijk';
+    trip.license_plate = (config.vehicles || {})[selectValue('trip-vehicle')] || '';
+    if (!trip.date || !trip.start_location || !trip.end_location) return Promise.resolve();
+    return withStore('readwrite', function (store) { return store.put(trip); }).then(function () {
+      showStatus(text('offline_saved'));
+      setTimeout(refreshStatus, 3000);
+    });
+  }
+
+  function post(apiUrl, token, trips) {
+    return fetch(apiUrl + '/api/sync/trips', {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json', 'Authorization': 'Bearer ' + token },
+      body: JSON.stringify({ trips: trips.map(function (trip) {
+        var record = Object.assign({}, trip);
+        delete record.user; delete record.token; delete record.api_url; delete record.error;
+        return record;
+      }) })
+    });
+  }
+
+  function flush() {
+    if (flushing) return Promise.resolve();
+    flushing = true;
+    return withStore('readonly', function (store) { return store.getAll(); }).then(function (entries) {
+      entries = entries.filter(function (entry) { return !entry.error; });
+      // Each trip goes out with the token of whoever captured it
+      var groups = {};
+      entries.forEach(function (entry) {
+        var key = entry.api_url + ' ' + entry.token;
+        (groups[key] = groups[key] || []).push(entry);
+      });
+      var batches = [];
+      Object.keys(groups).forEach(function (key) {
+        for (var i = 0; i < groups[key].length; i += BATCH_SIZE) batches.push(groups[key].slice(i, i + BATCH_SIZE));
+      });
+      return batches.reduce(function (previous, batch) {
+        return previous.then(function () {
+          return post(batch[0].api_url, batch[0].token, batch).then(function (response) {
+            reachable = true;
+            // The server refused the batch itself: retrying can't help, so park its
+            // trips with the reason instead of blocking the outbox behind them
+            if (response.status >= 400 && response.status < 500 && RETRY_STATUSES.indexOf(response.status) < 0) {
+              return response.json().catch(function () { return {}; }).then(function (result) {
+                var reason = result.error || ('HTTP ' + response.status);
+                return withStore('readwrite', function (store) {
+                  batch.forEach(function (entry) { store.put(Object.assign({}, entry, { error: reason })); });
+                });
+              });
+            }
+            // Expired token or a server problem: keep the trips for a later attempt
+            if (!response.ok) return;
+            return response.json().then(function (result) {
+              return withStore('readwrite', function (store) {
+                result.trips.forEach(function (trip) { store.delete(trip.client_id); });
+                result.errors.forEach(function (error) {
+                  var entry = batch.find(function (item) { return item.client_id === error.client_id; });
+                  if (entry) store.put(Object.assign({}, entry, { error: error.error }));
+                });
+              });
+            });
+          });
+        });
+      }, Promise.resolve());
+    }).catch(function () {
+      reachable = false;
+    }).then(function () {
+      flushing = false;
+      return refreshStatus();
+    });
+  }
+
+  function ping() {
+    if (!config) return Promise.resolve();
+    // An opaque answer is enough to know the backend can be reached
+    return fetch(config.api_url + '/ping', { cache: 'no-store', mode: 'no-cors' }).then(function () {
+      reachable = true;
+      return flush();
+    }, function () {
+      reachable = false;
+    });
+  }
+
+  function online() {
+    return navigator.onLine && reachable;
+  }
+
+  // Capture phase on the document runs before React's listeners on the app root,
+  // so an offline save never queues an add_trip event for a socket that is down
+  document.addEventListener('click', function (event) {
+    if (!config || online() || !event.target.closest || !event.target.closest('#trip-save')) return;
+    event.preventDefault();
+    event.stopImmediatePropagation();
+    capture();
+  }, true);
+
+  window.addEventListener('online', ping);
+  window.addEventListener('offline', function () { reachable = false; });
+  setInterval(ping, RETRY_MS);
+
+  window.milewayOutbox = {
+    configure: function (value) {
+      config = value;
+      if (value) {
+        localStorage.setItem(CONFIG_KEY, JSON.stringify(value));
+        // A fresh login renews the token of this user's waiting trips
+        withStore('readwrite', function (store) {
+          var request = store.openCursor();
+          request.onsuccess = function () {
+            var cursor = request.result;
+            if (!cursor) return;
+            if (cursor.value.user === value.user) {
+              cursor.update(Object.assign({}, cursor.value, { token: value.token, api_url: value.api_url }));
+            }
+            cursor.continue();
+          };
+        }).then(flush);
+      } else {
+        localStorage.removeItem(CONFIG_KEY);
+      }
+    },
+    flush: flush
+  };
+
+  if ('serviceWorker' in navigator) {
+    navigator.serviceWorker.register('/sw.js').catch(function () {});
+  }
+  if (document.readyState === 'loading') {
+    document.addEventListener('DOMContentLoaded', ping);
+  } else {
+    ping();
+  }
+})();
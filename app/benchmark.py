@@ -0,0 +1,203 @@
+import asyncio
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import time
+from datetime import date, datetime, timedelta
+from typing import Awaitable, Callable, List
+
+from . import db, locations, routes, settings_cache
+from .importer import INSERT_TRIP_SQL
+from .validation import TRIP_TYPES
+
+# Synthetic databases are generated once per size into --dir and reused by later
+# runs, so reports from different commits compare like with like
+BENCHMARK_SIZES = (10_000, 100_000, 1_000_000)
+BENCHMARK_VEHICLES = 50
+BENCHMARK_LOCATIONS = 800
+BENCHMARK_YEARS = 3
+BENCHMARK_REPEAT = 20
+BENCHMARK_SEED = 1
+
+def _plate(number: int) -> str:
+    return f'{number % 100:02d}-BM-{number // 100 + 1}'
+
+def generate(db_path: str, trips: int, vehicles: int = BENCHMARK_VEHICLES, seed: int = BENCHMARK_SEED):
+    """Create a database with `trips` trips spread over `vehicles` vehicles and the last few years"""
+    db.close_pool()
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+    use_database(db_path)
+
+    rng = random.Random(seed)
+    places = [f'Plaats {n:03d}' for n in range(BENCHMARK_LOCATIONS)]
+    plates = [_plate(n) for n in range(vehicles)]
+    odometers = {plate: rng.randint(10_000, 90_000) for plate in plates}
+    first_day = date.today() - timedelta(days=365 * BENCHMARK_YEARS)
+    days = (date.today() - first_day).days + 1
+
+    with db.connection() as conn:
+        conn.executemany('''
+            INSERT INTO vehicles (license_plate, brand, model, fuel_type)
+            VALUES (?, 'Benchmark', 'Model', 'Benzine')
+        ''', [(plate,) for plate in plates])
+
+    batch = []
+    for n in range(trips):
+        # Dates grow with n, so each vehicle's odometer readings stay continuous
+        trip_date = (first_day + timedelta(days=n * days // trips)).isoformat()
+        plate = rng.choice(plates)
+        distance = rng.randint(3, 250)
+        start = odometers[plate]
+        odometers[plate] = start + distance
+        batch.append((
+            trip_date, rng.choice(places), rng.choice(places), start, start + distance, distance,
+            f'Klantbezoek {n % 97}', rng.choice(TRIP_TYPES), plate, f'Project {n % 31}', '',
+            round(rng.random() * 20, 2) if n % 10 == 0 else 0.0,
+            round(rng.random() * 8, 2) if n % 4 == 0 else 0.0, 0.0
+        ))
+        if len(batch) >= 10_000:
+            with db.connection() as conn:
+                conn.executemany(INSERT_TRIP_SQL, batch)
+            batch.clear()
+    with db.connection() as conn:
+        if batch:
+            conn.executemany(INSERT_TRIP_SQL, batch)
+        routes.rebuild_routes(conn)
+        conn.execute('PRAGMA optimize')
+
+def use_database(db_path: str):
+    """Point the process at another database and drop everything cached from the previous one"""
+    os.environ['MILEWAY_DB_PATH'] = db_path
+    db.get_pool()
+    locations.reset_index()
+    routes.get_cache().clear()
+    settings_cache.get_cache().clear()
+
+def summarize(timings: List[float]) -> dict:
+    """Milliseconds; the first call is reported apart because it fills the caches"""
+    first, rest = timings[0], timings[1:] or timings[:1]
+    ordered = sorted(rest)
+    return {
+        'first_ms': round(first * 1000, 3),
+        'min_ms': round(ordered[0] * 1000, 3),
+        'median_ms': round(statistics.median(ordered) * 1000, 3),
+        'p95_ms': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 3),
+        'max_ms': round(ordered[-1] * 1000, 3),
+        'runs': len(timings),
+    }
+
+async def _time(fn: Callable[[], Awaitable], repeat: int, before: Callable[[], Awaitable] = None) -> dict:
+    timings = []
+    for _ in range(repeat):
+        if before:
+            await before()
+        started = time.perf_counter()
+        await fn()
+        timings.append(time.perf_counter() - started)
+    return summarize(timings)
+
+async def bench_handlers(repeat: int) -> dict:
+    """Time the hot State handlers on the current database, called directly on a State instance"""
+    # Imported here so generating databases doesn't need the Reflex app
+    from .mileway import State
+
+    def new_state():
+        state = State(_reflex_internal_init=True)
+        state.username = os.getenv("AUTH_USERNAME", "admin")
+        state.password = os.getenv("AUTH_PASSWORD", "password123")
+        return state
+
+    results = {}
+    state = new_state()
+
+    async def login():
+        await new_state().login()
+    results['login'] = await _time(login, repeat)
+
+    await state.login()
+    if not state.is_authenticated:
+        raise SystemExit('Login failed; set AUTH_USERNAME and AUTH_PASSWORD')
+    results['load_trips'] = await _time(state.load_trips, repeat)
+    results['load_more_trips'] = await _time(state.load_more_trips, repeat, before=state.load_trips)
+    results['calculate_monthly_summary'] = await _time(state.calculate_monthly_summary, repeat)
+
+    # Each added trip is deleted again, so the database keeps its size across runs
+    added, deleted = [], []
+    for n in range(repeat):
+        state.trip_date = date.today().isoformat()
+        state.start_location = 'Plaats 001'
+        state.end_location = 'Plaats 002'
+        state.distance_km = str(40 + n)
+        state.start_odometer = ''
+        state.end_odometer = ''
+        state.purpose = 'Benchmark'
+        state.trip_type = 'zakelijk'
+        if state.vehicles:
+            state.selected_vehicle_id = str(state.vehicles[0].id)
+        started = time.perf_counter()
+        await state.add_trip()
+        added.append(time.perf_counter() - started)
+
+        trip_id = (await db.fetchone('SELECT MAX(id) FROM trips'))[0]
+        started = time.perf_counter()
+        await state.delete_trip(trip_id)
+        deleted.append(time.perf_counter() - started)
+    results['add_trip'] = summarize(added)
+    results['delete_trip'] = summarize(deleted)
+    return results
+
+def _commit() -> str:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+async def run(sizes, directory: str, vehicles: int, repeat: int, regenerate: bool) -> dict:
+    os.makedirs(directory, exist_ok=True)
+    report = {
+        'commit': _commit(),
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'repeat': repeat,
+        'results': [],
+    }
+    for size in sizes:
+        db_path = os.path.join(directory, f'trips-{size}-{vehicles}.db')
+        entry = {'trips': size, 'vehicles': vehicles}
+        if regenerate or not os.path.exists(db_path):
+            started = time.perf_counter()
+            generate(db_path, size, vehicles)
+            entry['generate_s'] = round(time.perf_counter() - started, 2)
+        use_database(db_path)
+        entry['handlers'] = await bench_handlers(repeat)
+        report['results'].append(entry)
+    return report
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Benchmark Mileway handlers on synthetic databases')
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(BENCHMARK_SIZES))
+    parser.add_argument('--vehicles', type=int, default=BENCHMARK_VEHICLES)
+    parser.add_argument('--repeat', type=int, default=BENCHMARK_REPEAT)
+    parser.add_argument('--dir', default='/tmp/mileway-benchmark')
+    parser.add_argument('--regenerate', action='store_true', help='rebuild databases that already exist')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args.sizes, args.dir, args.vehicles, args.repeat, args.regenerate))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
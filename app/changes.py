@@ -0,0 +1,53 @@
+import asyncio
+import os
+from typing import List
+
+from . import storage
+
+# Longest a GET /api/changes request waits for something new
+CHANGES_MAX_WAIT = float(os.getenv("CHANGES_MAX_WAIT", "30"))
+# How often a waiting request looks for changes made by other workers or the CLI
+CHANGES_POLL_INTERVAL = float(os.getenv("CHANGES_POLL_INTERVAL", "1"))
+CHANGES_PAGE_SIZE = 500
+
+# Events of requests waiting in this process
+_waiters = set()
+
+def notify():
+    """Wake waiting requests after a write in this process; other processes are seen by polling"""
+    for event in list(_waiters):
+        event.set()
+
+async def wait_for_change(since: int, timeout: float) -> int:
+    """Wait until the current database has changes after `since`; returns the latest sequence number"""
+    repository = storage.get()
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    event = asyncio.Event()
+    _waiters.add(event)
+    try:
+        while True:
+            # Cleared before reading, so a write after the read still wakes us
+            event.clear()
+            latest = await repository.latest_change()
+            remaining = deadline - loop.time()
+            if latest > since or remaining <= 0:
+                return latest
+            try:
+                await asyncio.wait_for(event.wait(), timeout=min(CHANGES_POLL_INTERVAL, remaining))
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        _waiters.discard(event)
+
+def describe(changes: List[tuple], trips: List[tuple], vehicles: List[tuple]) -> List[dict]:
+    """JSON entries for Repository.changes_since; `data` is the current row, None once deleted"""
+    rows = {
+        'trip': {row[0]: dict(zip(storage.TRIP_FIELDS, row)) for row in trips},
+        'vehicle': {row[0]: dict(zip(storage.VEHICLE_FIELDS, row), active=bool(row[6])) for row in vehicles},
+    }
+    return [
+        {'seq': seq, 'entity': entity, 'id': entity_id, 'op': op, 'changed_at': changed_at,
+         'data': rows.get(entity, {}).get(entity_id)}
+        for seq, entity, entity_id, op, changed_at in changes
+    ]
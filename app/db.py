@@ -0,0 +1,718 @@
+import asyncio
+import contextvars
+import functools
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import date
+from typing import Callable, Dict, Optional, Tuple
+
+from . import metrics
+
+# SQLite database file, overridable with MILEWAY_DB_PATH (e.g. a scratch file for benchmarks)
+DEFAULT_DB_PATH = "/app/data/mileage.db"
+
+# Pool configuration (overridable through the environment)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "256"))
+# Maximum number of queries running at once; async handlers queue beyond this
+DB_MAX_CONCURRENCY = int(os.getenv("DB_MAX_CONCURRENCY", str(DB_POOL_SIZE)))
+# Per-user databases see one driver's traffic, so their pools stay small...
+DB_USER_POOL_SIZE = int(os.getenv("DB_USER_POOL_SIZE", "2"))
+# ...and only the most recently used ones are kept open
+DB_MAX_OPEN_DATABASES = int(os.getenv("DB_MAX_OPEN_DATABASES", "64"))
+
+# Applied to every new connection. journal_mode=WAL is persistent in the
+# database file, the others are per-connection.
+PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('cache_size', -16000),       # ~16 MB page cache per connection
+    ('mmap_size', 134217728),     # 128 MB memory-mapped I/O
+    ('temp_store', 'MEMORY'),
+    ('busy_timeout', 5000),
+)
+
+# Secondary indexes on trips. Dates are stored as ISO 'YYYY-MM-DD' text, so
+# these serve both range filters and the newest-first ordering.
+TRIP_INDEXES = (
+    ('idx_trips_date_id', '(date, id)'),
+    ('idx_trips_type_date', '(trip_type, date)'),
+    ('idx_trips_plate_date', '(license_plate, date)'),
+    ('idx_trips_route', '(start_location COLLATE NOCASE, end_location COLLATE NOCASE)'),
+)
+
+# Per (year, month, vehicle, trip type) totals, maintained by triggers on trips
+ROLLUP_COLUMNS = ('trip_count', 'distance_km', 'fuel_cost', 'parking_cost', 'toll_cost')
+
+def _rollup_trigger_sql(name: str, event: str, sign: str, row: str) -> str:
+    """Build a trigger that adds (sign '+') or removes (sign '-') a trip row from trip_rollups"""
+    return f'''
+        CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON trips
+        BEGIN
+            INSERT INTO trip_rollups (year, month, license_plate, trip_type,
+                                      trip_count, distance_km, fuel_cost, parking_cost, toll_cost)
+            VALUES (CAST(substr({row}.date, 1, 4) AS INTEGER), CAST(substr({row}.date, 6, 2) AS INTEGER),
+                    COALESCE({row}.license_plate, ''), {row}.trip_type,
+                    {sign}1, {sign}COALESCE({row}.distance_km, 0), {sign}COALESCE({row}.fuel_cost, 0),
+                    {sign}COALESCE({row}.parking_cost, 0), {sign}COALESCE({row}.toll_cost, 0))
+            ON CONFLICT (year, month, license_plate, trip_type) DO UPDATE SET
+                trip_count = trip_count + excluded.trip_count,
+                distance_km = distance_km + excluded.distance_km,
+                fuel_cost = fuel_cost + excluded.fuel_cost,
+                parking_cost = parking_cost + excluded.parking_cost,
+                toll_cost = toll_cost + excluded.toll_cost;
+            DELETE FROM trip_rollups
+            WHERE year = CAST(substr({row}.date, 1, 4) AS INTEGER) AND month = CAST(substr({row}.date, 6, 2) AS INTEGER)
+              AND license_plate = COALESCE({row}.license_plate, '') AND trip_type = {row}.trip_type
+              AND trip_count <= 0;
+        END
+    '''
+
+# (name, event, sign, row) of each trigger keeping trip_rollups current
+ROLLUP_TRIGGER_SPECS = (
+    ('trg_trips_rollup_insert', 'INSERT', '', 'NEW'),
+    ('trg_trips_rollup_delete', 'DELETE', '-', 'OLD'),
+    ('trg_trips_rollup_update_old', 'UPDATE', '-', 'OLD'),
+    ('trg_trips_rollup_update_new', 'UPDATE', '', 'NEW'),
+)
+
+ROLLUP_TRIGGERS = tuple(_rollup_trigger_sql(*spec) for spec in ROLLUP_TRIGGER_SPECS)
+
+ROLLUP_AGGREGATE_SQL = '''
+    SELECT CAST(substr(date, 1, 4) AS INTEGER), CAST(substr(date, 6, 2) AS INTEGER),
+           COALESCE(license_plate, ''), trip_type,
+           COUNT(*), SUM(COALESCE(distance_km, 0)), SUM(COALESCE(fuel_cost, 0)),
+           SUM(COALESCE(parking_cost, 0)), SUM(COALESCE(toll_cost, 0))
+    FROM trips
+    GROUP BY 1, 2, 3, 4
+'''
+
+# Free-text trip columns indexed for search, kept in sync by triggers on trips
+FTS_COLUMNS = ('start_location', 'end_location', 'purpose', 'client_project', 'notes')
+
+def _fts_values(row: str) -> str:
+    return ', '.join(f'{row}.{column}' for column in FTS_COLUMNS)
+
+FTS_TRIGGERS = (
+    f'''
+        CREATE TRIGGER IF NOT EXISTS trg_trips_fts_insert AFTER INSERT ON trips
+        BEGIN
+            INSERT INTO trips_fts (rowid, {', '.join(FTS_COLUMNS)}) VALUES (NEW.id, {_fts_values('NEW')});
+        END
+    ''',
+    f'''
+        CREATE TRIGGER IF NOT EXISTS trg_trips_fts_delete AFTER DELETE ON trips
+        BEGIN
+            INSERT INTO trips_fts (trips_fts, rowid, {', '.join(FTS_COLUMNS)}) VALUES ('delete', OLD.id, {_fts_values('OLD')});
+        END
+    ''',
+    f'''
+        CREATE TRIGGER IF NOT EXISTS trg_trips_fts_update AFTER UPDATE ON trips
+        BEGIN
+            INSERT INTO trips_fts (trips_fts, rowid, {', '.join(FTS_COLUMNS)}) VALUES ('delete', OLD.id, {_fts_values('OLD')});
+            INSERT INTO trips_fts (rowid, {', '.join(FTS_COLUMNS)}) VALUES (NEW.id, {_fts_values('NEW')});
+        END
+    ''',
+)
+
+def fts_query(text: str) -> str:
+    """Turn free text into an FTS5 query matching all words as prefixes"""
+    words = text.split()
+    return ' '.join('"' + word.replace('"', '""') + '"*' for word in words)
+
+def month_range(year: int, month: int) -> Tuple[str, str]:
+    """Get the half-open [start, end) date range covering a month"""
+    start = date(year, month, 1)
+    end = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+    return start.isoformat(), end.isoformat()
+
+def year_range(year: int) -> Tuple[str, str]:
+    """Get the half-open [start, end) date range covering a year"""
+    return date(year, 1, 1).isoformat(), date(year + 1, 1, 1).isoformat()
+
+def trip_filters(start: Optional[str] = None, end: Optional[str] = None,
+                 license_plate: Optional[str] = None, trip_type: Optional[str] = None) -> Tuple[str, tuple]:
+    """Build a WHERE clause over trips; `end` is exclusive so month/year ranges compose"""
+    clauses = []
+    params = []
+    if start:
+        clauses.append('date >= ?')
+        params.append(start)
+    if end:
+        clauses.append('date < ?')
+        params.append(end)
+    if license_plate:
+        clauses.append('license_plate = ?')
+        params.append(license_plate)
+    if trip_type:
+        clauses.append('trip_type = ?')
+        params.append(trip_type)
+    where = ('WHERE ' + ' AND '.join(clauses)) if clauses else ''
+    return where, tuple(params)
+
+def get_db_path():
+    """Get database path"""
+    return os.getenv("MILEWAY_DB_PATH", DEFAULT_DB_PATH)
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Connection that records per-statement latency and errors, and logs slow statements"""
+
+    def _timed(self, method, sql: str, parameters):
+        started = time.perf_counter()
+        try:
+            return method(sql, parameters)
+        except sqlite3.Error:
+            metrics.QUERY_ERRORS.inc(metrics.statement_kind(sql))
+            raise
+        finally:
+            metrics.observe_query(sql, time.perf_counter() - started)
+
+    def execute(self, sql: str, parameters=()):
+        return self._timed(super().execute, sql, parameters)
+
+    def executemany(self, sql: str, parameters):
+        return self._timed(super().executemany, sql, parameters)
+
+class ConnectionPool:
+    """Bounded pool of SQLite connections to a single database file"""
+
+    def __init__(self, db_path: str, size: int = DB_POOL_SIZE, timeout: float = DB_POOL_TIMEOUT):
+        self.db_path = db_path
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._opened = 0
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open a new connection and apply the tuned pragmas"""
+        started = time.perf_counter()
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.timeout,
+            check_same_thread=False,
+            cached_statements=DB_STATEMENT_CACHE_SIZE,
+            factory=InstrumentedConnection if metrics.METRICS_ENABLED else sqlite3.Connection
+        )
+        for name, value in PRAGMAS:
+            conn.execute(f'PRAGMA {name} = {value}')
+        metrics.DB_CONNECT_SECONDS.observe(time.perf_counter() - started)
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        """Borrow a connection, opening a new one while below the pool size"""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_open = self._opened < self.size
+            if can_open:
+                self._opened += 1
+        if can_open:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._opened -= 1
+                raise
+
+        started = time.perf_counter()
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise sqlite3.OperationalError(
+                f'Timed out waiting for a database connection ({self.size} in use)'
+            )
+        finally:
+            metrics.DB_POOL_WAIT_SECONDS.observe(time.perf_counter() - started)
+
+    def release(self, conn: sqlite3.Connection):
+        """Return a connection to the pool, or close it once the pool was closed"""
+        if conn.in_transaction:
+            conn.rollback()
+        if self._closed:
+            conn.close()
+            with self._lock:
+                self._opened -= 1
+            return
+        self._idle.put_nowait(conn)
+
+    def close(self):
+        """Close all idle connections; borrowed ones are closed when released"""
+        self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._opened -= 1
+
+# Database used by the current task or thread; None means the default database.
+# run() copies it into the executor thread along with the rest of the context.
+_current_database: contextvars.ContextVar = contextvars.ContextVar('mileway_database', default=None)
+
+def current_database() -> str:
+    """Path of the database that pooled work in this context goes to"""
+    return _current_database.get() or get_db_path()
+
+def use_database(db_path: Optional[str]) -> contextvars.Token:
+    """Direct this context's database work at another file (None for the default database)"""
+    return _current_database.set(db_path)
+
+def reset_database(token: contextvars.Token):
+    _current_database.reset(token)
+
+_pools: 'OrderedDict[str, ConnectionPool]' = OrderedDict()
+_pools_pid: Optional[int] = None
+_pool_lock = threading.Lock()
+# Held while a database's pool is opened and migrated, so a long migration of one
+# driver's file doesn't keep _pool_lock (and everyone else's sessions) waiting
+_open_locks: Dict[str, threading.Lock] = {}
+
+def _cached_pool(db_path: str) -> Optional[ConnectionPool]:
+    """The open pool for a database; call with _pool_lock held"""
+    global _pools_pid
+    # Connections must not be shared across forked worker processes
+    if _pools_pid != os.getpid():
+        _pools.clear()
+        _open_locks.clear()
+        _pools_pid = os.getpid()
+    pool = _pools.get(db_path)
+    if pool is not None:
+        _pools.move_to_end(db_path)
+    return pool
+
+def get_pool() -> ConnectionPool:
+    """Get the pool for the current database, creating and migrating it on first use"""
+    db_path = current_database()
+    with _pool_lock:
+        pool = _cached_pool(db_path)
+        if pool is not None:
+            return pool
+        open_lock = _open_locks.setdefault(db_path, threading.Lock())
+
+    with open_lock:
+        with _pool_lock:
+            # Opened by another thread while this one waited
+            pool = _cached_pool(db_path)
+        if pool is not None:
+            return pool
+
+        # A bare file name (relative to the working directory) has no directory to create
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        pool = ConnectionPool(db_path, DB_POOL_SIZE if db_path == get_db_path() else DB_USER_POOL_SIZE)
+        try:
+            conn = pool.acquire()
+            try:
+                migrate(conn)
+            finally:
+                pool.release(conn)
+        except BaseException:
+            pool.close()
+            raise
+
+        with _pool_lock:
+            _pools[db_path] = pool
+            _open_locks.pop(db_path, None)
+            while len(_pools) > DB_MAX_OPEN_DATABASES:
+                _, evicted = _pools.popitem(last=False)
+                evicted.close()
+        return pool
+
+def close_pool(db_path: Optional[str] = None):
+    """Close the pool for a database, e.g. before replacing the file"""
+    with _pool_lock:
+        pool = _pools.pop(db_path or current_database(), None) if _pools_pid == os.getpid() else None
+    if pool is not None:
+        pool.close()
+
+class PerDatabase:
+    """One lazily created object per database file, such as an in-memory cache
+
+    Like the pools, only the DB_MAX_OPEN_DATABASES most recently used are kept.
+    """
+
+    def __init__(self, factory: Callable[[], object]):
+        self._factory = factory
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self):
+        db_path = current_database()
+        with self._lock:
+            item = self._items.get(db_path)
+            if item is None:
+                item = self._items[db_path] = self._factory()
+                while len(self._items) > DB_MAX_OPEN_DATABASES:
+                    self._items.popitem(last=False)
+            else:
+                self._items.move_to_end(db_path)
+            return item
+
+    def discard(self):
+        with self._lock:
+            self._items.pop(current_database(), None)
+
+@contextmanager
+def connection():
+    """Borrow a pooled connection; commits on success and rolls back on error"""
+    pool = get_pool()
+    conn = pool.acquire()
+    try:
+        yield conn
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        pool.release(conn)
+
+@contextmanager
+def dedicated_connection():
+    """Open a connection of its own to the current database, outside its pool
+
+    For long reads such as streaming exports: a download can run for minutes and
+    must not keep one of the few pooled connections of a driver's database.
+    """
+    # Opens and migrates the database on first use, like any pooled access
+    conn = get_pool()._connect()
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_pid: Optional[int] = None
+
+def get_executor() -> ThreadPoolExecutor:
+    """Get the process-wide thread pool that runs database work"""
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        with _pool_lock:
+            if _executor is None or _executor_pid != os.getpid():
+                _executor = ThreadPoolExecutor(
+                    max_workers=DB_MAX_CONCURRENCY,
+                    thread_name_prefix='mileway-db'
+                )
+                _executor_pid = os.getpid()
+    return _executor
+
+def _run_in_connection(fn, args, kwargs):
+    with connection() as conn:
+        return fn(conn, *args, **kwargs)
+
+async def run(fn, *args, **kwargs):
+    """Run fn(conn, *args, **kwargs) on a pooled connection without blocking the event loop"""
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    result = await loop.run_in_executor(
+        get_executor(),
+        contextvars.copy_context().run,
+        functools.partial(_run_in_connection, fn, args, kwargs)
+    )
+    if metrics.METRICS_ENABLED:
+        operation = metrics.operation_name(fn)
+        metrics.DB_CALL_SECONDS.observe(time.perf_counter() - started, operation)
+        if isinstance(result, list):
+            metrics.DB_ROWS.observe(len(result), operation)
+    return result
+
+async def fetchone(sql: str, params=()):
+    """Run a query and return its first row"""
+    return await run(lambda conn: conn.execute(sql, params).fetchone())
+
+async def fetchall(sql: str, params=()):
+    """Run a query and return all rows"""
+    return await run(lambda conn: conn.execute(sql, params).fetchall())
+
+async def execute(sql: str, params=()) -> int:
+    """Run a write statement in its own transaction and return the last row id"""
+    return await run(lambda conn: conn.execute(sql, params).lastrowid)
+
+def _create_base_tables(conn: sqlite3.Connection):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS trips (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            date TEXT NOT NULL,
+            start_location TEXT NOT NULL,
+            end_location TEXT NOT NULL,
+            start_odometer INTEGER,
+            end_odometer INTEGER,
+            distance_km INTEGER,
+            purpose TEXT NOT NULL,
+            trip_type TEXT NOT NULL,
+            license_plate TEXT,
+            client_project TEXT,
+            notes TEXT,
+            fuel_cost REAL DEFAULT 0,
+            parking_cost REAL DEFAULT 0,
+            toll_cost REAL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS vehicles (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            license_plate TEXT UNIQUE NOT NULL,
+            brand TEXT,
+            model TEXT,
+            fuel_type TEXT DEFAULT 'Benzine',
+            lease_company TEXT,
+            active BOOLEAN DEFAULT 1,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS app_settings (
+            id INTEGER PRIMARY KEY,
+            webhook_url TEXT,
+            webhook_enabled BOOLEAN DEFAULT 0,
+            locale TEXT DEFAULT 'nl_NL',
+            currency TEXT DEFAULT 'EUR',
+            default_vehicle_id INTEGER,
+            mileage_rate REAL DEFAULT 0.23
+        )
+    ''')
+    conn.execute('INSERT OR IGNORE INTO app_settings (id, locale, currency, mileage_rate) VALUES (1, "nl_NL", "EUR", 0.23)')
+
+def _create_trip_indexes(conn: sqlite3.Connection):
+    for name, columns in TRIP_INDEXES:
+        conn.execute(f'CREATE INDEX IF NOT EXISTS {name} ON trips {columns}')
+
+def _create_webhook_outbox(conn: sqlite3.Connection):
+    # Written in the same transaction as the data it reports
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS webhook_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            url TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_webhook_outbox_due ON webhook_outbox (status, next_attempt_at)')
+
+def _create_trip_rollups(conn: sqlite3.Connection):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS trip_rollups (
+            year INTEGER NOT NULL,
+            month INTEGER NOT NULL,
+            license_plate TEXT NOT NULL,
+            trip_type TEXT NOT NULL,
+            trip_count INTEGER NOT NULL DEFAULT 0,
+            distance_km INTEGER NOT NULL DEFAULT 0,
+            fuel_cost REAL NOT NULL DEFAULT 0,
+            parking_cost REAL NOT NULL DEFAULT 0,
+            toll_cost REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (year, month, license_plate, trip_type)
+        ) WITHOUT ROWID
+    ''')
+    for trigger_sql in ROLLUP_TRIGGERS:
+        conn.execute(trigger_sql)
+    rebuild_rollups(conn)
+
+def _create_trips_fts(conn: sqlite3.Connection):
+    conn.execute(f'''
+        CREATE VIRTUAL TABLE IF NOT EXISTS trips_fts USING fts5(
+            {', '.join(FTS_COLUMNS)},
+            content='trips', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+        )
+    ''')
+    for trigger_sql in FTS_TRIGGERS:
+        conn.execute(trigger_sql)
+    conn.execute("INSERT INTO trips_fts (trips_fts) VALUES ('rebuild')")
+
+def _create_route_distances(conn: sqlite3.Connection):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS route_distances (
+            origin TEXT NOT NULL COLLATE NOCASE,
+            destination TEXT NOT NULL COLLATE NOCASE,
+            distance_km INTEGER NOT NULL,
+            trip_count INTEGER NOT NULL DEFAULT 0,
+            source TEXT NOT NULL DEFAULT 'learned',
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (origin, destination)
+        ) WITHOUT ROWID
+    ''')
+    # Imported here because routes builds on this module
+    from .routes import rebuild_routes
+    rebuild_routes(conn)
+
+# Tables whose writes bump config_generation, so cached copies can be revalidated cheaply
+CONFIG_TABLES = ('app_settings', 'vehicles')
+
+def _create_config_generation(conn: sqlite3.Connection):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS config_generation (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            generation INTEGER NOT NULL
+        )
+    ''')
+    conn.execute('INSERT OR IGNORE INTO config_generation (id, generation) VALUES (1, 0)')
+    for table in CONFIG_TABLES:
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_{event.lower()}_generation AFTER {event} ON {table}
+                BEGIN
+                    UPDATE config_generation SET generation = generation + 1 WHERE id = 1;
+                END
+            ''')
+
+def _add_trip_client_ids(conn: sqlite3.Connection):
+    # UUID a device gave a trip it captured offline, so re-sent batches don't duplicate it
+    conn.execute('ALTER TABLE trips ADD COLUMN client_id TEXT')
+    conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_trips_client_id ON trips (client_id) WHERE client_id IS NOT NULL')
+
+# Tables whose every insert, update and delete is appended to change_log
+CHANGE_LOG_TABLES = (('vehicles', 'vehicle'), ('trips', 'trip'))
+
+def _create_change_log(conn: sqlite3.Connection):
+    # AUTOINCREMENT so sequence numbers are never reused, even after the newest entry is deleted
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS change_log (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            entity TEXT NOT NULL,
+            entity_id INTEGER NOT NULL,
+            op TEXT NOT NULL,
+            changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    for table, entity in CHANGE_LOG_TABLES:
+        for event, row in (('INSERT', 'NEW'), ('UPDATE', 'NEW'), ('DELETE', 'OLD')):
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_{event.lower()}_change_log AFTER {event} ON {table}
+                BEGIN
+                    INSERT INTO change_log (entity, entity_id, op) VALUES ('{entity}', {row}.id, '{event.lower()}');
+                END
+            ''')
+    # Existing rows start the log, so a consumer reading from 0 sees everything
+    for table, entity in CHANGE_LOG_TABLES:
+        conn.execute(f"INSERT INTO change_log (entity, entity_id, op) SELECT '{entity}', id, 'insert' FROM {table} ORDER BY id")
+
+def _scope_rollup_cleanup(conn: sqlite3.Connection):
+    # The first rollup triggers swept the whole table for empty rows on every
+    # trip write; recreate them so they only look at the key they touched
+    for name, *_ in ROLLUP_TRIGGER_SPECS:
+        conn.execute(f'DROP TRIGGER IF EXISTS {name}')
+    for trigger_sql in ROLLUP_TRIGGERS:
+        conn.execute(trigger_sql)
+
+def _trim_trip_locations(conn: sqlite3.Connection):
+    # Trips saved from the form kept surrounding spaces, which route learning and
+    # suggestions (keyed on the trimmed name) never matched; store them trimmed
+    conn.execute('''
+        UPDATE trips SET start_location = trim(start_location), end_location = trim(end_location)
+        WHERE start_location != trim(start_location) OR end_location != trim(end_location)
+    ''')
+    from .routes import rebuild_routes
+    rebuild_routes(conn)
+
+# Schema migrations, applied in order. PRAGMA user_version records how many
+# have run, so append new steps and never reorder or edit released ones.
+# The early steps use IF NOT EXISTS so databases created before versioning
+# (user_version 0) are picked up without losing data.
+MIGRATIONS = (
+    _create_base_tables,
+    _create_trip_indexes,
+    _create_webhook_outbox,
+    _create_trip_rollups,
+    _create_trips_fts,
+    _create_route_distances,
+    _create_config_generation,
+    _add_trip_client_ids,
+    _create_change_log,
+    _scope_rollup_cleanup,
+    _trim_trip_locations,
+)
+
+def schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """Apply pending migrations in one transaction and return the schema version
+
+    When the schema is current this is a single pragma read.
+    """
+    if schema_version(conn) >= len(MIGRATIONS):
+        return schema_version(conn)
+    # Take the write lock up front so concurrent workers migrate one at a time
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        version = schema_version(conn)
+        for number in range(version, len(MIGRATIONS)):
+            MIGRATIONS[number](conn)
+            conn.execute(f'PRAGMA user_version = {number + 1}')
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    # Refresh planner statistics for new tables and indexes
+    conn.execute('PRAGMA optimize')
+    return len(MIGRATIONS)
+
+def init_db():
+    """Make sure the schema is current; cheap after the first call in a process"""
+    get_pool()
+
+def rebuild_rollups(conn: sqlite3.Connection):
+    """Recompute trip_rollups from scratch"""
+    conn.execute('DELETE FROM trip_rollups')
+    conn.execute(f'''
+        INSERT INTO trip_rollups (year, month, license_plate, trip_type, {', '.join(ROLLUP_COLUMNS)})
+        {ROLLUP_AGGREGATE_SQL}
+    ''')
+
+def verify_rollups(conn: sqlite3.Connection) -> list:
+    """Compare trip_rollups against a fresh aggregate and return the differing keys"""
+    expected = {tuple(row[:4]): row[4:] for row in conn.execute(ROLLUP_AGGREGATE_SQL)}
+    actual = {
+        tuple(row[:4]): row[4:]
+        for row in conn.execute(f'''
+            SELECT year, month, license_plate, trip_type, {', '.join(ROLLUP_COLUMNS)}
+            FROM trip_rollups
+        ''')
+    }
+    mismatches = []
+    for key in sorted(expected.keys() | actual.keys()):
+        want = expected.get(key)
+        got = actual.get(key)
+        # Costs are accumulated incrementally, so allow for float drift below a cent
+        if want is None or got is None or any(abs(w - g) >= 0.005 for w, g in zip(want, got)):
+            mismatches.append((key, want, got))
+    return mismatches
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Mileway database maintenance')
+    parser.add_argument('command', choices=['migrate', 'rebuild-rollups', 'verify-rollups'])
+    args = parser.parse_args()
+
+    with connection() as conn:
+        if args.command == 'migrate':
+            print(f'Schema at version {schema_version(conn)}')
+        elif args.command == 'rebuild-rollups':
+            rebuild_rollups(conn)
+            print('Rollups rebuilt')
+        else:
+            mismatches = verify_rollups(conn)
+            for key, want, got in mismatches:
+                print(f'{key}: expected {want}, found {got}')
+            print(f'{len(mismatches)} mismatching rollup rows')
+            raise SystemExit(1 if mismatches else 0)
@@ -0,0 +1,60 @@
+import csv
+import io
+from typing import Iterator
+
+from . import db
+
+# Rows fetched from SQLite per round trip while exporting
+EXPORT_FETCH_SIZE = 1000
+
+EXPORT_COLUMNS = (
+    'id', 'date', 'start_location', 'end_location', 'start_odometer', 'end_odometer',
+    'distance_km', 'purpose', 'trip_type', 'license_plate', 'client_project', 'notes',
+    'fuel_cost', 'parking_cost', 'toll_cost', 'reimbursement'
+)
+
+def iter_trip_chunks(where: str = '', params: tuple = ()) -> Iterator[list]:
+    """Yield trips matching the filter in (date, id) order, EXPORT_FETCH_SIZE rows at a time"""
+    # The client sets the pace, so the export reads on a connection outside the pool
+    with db.dedicated_connection() as conn:
+        row = conn.execute('SELECT mileage_rate FROM app_settings WHERE id = 1').fetchone()
+        mileage_rate = (row[0] if row else None) or 0.23
+        cursor = conn.execute(f'''
+            SELECT id, date, start_location, end_location, start_odometer, end_odometer,
+                   distance_km, purpose, trip_type, license_plate, client_project, notes,
+                   fuel_cost, parking_cost, toll_cost,
+                   CASE WHEN trip_type = 'zakelijk' THEN ROUND(distance_km * ?, 2) ELSE 0 END
+            FROM trips
+            {where}
+            ORDER BY date, id
+        ''', (mileage_rate,) + params)
+        while True:
+            rows = cursor.fetchmany(EXPORT_FETCH_SIZE)
+            if not rows:
+                break
+            yield rows
+
+def iter_csv(where: str = '', params: tuple = ()) -> Iterator[str]:
+    """Stream trips as CSV text, one chunk per fetched batch"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    yield buffer.getvalue()
+    for rows in iter_trip_chunks(where, params):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(rows)
+        yield buffer.getvalue()
+
+def write_xlsx(path: str, where: str = '', params: tuple = ()):
+    """Write trips to an XLSX file; needs the optional openpyxl package"""
+    from openpyxl import Workbook
+
+    # Write-only workbooks stream rows to disk instead of building the sheet in memory
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Ritten')
+    sheet.append(EXPORT_COLUMNS)
+    for rows in iter_trip_chunks(where, params):
+        for row in rows:
+            sheet.append(row)
+    workbook.save(path)
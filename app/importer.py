@@ -0,0 +1,137 @@
+import codecs
+import csv
+import json
+from typing import IO, Iterator, Optional
+
+from . import db, locations, routes
+from .validation import TRIP_TYPES, normalize_plate, parse_cost, parse_date, parse_distance
+
+# Rows written per executemany / transaction
+IMPORT_BATCH_SIZE = 5000
+# Per-row errors kept in the report; further errors are only counted
+IMPORT_MAX_ERRORS = 1000
+
+IMPORT_FORMATS = ('csv', 'json', 'ndjson')
+
+INSERT_TRIP_SQL = '''
+    INSERT INTO trips (date, start_location, end_location, start_odometer,
+                       end_odometer, distance_km, purpose, trip_type, license_plate,
+                       client_project, notes, fuel_cost, parking_cost, toll_cost)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+def iter_records(stream: IO[bytes], fmt: str) -> Iterator[dict]:
+    """Yield one dict per trip from a CSV, JSON array or NDJSON byte stream"""
+    if fmt == 'csv':
+        yield from csv.DictReader(codecs.getreader('utf-8-sig')(stream))
+    elif fmt == 'ndjson':
+        for line in codecs.getreader('utf-8')(stream):
+            if line.strip():
+                yield json.loads(line)
+    elif fmt == 'json':
+        # A JSON array has to be parsed whole; use NDJSON for very large imports
+        records = json.load(stream)
+        if not isinstance(records, list):
+            raise ValueError('JSON import must be an array of trips')
+        yield from records
+    else:
+        raise ValueError(f'Unknown import format: {fmt}')
+
+def validate_record(record: dict, plates: set) -> tuple:
+    """Turn an imported record into an INSERT_TRIP_SQL row, applying the trip form's rules"""
+    if not isinstance(record, dict):
+        raise ValueError('record must be an object')
+
+    def get(key):
+        value = record.get(key)
+        return '' if value is None else value
+
+    try:
+        trip_date = parse_date(get('date'))
+    except ValueError:
+        raise ValueError(f'invalid date: {get("date")!r}')
+
+    start_location = str(get('start_location')).strip()
+    end_location = str(get('end_location')).strip()
+    if not start_location or not end_location:
+        raise ValueError('start_location and end_location are required')
+
+    trip_type = str(get('trip_type')).strip() or 'zakelijk'
+    if trip_type not in TRIP_TYPES:
+        raise ValueError(f'invalid trip_type: {trip_type!r}')
+
+    license_plate = normalize_plate(get('license_plate'))
+    if license_plate and license_plate not in plates:
+        raise ValueError(f'unknown vehicle: {license_plate}')
+
+    try:
+        distance, start_odo, end_odo = parse_distance(
+            get('distance_km'), get('start_odometer'), get('end_odometer')
+        )
+    except (TypeError, ValueError):
+        # TypeError: JSON arrays and objects where a number belongs
+        raise ValueError('distance_km and odometer readings must be whole numbers')
+    try:
+        costs = tuple(parse_cost(get(name)) for name in ('fuel_cost', 'parking_cost', 'toll_cost'))
+    except (TypeError, ValueError):
+        raise ValueError('costs must be numbers')
+
+    return (trip_date, start_location, end_location, start_odo, end_odo, distance,
+            str(get('purpose')), trip_type, license_plate, str(get('client_project')),
+            str(get('notes'))) + costs
+
+def import_trips(stream: IO[bytes], fmt: str, batch_size: Optional[int] = None) -> dict:
+    """Validate and insert trips in batches; returns a report with per-row errors"""
+    batch_size = batch_size or IMPORT_BATCH_SIZE
+    with db.connection() as conn:
+        plates = {normalize_plate(row[0]) for row in conn.execute('SELECT license_plate FROM vehicles')}
+
+    report = {'imported': 0, 'failed': 0, 'errors': []}
+    batch = []
+
+    def flush():
+        with db.connection() as conn:
+            conn.executemany(INSERT_TRIP_SQL, batch)
+        report['imported'] += len(batch)
+        batch.clear()
+
+    row_number = 0
+    try:
+        for row_number, record in enumerate(iter_records(stream, fmt), start=1):
+            try:
+                batch.append(validate_record(record, plates))
+            except ValueError as e:
+                report['failed'] += 1
+                if len(report['errors']) < IMPORT_MAX_ERRORS:
+                    report['errors'].append({'row': row_number, 'error': str(e)})
+                continue
+            if len(batch) >= batch_size:
+                flush()
+    except (ValueError, csv.Error) as e:
+        # Malformed input stops the import; batches already written are kept
+        report['errors'].append({'row': row_number + 1, 'error': f'unreadable input: {e}'})
+    if batch:
+        flush()
+    if report['imported']:
+        # Relearn route distances and reload autocomplete once instead of per row
+        with db.connection() as conn:
+            routes.rebuild_routes(conn)
+        locations.reset_index()
+    return report
+
+if __name__ == '__main__':
+    import argparse
+    import os
+
+    parser = argparse.ArgumentParser(description='Import trips from CSV, JSON or NDJSON')
+    parser.add_argument('path')
+    parser.add_argument('--format', choices=IMPORT_FORMATS)
+    parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    fmt = args.format or os.path.splitext(args.path)[1].lstrip('.').lower()
+    if fmt not in IMPORT_FORMATS:
+        parser.error('cannot infer the format from the file name; pass --format')
+
+    with open(args.path, 'rb') as f:
+        print(json.dumps(import_trips(f, fmt, args.batch_size), indent=2))
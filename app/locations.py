@@ -0,0 +1,110 @@
+import bisect
+import os
+import threading
+from collections import OrderedDict
+from typing import List
+
+from . import db
+
+# Distinct locations kept in memory; the least recently used are evicted beyond this
+LOCATION_INDEX_SIZE = int(os.getenv("LOCATION_INDEX_SIZE", "5000"))
+LOCATION_SUGGESTIONS = 8
+
+class LocationIndex:
+    """Prefix index over known locations, ranked by frequency and recency
+
+    Keys are kept in a sorted list so a prefix lookup is a bisect plus a short
+    scan; usage stats live in an OrderedDict that doubles as the LRU order.
+    """
+
+    def __init__(self, max_entries: int = LOCATION_INDEX_SIZE):
+        self.max_entries = max_entries
+        self.loaded = False
+        self._stats = OrderedDict()  # name -> [count, last_date]
+        self._keys = []              # sorted (folded name, name)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._stats)
+
+    def add(self, name: str, last_date: str = "", count: int = 1):
+        """Record `count` uses of a location, most recently on `last_date`"""
+        name = name.strip()
+        if not name:
+            return
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                self._stats[name] = [count, last_date]
+                bisect.insort(self._keys, (name.casefold(), name))
+                while len(self._stats) > self.max_entries:
+                    evicted, _ = self._stats.popitem(last=False)
+                    key = (evicted.casefold(), evicted)
+                    del self._keys[bisect.bisect_left(self._keys, key)]
+            else:
+                stats[0] += count
+                stats[1] = max(stats[1], last_date)
+                self._stats.move_to_end(name)
+
+    def suggest(self, prefix: str, limit: int = LOCATION_SUGGESTIONS) -> List[str]:
+        """Known locations starting with `prefix`, most used and most recent first"""
+        folded = prefix.strip().casefold()
+        if not folded:
+            return []
+        with self._lock:
+            start = bisect.bisect_left(self._keys, (folded,))
+            matches = []
+            for key, name in self._keys[start:]:
+                if not key.startswith(folded):
+                    break
+                count, last_date = self._stats[name]
+                matches.append((count, last_date, name))
+        matches.sort(key=lambda m: (m[0], m[1]), reverse=True)
+        return [name for _, _, name in matches[:limit] if name != prefix]
+
+    def load(self, rows):
+        """Fill the index from (location, count, last_date) rows, oldest first so LRU order follows recency"""
+        for location, count, last_date in rows:
+            self.add(location, last_date or "", count)
+
+LOCATION_COUNTS_SQL = '''
+    SELECT location, COUNT(*), MAX(date) FROM (
+        SELECT start_location AS location, date FROM trips
+        UNION ALL
+        SELECT end_location, date FROM trips
+    )
+    GROUP BY location
+    ORDER BY MAX(date)
+'''
+
+_indexes = db.PerDatabase(LocationIndex)
+_load_lock = threading.Lock()
+
+def cached_index() -> LocationIndex:
+    """The current database's index, which may not be loaded yet"""
+    return _indexes.get()
+
+def fill(index: LocationIndex, rows):
+    """Load an index once, however many callers race to do it"""
+    with _load_lock:
+        if not index.loaded:
+            index.load(rows)
+            index.loaded = True
+
+def get_index(conn) -> LocationIndex:
+    """Get the current database's location index, loading it from `conn` on first use"""
+    index = _indexes.get()
+    if not index.loaded:
+        fill(index, conn.execute(LOCATION_COUNTS_SQL))
+    return index
+
+def reset_index():
+    """Drop the index so it is reloaded on next use, e.g. after a bulk import"""
+    _indexes.discard()
+
+async def get_index_async() -> LocationIndex:
+    """Get the location index without touching the database once it is loaded"""
+    index = _indexes.get()
+    if index.loaded:
+        return index
+    return await db.run(get_index)
@@ -0,0 +1,161 @@
+import bisect
+import functools
+import inspect
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Set METRICS_ENABLED=0 to skip instrumentation entirely
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"
+# Statements slower than this many milliseconds are logged with their SQL; 0 disables the log
+DB_SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", "0"))
+
+# Seconds, from half a millisecond (an indexed SQLite read) up to a slow webhook
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+ROW_BUCKETS = (0, 1, 10, 50, 100, 500, 1000, 5000, 10000, 50000)
+
+_registry: List['Metric'] = []
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+class Metric:
+    """A named metric with a fixed set of label names, rendered in Prometheus text format"""
+
+    kind = ''
+
+    def __init__(self, name: str, description: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self._values: Dict[tuple, object] = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _label_text(self, values: tuple, extra: str = '') -> str:
+        pairs = [f'{name}="{_escape(value)}"' for name, value in zip(self.labels, values)]
+        if extra:
+            pairs.append(extra)
+        return '{' + ','.join(pairs) + '}' if pairs else ''
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            items = sorted(self._values.items())
+            lines.extend(self._render_value(values, value) for values, value in items)
+        return lines
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *label_values, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def _render_value(self, values: tuple, value) -> str:
+        return f'{self.name}{self._label_text(values)} {value}'
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, description: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = buckets
+
+    def observe(self, value: float, *label_values):
+        # Per-bucket counts are kept non-cumulative so an observation is one increment
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(label_values)
+            if state is None:
+                state = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def _render_value(self, values: tuple, state) -> str:
+        counts, total, count = state
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+            cumulative += bucket_count
+            le = f'le="{bound}"'
+            lines.append(f'{self.name}_bucket{self._label_text(values, le)} {cumulative}')
+        lines.append(f'{self.name}_sum{self._label_text(values)} {total}')
+        lines.append(f'{self.name}_count{self._label_text(values)} {count}')
+        return '\n'.join(lines)
+
+HANDLER_SECONDS = Histogram('mileway_handler_seconds', 'State event handler latency', ('handler',))
+HANDLER_ERRORS = Counter('mileway_handler_errors_total', 'State event handlers that raised', ('handler',))
+QUERY_SECONDS = Histogram('mileway_db_query_seconds', 'SQL statement execution time', ('statement',))
+QUERY_ERRORS = Counter('mileway_db_query_errors_total', 'SQL statements that raised', ('statement',))
+SLOW_QUERIES = Counter('mileway_db_slow_queries_total', 'SQL statements slower than DB_SLOW_QUERY_MS', ('statement',))
+DB_CALL_SECONDS = Histogram('mileway_db_call_seconds', 'Database calls from the event loop, including queueing', ('operation',))
+DB_ROWS = Histogram('mileway_db_rows_returned', 'Rows returned by database calls', ('operation',), ROW_BUCKETS)
+DB_CONNECT_SECONDS = Histogram('mileway_db_connect_seconds', 'Time to open and configure a pooled connection')
+DB_POOL_WAIT_SECONDS = Histogram('mileway_db_pool_wait_seconds', 'Time spent waiting for a free pooled connection')
+WEBHOOK_SECONDS = Histogram('mileway_webhook_delivery_seconds', 'Webhook POST latency', ('outcome',))
+WEBHOOK_ENTRIES = Counter('mileway_webhook_entries_total', 'Webhook outbox entries by delivery outcome', ('outcome',))
+
+def statement_kind(sql: str) -> str:
+    """First keyword of a statement, lower-cased, as a low-cardinality label"""
+    head = sql.lstrip()[:10].split(None, 1)
+    return head[0].lower() if head else ''
+
+def observe_query(sql: str, elapsed: float):
+    """Record a statement's latency, and log it when it is slower than DB_SLOW_QUERY_MS"""
+    kind = statement_kind(sql)
+    QUERY_SECONDS.observe(elapsed, kind)
+    if DB_SLOW_QUERY_MS and elapsed * 1000 >= DB_SLOW_QUERY_MS:
+        SLOW_QUERIES.inc(kind)
+        logger.warning('Slow query (%.1f ms): %s', elapsed * 1000, ' '.join(sql.split()))
+
+def operation_name(fn) -> str:
+    """Label for a database call: the function, or the function a lambda was defined in"""
+    name = getattr(fn, '__qualname__', None) or getattr(fn, '__name__', 'unknown')
+    name = name.replace('.<locals>', '')
+    if name.endswith('.<lambda>'):
+        name = name[:-len('.<lambda>')]
+    return name
+
+def timed(fn):
+    """Record latency and errors of a State event handler under its name"""
+    if not METRICS_ENABLED:
+        return fn
+    name = fn.__name__
+
+    if inspect.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            except Exception:
+                HANDLER_ERRORS.inc(name)
+                raise
+            finally:
+                HANDLER_SECONDS.observe(time.perf_counter() - started, name)
+    else:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            except Exception:
+                HANDLER_ERRORS.inc(name)
+                raise
+            finally:
+                HANDLER_SECONDS.observe(time.perf_counter() - started, name)
+    return wrapper
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
@@ -1,80 +1,15 @@
 import reflex as rx
-import sqlite3
-import hashlib
-import os
 import requests
 import json
 from datetime import datetime, date, timedelta
-from typing import List, Optional
+from typing import Dict, List, Optional
 import asyncio
 
-# Database setup
-def init_db():
-    # Use data directory for database
-    db_path = os.path.join('/app/data', 'mileage.db')
-    os.makedirs('/app/data', exist_ok=True)
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    
-    # Create mileage trips table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS trips (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            date TEXT NOT NULL,
-            start_location TEXT NOT NULL,
-            end_location TEXT NOT NULL,
-            start_odometer INTEGER,
-            end_odometer INTEGER,
-            distance_km INTEGER,
-            purpose TEXT NOT NULL,
-            trip_type TEXT NOT NULL,
-            license_plate TEXT,
-            client_project TEXT,
-            notes TEXT,
-            fuel_cost REAL DEFAULT 0,
-            parking_cost REAL DEFAULT 0,
-            toll_cost REAL DEFAULT 0,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Create vehicles table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS vehicles (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            license_plate TEXT UNIQUE NOT NULL,
-            brand TEXT,
-            model TEXT,
-            fuel_type TEXT DEFAULT 'Benzine',
-            lease_company TEXT,
-            active BOOLEAN DEFAULT 1,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Create settings table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS app_settings (
-            id INTEGER PRIMARY KEY,
-            webhook_url TEXT,
-            webhook_enabled BOOLEAN DEFAULT 0,
-            locale TEXT DEFAULT 'nl_NL',
-            currency TEXT DEFAULT 'EUR',
-            default_vehicle_id INTEGER,
-            mileage_rate REAL DEFAULT 0.23
-        )
-    ''')
-    
-    # Insert default settings if not exists
-    cursor.execute('INSERT OR IGNORE INTO app_settings (id, locale, currency, mileage_rate) VALUES (1, "nl_NL", "EUR", 0.23)')
-    
-    conn.commit()
-    conn.close()
+from . import changes, metrics, odometer, routes, storage, summaries, users, webhooks
+from .api import api
+from .validation import TRIP_TYPES, parse_distance
 
-# Initialize database on startup
-init_db()
-
-# Dutch localization focused
+# Localization; nl_NL is the default and fills any gaps in other locales
 LOCALES = {
     'nl_NL': {
         'title': 'Kilometerregistratie',
@@ -129,12 +64,129 @@ LOCALES = {
         'lease_company': 'Leasemaatschappij',
         'summary': 'Overzicht',
         'export': 'Exporteren',
-        'monthly_overview': 'Maandoverzicht'
+        'monthly_overview': 'Maandoverzicht',
+        'select_vehicle': 'Selecteer voertuig',
+        'odometer_or_distance': 'Kilometerstand of afstand:',
+        'usual_distance': 'Gebruikelijke afstand',
+        'costs_optional': 'Kosten (optioneel):',
+        'business_km': 'Zakelijk km',
+        'private_commute': 'Privé / Woon-werk',
+        'reimbursement_suffix': 'vergoeding',
+        'search_placeholder': 'Zoeken op locatie, doel, klant of opmerking',
+        'load_more': 'Meer laden',
+        'show_newest': 'Nieuwste ritten tonen',
+        'existing_vehicles': 'Bestaande voertuigen:',
+        'close': 'Sluiten',
+        'language': 'Taal/Locale:',
+        'vehicle_added': 'Voertuig toegevoegd',
+        'saved_with_warnings': 'Rit opgeslagen, maar {warnings}',
+        'implausible_distance': '{distance} km wijkt sterk af van de gebruikelijke {expected} km voor deze route',
+        'odometer_rollback': 'eindstand {found} ligt onder beginstand {expected}',
+        'odometer_overlap': 'kilometerstand {found} overlapt met de vorige rit (eindstand {expected})',
+        'odometer_gap': '{missing} km ontbreekt tussen {expected} en {found}',
+        'offline_saved': 'Geen verbinding: rit op dit apparaat bewaard',
+        'offline_pending': '{count} rit(ten) wachten op verbinding',
+        'offline_failed': '{count} rit(ten) konden niet worden gesynchroniseerd'
+    },
+    'en_US': {
+        'title': 'Mileage Log',
+        'login': 'Log in',
+        'logout': 'Log out',
+        'username': 'Username',
+        'password': 'Password',
+        'date': 'Date',
+        'start_location': 'Start location',
+        'end_location': 'Destination',
+        'start_odometer': 'Start odometer',
+        'end_odometer': 'End odometer',
+        'distance_km': 'Distance (km)',
+        'purpose': 'Purpose of trip',
+        'trip_type': 'Trip type',
+        'license_plate': 'License plate',
+        'client_project': 'Client/Project',
+        'notes': 'Notes',
+        'fuel_cost': 'Fuel cost (€)',
+        'parking_cost': 'Parking cost (€)',
+        'toll_cost': 'Tolls/Vignettes (€)',
+        'add_trip': 'Add Trip',
+        'recent_trips': 'Recent Trips',
+        'vehicles': 'Vehicles',
+        'settings': 'Settings',
+        'webhook_url': 'Webhook URL',
+        'webhook_enabled': 'Webhook Enabled',
+        'mileage_rate': 'Mileage allowance (€)',
+        'save_settings': 'Save Settings',
+        'delete': 'Delete',
+        'edit': 'Edit',
+        'cancel': 'Cancel',
+        'save': 'Save',
+        'today': 'Today',
+        'this_week': 'This Week',
+        'this_month': 'This Month',
+        'invalid_login': 'Invalid credentials',
+        'trip_added': 'Trip added',
+        'trip_updated': 'Trip updated',
+        'trip_deleted': 'Trip deleted',
+        'settings_saved': 'Settings saved',
+        'total_km': 'Total km',
+        'total_cost': 'Total cost',
+        'reimbursement': 'Reimbursement',
+        'business': 'Business',
+        'private': 'Private',
+        'commute': 'Commute',
+        'add_vehicle': 'Add Vehicle',
+        'brand': 'Brand',
+        'model': 'Model',
+        'fuel_type': 'Fuel type',
+        'lease_company': 'Lease company',
+        'summary': 'Summary',
+        'export': 'Export',
+        'monthly_overview': 'Monthly Overview',
+        'select_vehicle': 'Select vehicle',
+        'odometer_or_distance': 'Odometer or distance:',
+        'usual_distance': 'Usual distance',
+        'costs_optional': 'Costs (optional):',
+        'business_km': 'Business km',
+        'private_commute': 'Private / Commute',
+        'reimbursement_suffix': 'reimbursement',
+        'search_placeholder': 'Search by location, purpose, client or notes',
+        'load_more': 'Load more',
+        'show_newest': 'Show newest trips',
+        'existing_vehicles': 'Existing vehicles:',
+        'close': 'Close',
+        'language': 'Language/Locale:',
+        'vehicle_added': 'Vehicle added',
+        'saved_with_warnings': 'Trip saved, but {warnings}',
+        'implausible_distance': '{distance} km is far from the usual {expected} km for this route',
+        'odometer_rollback': 'end reading {found} is below start reading {expected}',
+        'odometer_overlap': 'odometer {found} overlaps the previous trip (end reading {expected})',
+        'odometer_gap': '{missing} km missing between {expected} and {found}',
+        'offline_saved': 'No connection: trip kept on this device',
+        'offline_pending': '{count} trip(s) waiting for a connection',
+        'offline_failed': '{count} trip(s) could not be synced'
     }
 }
 
+DEFAULT_LOCALE = 'nl_NL'
+
+def compile_catalog(locales: dict, default: str = DEFAULT_LOCALE) -> Dict[str, Dict[str, str]]:
+    """Resolve every locale against the default once, so lookups never fall back at runtime"""
+    base = locales[default]
+    return {locale: {**base, **texts} for locale, texts in locales.items()}
+
+CATALOG = compile_catalog(LOCALES)
+
 FUEL_TYPES = ['Benzine', 'Diesel', 'Hybride', 'Elektrisch', 'LPG']
 
+# Number of trips fetched per page of the trip history
+TRIPS_PAGE_SIZE = 50
+# Pages kept in the state while scrolling back; older pages push the newest ones out
+TRIPS_WINDOW_PAGES = 4
+
+# Delay before typed input is sent to the server; autocomplete reacts a bit sooner
+INPUT_DEBOUNCE_MS = 400
+LOCATION_DEBOUNCE_MS = 200
+
 class Trip(rx.Base):
     id: int
     date: str
@@ -152,6 +204,21 @@ class Trip(rx.Base):
     parking_cost: float = 0.0
     toll_cost: float = 0.0
 
+class TripRow(rx.Base):
+    """The fields the trip list renders; notes and the cost split stay in the database"""
+    id: int
+    date: str
+    start_location: str
+    end_location: str
+    start_odometer: Optional[int] = None
+    end_odometer: Optional[int] = None
+    distance_km: int
+    purpose: str
+    trip_type: str
+    license_plate: str
+    client_project: str = ""
+    total_cost: float = 0.0
+
 class Vehicle(rx.Base):
     id: int
     license_plate: str
@@ -169,15 +236,69 @@ class AppSettings(rx.Base):
     default_vehicle_id: Optional[int] = None
     mileage_rate: float = 0.23
 
-def get_db_path():
-    """Get database path"""
-    return os.path.join('/app/data', 'mileage.db')
+def trip_from_row(row) -> Trip:
+    """Build a Trip from a row selected with TRIP_COLUMNS"""
+    return Trip(
+        id=row[0], date=row[1], start_location=row[2], end_location=row[3],
+        start_odometer=row[4], end_odometer=row[5], distance_km=row[6],
+        purpose=row[7], trip_type=row[8], license_plate=row[9] or "",
+        client_project=row[10] or "", notes=row[11] or "", fuel_cost=row[12] or 0.0,
+        parking_cost=row[13] or 0.0, toll_cost=row[14] or 0.0
+    )
+
+def trip_row_from_row(row) -> TripRow:
+    """Build a TripRow from a row selected with TRIP_ROW_COLUMNS"""
+    return TripRow(
+        id=row[0], date=row[1], start_location=row[2], end_location=row[3],
+        start_odometer=row[4], end_odometer=row[5], distance_km=row[6],
+        purpose=row[7], trip_type=row[8], license_plate=row[9] or "",
+        client_project=row[10] or "", total_cost=row[11] or 0.0
+    )
+
+def trip_row(trip: Trip) -> TripRow:
+    """Slim list row for a full trip"""
+    return TripRow(
+        id=trip.id, date=trip.date, start_location=trip.start_location,
+        end_location=trip.end_location, start_odometer=trip.start_odometer,
+        end_odometer=trip.end_odometer, distance_km=trip.distance_km,
+        purpose=trip.purpose, trip_type=trip.trip_type, license_plate=trip.license_plate,
+        client_project=trip.client_project,
+        total_cost=trip.fuel_cost + trip.parking_cost + trip.toll_cost
+    )
+
+class SummaryLine(rx.Base):
+    key: str
+    km: int = 0
+    fuel_cost: float = 0.0
+    parking_cost: float = 0.0
+    toll_cost: float = 0.0
+    total_cost: float = 0.0
+
+class MonthlySummary(rx.Base):
+    month: str = ""
+    total_km: int = 0
+    business_km: int = 0
+    private_km: int = 0
+    commute_km: int = 0
+    fuel_cost: float = 0.0
+    parking_cost: float = 0.0
+    toll_cost: float = 0.0
+    total_cost: float = 0.0
+    reimbursement: float = 0.0
+    by_type: List[SummaryLine] = []
+    by_vehicle: List[SummaryLine] = []
+
+def build_summary(month: str, rows, mileage_rate: float) -> MonthlySummary:
+    """Fold (trip_type, license_plate, km, fuel, parking, toll) rows into a summary"""
+    return MonthlySummary(month=month, **summaries.fold(rows, mileage_rate))
 
 class State(rx.State):
     # Authentication
     is_authenticated: bool = False
     username: str = ""
     password: str = ""
+    # Driver account of the session, None for the environment account; selects the database
+    _user_id: Optional[int] = None
     login_error: str = ""
     
     # Trip form
@@ -197,7 +318,18 @@ class State(rx.State):
     toll_cost: str = "0"
     
     # Data
-    trips: List[Trip] = []
+    trips: List[TripRow] = []
+    has_more_trips: bool = False
+    # Newer trips were dropped from the front of the window
+    has_newer_trips: bool = False
+    search_query: str = ""
+    # Search results fetched so far, including pages dropped from the window
+    _search_offset: int = 0
+    
+    # Location autocomplete
+    location_suggestions: List[str] = []
+    suggestion_field: str = ""
+    suggested_distance: int = 0
     vehicles: List[Vehicle] = []
     editing_id: Optional[int] = None
     
@@ -205,7 +337,6 @@ class State(rx.State):
     settings: AppSettings = AppSettings()
     show_settings: bool = False
     show_vehicles: bool = False
-    show_summary: bool = False
     
     # Vehicle form
     vehicle_license_plate: str = ""
@@ -219,62 +350,16 @@ class State(rx.State):
     message_type: str = ""
     
     # Summary data
-    monthly_km: int = 0
-    monthly_business_km: int = 0
-    monthly_reimbursement: float = 0.0
-    
-    # Computed vars for localized text
-    @rx.var
-    def app_title(self) -> str:
-        return LOCALES.get(self.settings.locale, LOCALES['nl_NL']).get('title', 'Kilometerregistratie')
-    
-    @rx.var
-    def login_text(self) -> str:
-        return LOCALES.get(self.settings.locale, LOCALES['nl_NL']).get('login', 'Inloggen')
-    
-    @rx.var
-    def logout_text(self) -> str:
-        return LOCALES.get(self.settings.locale, LOCALES['nl_NL']).get('logout', 'Uitloggen')
+    summary: MonthlySummary = MonthlySummary()
     
-    @rx.var
-    def username_text(self) -> str:
-        return LOCALES.get(self.settings.locale, LOCALES['nl_NL']).get('username', 'Gebruikersnaam')
-    
-    @rx.var
-    def password_text(self) -> str:
-        return LOCALES.get(self.settings.locale, LOCALES['nl_NL']).get('password', 'Wachtwoord')
-    
-    @rx.var
-    def vehicles_text(self) -> str:
-        return LOCALES.get(self.settings.locale, LOCALES['nl_NL']).get('vehicles', 'Voertuigen')
+    # Locale of the translation catalog; kept apart from settings so editing
+    # other settings doesn't recompute and resend the catalog
+    locale: str = DEFAULT_LOCALE
     
-    @rx.var
-    def settings_text(self) -> str:
-        return LOCALES.get(self.settings.locale, LOCALES['nl_NL']).get('settings', 'Instellingen')
-    
-    @rx.var
-    def add_trip_text(self) -> str:
-        return LOCALES.get(self.settings.locale, LOCALES['nl_NL']).get('add_trip', 'Rit Toevoegen')
-    
-    @rx.var
-    def edit_text(self) -> str:
-        return LOCALES.get(self.settings.locale, LOCALES['nl_NL']).get('edit', 'Bewerken')
-    
-    @rx.var
-    def recent_trips_text(self) -> str:
-        return LOCALES.get(self.settings.locale, LOCALES['nl_NL']).get('recent_trips', 'Recente Ritten')
-    
-    @rx.var
-    def save_text(self) -> str:
-        return LOCALES.get(self.settings.locale, LOCALES['nl_NL']).get('save', 'Opslaan')
-    
-    @rx.var
-    def cancel_text(self) -> str:
-        return LOCALES.get(self.settings.locale, LOCALES['nl_NL']).get('cancel', 'Annuleren')
-    
-    @rx.var
-    def delete_text(self) -> str:
-        return LOCALES.get(self.settings.locale, LOCALES['nl_NL']).get('delete', 'Verwijderen')
+    @rx.var(cache=True)
+    def t(self) -> Dict[str, str]:
+        """Translations for the active locale"""
+        return CATALOG.get(self.locale, CATALOG[DEFAULT_LOCALE])
     
     @rx.var
     def vehicle_options(self) -> List[str]:
@@ -283,11 +368,24 @@ class State(rx.State):
     
     def get_text(self, key: str) -> str:
         """Get localized text"""
-        return LOCALES.get(self.settings.locale, LOCALES['nl_NL']).get(key, key)
+        return CATALOG.get(self.locale, CATALOG[DEFAULT_LOCALE]).get(key, key)
+    
+    def _outbox_config(self):
+        """Hand the browser's offline outbox (assets/outbox.js) what it needs to sync on its own"""
+        texts = CATALOG.get(self.locale, CATALOG[DEFAULT_LOCALE])
+        config = {
+            'api_url': rx.config.get_config().api_url,
+            'token': users.issue_token(self._user_id),
+            'user': self.username,
+            'vehicles': {str(v.id): v.license_plate for v in self.vehicles},
+            'texts': {key: texts[key] for key in ('offline_saved', 'offline_pending', 'offline_failed')},
+        }
+        return rx.call_script(f'window.milewayOutbox && milewayOutbox.configure({json.dumps(config)})')
     
     def update_locale(self, locale: str):
         """Update locale setting"""
         self.settings.locale = locale
+        self.locale = locale
 
     def update_mileage_rate(self, rate: str):
         """Update mileage rate setting"""
@@ -304,38 +402,41 @@ class State(rx.State):
         """Update webhook enabled setting"""
         self.settings.webhook_enabled = enabled
     
+    @metrics.timed
     async def login(self):
-        """Authenticate user"""
-        expected_username = os.getenv("AUTH_USERNAME", "admin")
-        expected_password = os.getenv("AUTH_PASSWORD", "password123")
-        
-        password_hash = hashlib.sha256(self.password.encode()).hexdigest()
-        expected_hash = hashlib.sha256(expected_password.encode()).hexdigest()
-        
-        if self.username == expected_username and password_hash == expected_hash:
+        """Authenticate against the environment account or a driver account"""
+        account = await users.authenticate_async(self.username, self.password)
+        if account:
+            self._user_id = account.id
             self.is_authenticated = True
             self.login_error = ""
+            # Everything below reads the signed-in user's own database
+            users.use_account(account.id)
             await self.load_settings()
+            await storage.get().location_index()
             await self.load_vehicles()
             await self.load_trips()
             await self.calculate_monthly_summary()
+            return self._outbox_config()
         else:
             self.login_error = self.get_text("invalid_login")
     
     async def logout(self):
         """Logout user"""
         self.is_authenticated = False
+        self._user_id = None
         self.username = ""
         self.password = ""
         self.trips = []
         self.vehicles = []
+        # Trips still in the outbox keep the token they were captured with
+        return rx.call_script('window.milewayOutbox && milewayOutbox.configure(null)')
     
+    @metrics.timed
+    @users.scoped
     async def load_settings(self):
-        """Load app settings from database"""
-        conn = sqlite3.connect(get_db_path())
-        cursor = conn.cursor()
-        cursor.execute('SELECT webhook_url, webhook_enabled, locale, currency, default_vehicle_id, mileage_rate FROM app_settings WHERE id = 1')
-        row = cursor.fetchone()
+        """Load app settings, from the process-wide cache when it is fresh"""
+        row = (await storage.get().config()).settings
         if row:
             self.settings = AppSettings(
                 webhook_url=row[0] or "",
@@ -345,32 +446,25 @@ class State(rx.State):
                 default_vehicle_id=row[4],
                 mileage_rate=row[5] or 0.23
             )
-        conn.close()
+            self.locale = self.settings.locale
     
+    @metrics.timed
+    @users.scoped
     async def save_settings(self):
         """Save app settings to database"""
-        conn = sqlite3.connect(get_db_path())
-        cursor = conn.cursor()
-        cursor.execute('''
-            UPDATE app_settings 
-            SET webhook_url = ?, webhook_enabled = ?, locale = ?, currency = ?, 
-                default_vehicle_id = ?, mileage_rate = ?
-            WHERE id = 1
-        ''', (self.settings.webhook_url, self.settings.webhook_enabled, 
-              self.settings.locale, self.settings.currency,
-              self.settings.default_vehicle_id, self.settings.mileage_rate))
-        conn.commit()
-        conn.close()
-        self.show_message("Instellingen opgeslagen", "success")
+        await storage.get().save_settings((
+            self.settings.webhook_url, self.settings.webhook_enabled,
+            self.settings.locale, self.settings.currency,
+            self.settings.default_vehicle_id, self.settings.mileage_rate
+        ))
+        self.show_message(self.get_text("settings_saved"), "success")
         self.show_settings = False
     
+    @metrics.timed
+    @users.scoped
     async def load_vehicles(self):
-        """Load vehicles from database"""
-        conn = sqlite3.connect(get_db_path())
-        cursor = conn.cursor()
-        cursor.execute('SELECT id, license_plate, brand, model, fuel_type, lease_company, active FROM vehicles WHERE active = 1')
-        rows = cursor.fetchall()
-        conn.close()
+        """Load the active vehicles, from the process-wide cache when it is fresh"""
+        rows = (await storage.get().config()).vehicles
         
         self.vehicles = [
             Vehicle(
@@ -389,24 +483,23 @@ class State(rx.State):
             if default_vehicle:
                 self.selected_vehicle_id = str(default_vehicle.id)
     
+    @metrics.timed
+    @users.scoped
     async def add_vehicle(self):
         """Add new vehicle"""
         if not self.vehicle_license_plate or not self.vehicle_brand:
             return
         
-        conn = sqlite3.connect(get_db_path())
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO vehicles (license_plate, brand, model, fuel_type, lease_company)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (self.vehicle_license_plate.upper(), self.vehicle_brand, self.vehicle_model,
-              self.vehicle_fuel_type, self.vehicle_lease_company))
-        conn.commit()
-        conn.close()
+        await storage.get().add_vehicle((
+            self.vehicle_license_plate.upper(), self.vehicle_brand, self.vehicle_model,
+            self.vehicle_fuel_type, self.vehicle_lease_company
+        ))
+        changes.notify()
         
         self.clear_vehicle_form()
         await self.load_vehicles()
-        self.show_message("Voertuig toegevoegd", "success")
+        self.show_message(self.get_text("vehicle_added"), "success")
+        return self._outbox_config()
     
     def clear_vehicle_form(self):
         """Clear vehicle form"""
@@ -416,6 +509,44 @@ class State(rx.State):
         self.vehicle_fuel_type = "Benzine"
         self.vehicle_lease_company = ""
     
+    async def _suggest_locations(self, field: str, value: str):
+        setattr(self, field, value)
+        self.suggestion_field = field
+        index = await storage.get().location_index()
+        self.location_suggestions = index.suggest(value)
+    
+    @metrics.timed
+    @users.scoped
+    async def update_start_location(self, value: str):
+        """Set the start location and suggest known locations"""
+        await self._suggest_locations('start_location', value)
+    
+    @metrics.timed
+    @users.scoped
+    async def update_end_location(self, value: str):
+        """Set the end location and suggest known locations"""
+        await self._suggest_locations('end_location', value)
+    
+    @metrics.timed
+    @users.scoped
+    async def pick_location(self, name: str):
+        """Fill the field being typed with a suggested location"""
+        if self.suggestion_field in ('start_location', 'end_location'):
+            setattr(self, self.suggestion_field, name)
+        self.location_suggestions = []
+        await self.suggest_distance()
+    
+    @metrics.timed
+    @users.scoped
+    async def suggest_distance(self):
+        """Look up the usual distance for the entered route"""
+        self.suggested_distance = await storage.get().usual_distance(self.start_location, self.end_location) or 0
+    
+    def use_suggested_distance(self):
+        """Copy the usual route distance into the distance field"""
+        if self.suggested_distance:
+            self.distance_km = str(self.suggested_distance)
+    
     def calculate_distance(self):
         """Calculate distance from odometer readings"""
         try:
@@ -426,9 +557,13 @@ class State(rx.State):
         except ValueError:
             pass
     
+    @metrics.timed
+    @users.scoped
     async def add_trip(self):
         """Add new trip"""
-        if not self.trip_date or not self.start_location or not self.end_location:
+        # Stored trimmed like imported trips, so routes and suggestions match on the same key
+        start_location, end_location = self.start_location.strip(), self.end_location.strip()
+        if not self.trip_date or not start_location or not end_location:
             return
         
         # Get vehicle license plate
@@ -436,108 +571,158 @@ class State(rx.State):
         license_plate = vehicle.license_plate if vehicle else ""
         
         # Calculate distance if odometer readings are provided
-        distance = 0
-        start_odo = None
-        end_odo = None
-        
         try:
-            if self.distance_km:
-                distance = int(self.distance_km)
-            elif self.start_odometer and self.end_odometer:
-                start_odo = int(self.start_odometer)
-                end_odo = int(self.end_odometer)
-                distance = end_odo - start_odo if end_odo > start_odo else 0
+            distance, start_odo, end_odo = parse_distance(self.distance_km, self.start_odometer, self.end_odometer)
         except ValueError:
-            distance = 0
+            distance, start_odo, end_odo = 0, None, None
         
-        conn = sqlite3.connect(get_db_path())
-        cursor = conn.cursor()
+        trip = Trip(
+            id=self.editing_id or 0, date=self.trip_date, start_location=start_location,
+            end_location=end_location, start_odometer=start_odo, end_odometer=end_odo,
+            distance_km=distance, purpose=self.purpose, trip_type=self.trip_type,
+            license_plate=license_plate, client_project=self.client_project, notes=self.notes,
+            fuel_cost=float(self.fuel_cost or 0), parking_cost=float(self.parking_cost or 0),
+            toll_cost=float(self.toll_cost or 0)
+        )
         
-        if self.editing_id:
-            # Update existing trip
-            cursor.execute('''
-                UPDATE trips 
-                SET date = ?, start_location = ?, end_location = ?, start_odometer = ?,
-                    end_odometer = ?, distance_km = ?, purpose = ?, trip_type = ?,
-                    license_plate = ?, client_project = ?, notes = ?, fuel_cost = ?,
-                    parking_cost = ?, toll_cost = ?
-                WHERE id = ?
-            ''', (self.trip_date, self.start_location, self.end_location, start_odo,
-                  end_odo, distance, self.purpose, self.trip_type, license_plate,
-                  self.client_project, self.notes, float(self.fuel_cost or 0),
-                  float(self.parking_cost or 0), float(self.toll_cost or 0), self.editing_id))
-            self.show_message("Rit bijgewerkt", "success")
+        webhook_url = self.settings.webhook_url if self.settings.webhook_enabled else ""
+        mileage_rate = self.settings.mileage_rate
+        
+        values = (trip.date, trip.start_location, trip.end_location, trip.start_odometer,
+                  trip.end_odometer, trip.distance_km, trip.purpose, trip.trip_type,
+                  trip.license_plate, trip.client_project, trip.notes, trip.fuel_cost,
+                  trip.parking_cost, trip.toll_cost)
+        # Queue the webhook in the same transaction so it is sent exactly when the trip is saved
+        webhook = None
+        if webhook_url:
+            webhook = (webhook_url, lambda trip_id: webhooks.mileage_entry(trip_id, values, mileage_rate))
+        
+        repository = storage.get()
+        # Compare against the usual distance before this trip is learned into it
+        expected_distance = await repository.usual_distance(trip.start_location, trip.end_location)
+        odometer_issues = await repository.odometer_issues(
+            trip.license_plate, trip.date, trip.id or None, trip.start_odometer, trip.end_odometer
+        )
+        trip.id = await repository.save_trip(values, trip.id or None, webhook)
+        changes.notify()
+        # Edits too: a location typed while editing must be suggested from now on
+        index = await repository.location_index()
+        index.add(trip.start_location, trip.date)
+        index.add(trip.end_location, trip.date)
+        if webhook_url:
+            webhooks.notify()
+        
+        texts = CATALOG.get(self.locale, CATALOG[DEFAULT_LOCALE])
+        warnings = [odometer.describe(issue, texts) for issue in odometer_issues]
+        if routes.is_implausible(trip.distance_km, expected_distance):
+            warnings.append(texts['implausible_distance'].format(distance=trip.distance_km, expected=expected_distance))
+        
+        if warnings:
+            self.show_message(texts['saved_with_warnings'].format(warnings="; ".join(warnings)), "error")
+            self.editing_id = None
+        elif self.editing_id:
+            self.show_message(self.get_text("trip_updated"), "success")
             self.editing_id = None
         else:
-            # Insert new trip
-            cursor.execute('''
-                INSERT INTO trips (date, start_location, end_location, start_odometer,
-                                 end_odometer, distance_km, purpose, trip_type, license_plate,
-                                 client_project, notes, fuel_cost, parking_cost, toll_cost)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (self.trip_date, self.start_location, self.end_location, start_odo,
-                  end_odo, distance, self.purpose, self.trip_type, license_plate,
-                  self.client_project, self.notes, float(self.fuel_cost or 0),
-                  float(self.parking_cost or 0), float(self.toll_cost or 0)))
-            self.show_message("Rit toegevoegd", "success")
-        
-        conn.commit()
-        conn.close()
+            self.show_message(self.get_text("trip_added"), "success")
         
-        # Clear form and reload
+        # Clear form and patch the loaded list
         self.clear_trip_form()
-        await self.load_trips()
+        self._put_trip(trip_row(trip))
         await self.calculate_monthly_summary()
     
+    def _put_trip(self, trip: TripRow):
+        """Insert or replace a trip in the loaded list, keeping (date, id) descending order"""
+        if self.search_query.strip():
+            # Search results are ranked, not dated; only refresh a trip that is already shown
+            self.trips = [trip if t.id == trip.id else t for t in self.trips]
+            return
+        trips = [t for t in self.trips if t.id != trip.id]
+        key = (trip.date, trip.id)
+        index = next((i for i, t in enumerate(trips) if (t.date, t.id) < key), len(trips))
+        # Trips older than everything loaded belong to a page that hasn't been fetched yet,
+        # and trips newer than the window to pages that were dropped from it
+        if (index < len(trips) or not self.has_more_trips) and (index > 0 or not self.has_newer_trips):
+            trips.insert(index, trip)
+        self.trips = trips
+    
+    async def _fetch_trips_page(self, after: Optional[TripRow] = None) -> List[TripRow]:
+        """Fetch the page of trips that follows `after` in (date, id) order, newest first"""
+        # Fetch one extra row to learn whether another page exists
+        rows = await storage.get().trips_page(
+            None if after is None else (after.date, after.id), TRIPS_PAGE_SIZE + 1
+        )
+        
+        self.has_more_trips = len(rows) > TRIPS_PAGE_SIZE
+        return [trip_row_from_row(row) for row in rows[:TRIPS_PAGE_SIZE]]
+    
+    async def _search_trips_page(self, offset: int = 0) -> List[TripRow]:
+        """Fetch a page of trips matching search_query, best matches first"""
+        rows = await storage.get().search_trips(self.search_query, TRIPS_PAGE_SIZE + 1, offset)
+        
+        self.has_more_trips = len(rows) > TRIPS_PAGE_SIZE
+        self._search_offset = offset + min(len(rows), TRIPS_PAGE_SIZE)
+        return [trip_row_from_row(row) for row in rows[:TRIPS_PAGE_SIZE]]
+    
+    @metrics.timed
+    @users.scoped
     async def load_trips(self):
-        """Load recent trips"""
-        conn = sqlite3.connect(get_db_path())
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT id, date, start_location, end_location, start_odometer, end_odometer,
-                   distance_km, purpose, trip_type, license_plate, client_project, notes,
-                   fuel_cost, parking_cost, toll_cost
-            FROM trips 
-            ORDER BY date DESC, id DESC 
-            LIMIT 50
-        ''')
-        rows = cursor.fetchall()
-        conn.close()
+        """Load the first page of recent trips, or of search results while searching"""
+        self.has_newer_trips = False
+        if self.search_query.strip():
+            self.trips = await self._search_trips_page()
+        else:
+            self.trips = await self._fetch_trips_page()
+    
+    @metrics.timed
+    @users.scoped
+    async def load_more_trips(self):
+        """Append the next page of older trips or search results
         
-        self.trips = [
-            Trip(
-                id=row[0], date=row[1], start_location=row[2], end_location=row[3],
-                start_odometer=row[4], end_odometer=row[5], distance_km=row[6],
-                purpose=row[7], trip_type=row[8], license_plate=row[9],
-                client_project=row[10], notes=row[11], fuel_cost=row[12],
-                parking_cost=row[13], toll_cost=row[14]
-            ) for row in rows
-        ]
+        At most TRIPS_WINDOW_PAGES pages stay loaded, so the state and every
+        update sent to the browser keep the same size however far back one scrolls.
+        The next page only needs the oldest loaded trip (or the search offset).
+        """
+        if not self.trips:
+            await self.load_trips()
+            return
+        if self.search_query.strip():
+            page = await self._search_trips_page(offset=self._search_offset)
+        else:
+            page = await self._fetch_trips_page(after=self.trips[-1])
+        trips = self.trips + page
+        excess = len(trips) - TRIPS_WINDOW_PAGES * TRIPS_PAGE_SIZE
+        if excess > 0:
+            trips = trips[excess:]
+            self.has_newer_trips = True
+        self.trips = trips
     
+    @metrics.timed
+    @users.scoped
+    async def search_trips(self, query: str):
+        """Search locations, purpose, client/project and notes"""
+        self.search_query = query
+        await self.load_trips()
+    
+    @metrics.timed
+    @users.scoped
     async def calculate_monthly_summary(self):
         """Calculate monthly statistics"""
-        current_month = datetime.now().strftime('%Y-%m')
-        
-        conn = sqlite3.connect(get_db_path())
-        cursor = conn.cursor()
+        now = datetime.now()
         
-        # Total km this month
-        cursor.execute('SELECT SUM(distance_km) FROM trips WHERE date LIKE ?', (f'{current_month}%',))
-        self.monthly_km = cursor.fetchone()[0] or 0
+        # One row per type and vehicle for this month
+        rows = await storage.get().monthly_totals(now.year, now.month)
         
-        # Business km this month
-        cursor.execute('SELECT SUM(distance_km) FROM trips WHERE date LIKE ? AND trip_type = "zakelijk"', (f'{current_month}%',))
-        self.monthly_business_km = cursor.fetchone()[0] or 0
-        
-        # Calculate reimbursement
-        self.monthly_reimbursement = self.monthly_business_km * self.settings.mileage_rate
-        
-        conn.close()
+        self.summary = build_summary(now.strftime('%Y-%m'), rows, self.settings.mileage_rate)
     
+    @metrics.timed
+    @users.scoped
     async def edit_trip(self, trip_id: int):
         """Load trip for editing"""
-        trip = next((t for t in self.trips if t.id == trip_id), None)
-        if trip:
+        # The list only holds slim rows, so read the full trip
+        row = await storage.get().get_trip(trip_id)
+        if row:
+            trip = trip_from_row(row)
             self.editing_id = trip_id
             self.trip_date = trip.date
             self.start_location = trip.start_location
@@ -558,16 +743,18 @@ class State(rx.State):
             if vehicle:
                 self.selected_vehicle_id = str(vehicle.id)
     
+    @metrics.timed
+    @users.scoped
     async def delete_trip(self, trip_id: int):
         """Delete trip"""
-        conn = sqlite3.connect(get_db_path())
-        cursor = conn.cursor()
-        cursor.execute('DELETE FROM trips WHERE id = ?', (trip_id,))
-        conn.commit()
-        conn.close()
+        await storage.get().delete_trip(trip_id)
+        changes.notify()
         
-        self.show_message("Rit verwijderd", "success")
-        await self.load_trips()
+        self.show_message(self.get_text("trip_deleted"), "success")
+        if self.search_query.strip() and any(t.id == trip_id for t in self.trips):
+            # The remaining results move up one place
+            self._search_offset -= 1
+        self.trips = [t for t in self.trips if t.id != trip_id]
         await self.calculate_monthly_summary()
     
     def clear_trip_form(self):
@@ -585,6 +772,8 @@ class State(rx.State):
         self.parking_cost = "0"
         self.toll_cost = "0"
         self.editing_id = None
+        self.location_suggestions = []
+        self.suggested_distance = 0
     
     def show_message(self, text: str, msg_type: str = "info"):
         """Show message to user"""
@@ -600,20 +789,22 @@ def login_page() -> rx.Component:
     """Login page component"""
     return rx.container(
         rx.vstack(
-            rx.heading(State.app_title, size="9", text_align="center", color="#1a365d"),
+            rx.heading(State.t["title"], size="9", text_align="center", color="#1a365d"),
             rx.card(
                 rx.vstack(
                     rx.input(
-                        placeholder=State.username_text,
+                        placeholder=State.t["username"],
                         value=State.username,
                         on_change=State.set_username,
+                        debounce_timeout=INPUT_DEBOUNCE_MS,
                         width="100%"
                     ),
                     rx.input(
-                        placeholder=State.password_text,
+                        placeholder=State.t["password"],
                         type="password",
                         value=State.password,
                         on_change=State.set_password,
+                        debounce_timeout=INPUT_DEBOUNCE_MS,
                         width="100%"
                     ),
                     rx.cond(
@@ -621,7 +812,7 @@ def login_page() -> rx.Component:
                         rx.text(State.login_error, color="red", size="2")
                     ),
                     rx.button(
-                        State.login_text,
+                        State.t["login"],
                         on_click=State.login,
                         width="100%",
                         size="3",
@@ -649,8 +840,8 @@ def trip_form() -> rx.Component:
             rx.heading(
                 rx.cond(
                     State.editing_id,
-                    State.edit_text,
-                    State.add_trip_text
+                    State.t["edit"],
+                    State.t["add_trip"]
                 ),
                 size="6"
             ),
@@ -659,15 +850,20 @@ def trip_form() -> rx.Component:
             rx.flex(
                 rx.input(
                     type="date",
+                    id="trip-date",
                     value=State.trip_date,
                     on_change=State.set_trip_date,
-                    placeholder="Datum"
+                    placeholder=State.t["date"]
                 ),
-                rx.select(
-                    State.vehicle_options,
-                    value=State.selected_vehicle_id,
-                    on_change=State.set_selected_vehicle_id,
-                    placeholder="Selecteer voertuig"
+                # Wrapped so the offline outbox can read the selection
+                rx.box(
+                    rx.select(
+                        State.vehicle_options,
+                        value=State.selected_vehicle_id,
+                        on_change=State.set_selected_vehicle_id,
+                        placeholder=State.t["select_vehicle"]
+                    ),
+                    id="trip-vehicle"
                 ),
                 direction="column",
                 spacing="2",
@@ -677,14 +873,36 @@ def trip_form() -> rx.Component:
             # Locations
             rx.flex(
                 rx.input(
+                    id="trip-start-location",
                     value=State.start_location,
-                    on_change=State.set_start_location,
-                    placeholder="Vertreklocatie"
+                    on_change=State.update_start_location,
+                    debounce_timeout=LOCATION_DEBOUNCE_MS,
+                    on_blur=State.suggest_distance,
+                    placeholder=State.t["start_location"]
                 ),
                 rx.input(
+                    id="trip-end-location",
                     value=State.end_location,
-                    on_change=State.set_end_location,
-                    placeholder="Bestemmingslocatie"
+                    on_change=State.update_end_location,
+                    debounce_timeout=LOCATION_DEBOUNCE_MS,
+                    on_blur=State.suggest_distance,
+                    placeholder=State.t["end_location"]
+                ),
+                rx.cond(
+                    State.location_suggestions,
+                    rx.flex(
+                        rx.foreach(
+                            State.location_suggestions,
+                            lambda name: rx.badge(
+                                name,
+                                on_click=State.pick_location(name),
+                                variant="soft",
+                                cursor="pointer"
+                            )
+                        ),
+                        wrap="wrap",
+                        spacing="1"
+                    )
                 ),
                 direction="column",
                 spacing="2",
@@ -692,27 +910,42 @@ def trip_form() -> rx.Component:
             ),
             
             # Distance tracking
-            rx.text("Kilometerstand of afstand:", weight="bold", size="3"),
+            rx.text(State.t["odometer_or_distance"], weight="bold", size="3"),
             rx.flex(
                 rx.input(
                     type="number",
+                    id="trip-start-odometer",
                     value=State.start_odometer,
                     on_change=State.set_start_odometer,
+                    debounce_timeout=INPUT_DEBOUNCE_MS,
                     on_blur=State.calculate_distance,
-                    placeholder="Kilometerstand begin"
+                    placeholder=State.t["start_odometer"]
                 ),
                 rx.input(
                     type="number",
+                    id="trip-end-odometer",
                     value=State.end_odometer,
                     on_change=State.set_end_odometer,
+                    debounce_timeout=INPUT_DEBOUNCE_MS,
                     on_blur=State.calculate_distance,
-                    placeholder="Kilometerstand eind"
+                    placeholder=State.t["end_odometer"]
                 ),
                 rx.input(
                     type="number",
+                    id="trip-distance-km",
                     value=State.distance_km,
                     on_change=State.set_distance_km,
-                    placeholder="Afstand (km)"
+                    debounce_timeout=INPUT_DEBOUNCE_MS,
+                    placeholder=State.t["distance_km"]
+                ),
+                rx.cond(
+                    State.suggested_distance > 0,
+                    rx.button(
+                        State.t["usual_distance"], f": {State.suggested_distance} km",
+                        on_click=State.use_suggested_distance,
+                        variant="ghost",
+                        size="1"
+                    )
                 ),
                 direction="column",
                 spacing="2",
@@ -721,21 +954,28 @@ def trip_form() -> rx.Component:
             
             # Trip details
             rx.flex(
-                rx.select(
-                    ["zakelijk", "prive", "woon_werk"],
-                    value=State.trip_type,
-                    on_change=State.set_trip_type,
-                    placeholder="Type rit"
+                rx.box(
+                    rx.select(
+                        list(TRIP_TYPES),
+                        value=State.trip_type,
+                        on_change=State.set_trip_type,
+                        placeholder=State.t["trip_type"]
+                    ),
+                    id="trip-type"
                 ),
                 rx.input(
+                    id="trip-purpose",
                     value=State.purpose,
                     on_change=State.set_purpose,
-                    placeholder="Doel van de rit"
+                    debounce_timeout=INPUT_DEBOUNCE_MS,
+                    placeholder=State.t["purpose"]
                 ),
                 rx.input(
+                    id="trip-client-project",
                     value=State.client_project,
                     on_change=State.set_client_project,
-                    placeholder="Klant/Project"
+                    debounce_timeout=INPUT_DEBOUNCE_MS,
+                    placeholder=State.t["client_project"]
                 ),
                 direction="column",
                 spacing="2",
@@ -743,28 +983,34 @@ def trip_form() -> rx.Component:
             ),
             
             # Costs (optional)
-            rx.text("Kosten (optioneel):", weight="bold", size="3"),
+            rx.text(State.t["costs_optional"], weight="bold", size="3"),
             rx.flex(
                 rx.input(
                     type="number",
                     step="0.01",
+                    id="trip-fuel-cost",
                     value=State.fuel_cost,
                     on_change=State.set_fuel_cost,
-                    placeholder="Brandstofkosten (€)"
+                    debounce_timeout=INPUT_DEBOUNCE_MS,
+                    placeholder=State.t["fuel_cost"]
                 ),
                 rx.input(
                     type="number",
                     step="0.01",
+                    id="trip-parking-cost",
                     value=State.parking_cost,
                     on_change=State.set_parking_cost,
-                    placeholder="Parkeerkosten (€)"
+                    debounce_timeout=INPUT_DEBOUNCE_MS,
+                    placeholder=State.t["parking_cost"]
                 ),
                 rx.input(
                     type="number",
                     step="0.01",
+                    id="trip-toll-cost",
                     value=State.toll_cost,
                     on_change=State.set_toll_cost,
-                    placeholder="Tol/Vignetten (€)"
+                    debounce_timeout=INPUT_DEBOUNCE_MS,
+                    placeholder=State.t["toll_cost"]
                 ),
                 direction="column",
                 spacing="2",
@@ -773,16 +1019,19 @@ def trip_form() -> rx.Component:
             
             # Notes
             rx.text_area(
+                id="trip-notes",
                 value=State.notes,
                 on_change=State.set_notes,
-                placeholder="Opmerkingen",
+                debounce_timeout=INPUT_DEBOUNCE_MS,
+                placeholder=State.t["notes"],
                 rows="2"
             ),
             
             # Action buttons
             rx.flex(
                 rx.button(
-                    State.save_text,
+                    State.t["save"],
+                    id="trip-save",
                     on_click=State.add_trip,
                     size="3",
                     color_scheme="blue"
@@ -790,7 +1039,7 @@ def trip_form() -> rx.Component:
                 rx.cond(
                     State.editing_id,
                     rx.button(
-                        State.cancel_text,
+                        State.t["cancel"],
                         on_click=State.clear_trip_form,
                         variant="soft",
                         size="3"
@@ -809,13 +1058,33 @@ def monthly_summary() -> rx.Component:
     """Monthly summary component"""
     return rx.card(
         rx.vstack(
-            rx.heading("Maandoverzicht", size="6"),
+            rx.heading(State.t["monthly_overview"], size="6"),
             rx.flex(
                 rx.card(
                     rx.vstack(
-                        rx.text("Totaal km", weight="bold", size="3"),
-                        rx.text(f"{State.monthly_km} km", size="5", weight="bold", color="blue"),
-                        rx.text("Deze maand", size="2", color="gray"),
+                        rx.text(State.t["total_km"], weight="bold", size="3"),
+                        rx.text(f"{State.summary.total_km} km", size="5", weight="bold", color="blue"),
+                        rx.text(State.t["this_month"], size="2", color="gray"),
+                        spacing="1",
+                        align="center"
+                    ),
+                    size="2"
+                ),
+                rx.card(
+                    rx.vstack(
+                        rx.text(State.t["business_km"], weight="bold", size="3"),
+                        rx.text(f"{State.summary.business_km} km", size="5", weight="bold", color="green"),
+                        rx.text(f"€{State.summary.reimbursement:.2f} ", State.t["reimbursement_suffix"], size="2", color="gray"),
+                        spacing="1",
+                        align="center"
+                    ),
+                    size="2"
+                ),
+                rx.card(
+                    rx.vstack(
+                        rx.text(State.t["private_commute"], weight="bold", size="3"),
+                        rx.text(f"{State.summary.private_km} / {State.summary.commute_km} km", size="5", weight="bold", color="gray"),
+                        rx.text(State.t["this_month"], size="2", color="gray"),
                         spacing="1",
                         align="center"
                     ),
@@ -823,9 +1092,9 @@ def monthly_summary() -> rx.Component:
                 ),
                 rx.card(
                     rx.vstack(
-                        rx.text("Zakelijk km", weight="bold", size="3"),
-                        rx.text(f"{State.monthly_business_km} km", size="5", weight="bold", color="green"),
-                        rx.text(f"€{State.monthly_reimbursement:.2f} vergoeding", size="2", color="gray"),
+                        rx.text(State.t["total_cost"], weight="bold", size="3"),
+                        rx.text(f"€{State.summary.total_cost:.2f}", size="5", weight="bold", color="red"),
+                        rx.text(f"⛽ €{State.summary.fuel_cost:.2f} • 🅿️ €{State.summary.parking_cost:.2f} • 🛣️ €{State.summary.toll_cost:.2f}", size="2", color="gray"),
                         spacing="1",
                         align="center"
                     ),
@@ -835,6 +1104,17 @@ def monthly_summary() -> rx.Component:
                 width="100%",
                 wrap="wrap"
             ),
+            
+            # Per-vehicle breakdown
+            rx.foreach(
+                State.summary.by_vehicle,
+                lambda line: rx.flex(
+                    rx.text(rx.cond(line.key != "", f"🚗 {line.key}", "🚗 -"), size="2"),
+                    rx.text(f"{line.km} km • €{line.total_cost:.2f}", size="2", color="gray"),
+                    justify="between",
+                    width="100%"
+                )
+            ),
             spacing="3",
             width="100%"
         ),
@@ -845,7 +1125,23 @@ def trips_list() -> rx.Component:
     """Trips list component"""
     return rx.card(
         rx.vstack(
-            rx.heading(State.recent_trips_text, size="6"),
+            rx.heading(State.t["recent_trips"], size="6"),
+            rx.input(
+                value=State.search_query,
+                on_change=State.search_trips,
+                debounce_timeout=INPUT_DEBOUNCE_MS,
+                placeholder=State.t["search_placeholder"],
+                width="100%"
+            ),
+            rx.cond(
+                State.has_newer_trips,
+                rx.button(
+                    State.t["show_newest"],
+                    on_click=State.load_trips,
+                    variant="soft",
+                    width="100%"
+                )
+            ),
             rx.foreach(
                 State.trips,
                 lambda trip: rx.card(
@@ -888,18 +1184,18 @@ def trips_list() -> rx.Component:
                             rx.text(f"🔢 {trip.start_odometer} → {trip.end_odometer} km", size="2", color="gray")
                         ),
                         rx.cond(
-                            (trip.fuel_cost + trip.parking_cost + trip.toll_cost) > 0,
-                            rx.text(f"💰 €{trip.fuel_cost + trip.parking_cost + trip.toll_cost:.2f}", size="2", color="red")
+                            trip.total_cost > 0,
+                            rx.text(f"💰 €{trip.total_cost:.2f}", size="2", color="red")
                         ),
                         rx.flex(
                             rx.button(
-                                State.edit_text,
+                                State.t["edit"],
                                 on_click=lambda trip_id=trip.id: State.edit_trip(trip_id),
                                 variant="soft",
                                 size="1"
                             ),
                             rx.button(
-                                State.delete_text,
+                                State.t["delete"],
                                 on_click=lambda trip_id=trip.id: State.delete_trip(trip_id),
                                 variant="soft",
                                 color_scheme="red",
@@ -913,6 +1209,15 @@ def trips_list() -> rx.Component:
                     size="2"
                 )
             ),
+            rx.cond(
+                State.has_more_trips,
+                rx.button(
+                    State.t["load_more"],
+                    on_click=State.load_more_trips,
+                    variant="soft",
+                    width="100%"
+                )
+            ),
             spacing="3",
             width="100%"
         ),
@@ -923,28 +1228,31 @@ def vehicles_dialog() -> rx.Component:
     """Vehicles management dialog"""
     return rx.dialog.root(
         rx.dialog.trigger(
-            rx.button(State.vehicles_text, variant="soft")
+            rx.button(State.t["vehicles"], variant="soft")
         ),
         rx.dialog.content(
-            rx.dialog.title(State.vehicles_text),
+            rx.dialog.title(State.t["vehicles"]),
             rx.vstack(
                 # Add vehicle form
-                rx.text("Voertuig Toevoegen", weight="bold"),
+                rx.text(State.t["add_vehicle"], weight="bold"),
                 rx.input(
                     value=State.vehicle_license_plate,
                     on_change=State.set_vehicle_license_plate,
-                    placeholder="Kenteken"
+                    debounce_timeout=INPUT_DEBOUNCE_MS,
+                    placeholder=State.t["license_plate"]
                 ),
                 rx.flex(
                     rx.input(
                         value=State.vehicle_brand,
                         on_change=State.set_vehicle_brand,
-                        placeholder="Merk"
+                        debounce_timeout=INPUT_DEBOUNCE_MS,
+                        placeholder=State.t["brand"]
                     ),
                     rx.input(
                         value=State.vehicle_model,
                         on_change=State.set_vehicle_model,
-                        placeholder="Model"
+                        debounce_timeout=INPUT_DEBOUNCE_MS,
+                        placeholder=State.t["model"]
                     ),
                     spacing="2",
                     width="100%"
@@ -958,19 +1266,20 @@ def vehicles_dialog() -> rx.Component:
                     rx.input(
                         value=State.vehicle_lease_company,
                         on_change=State.set_vehicle_lease_company,
-                        placeholder="Leasemaatschappij"
+                        debounce_timeout=INPUT_DEBOUNCE_MS,
+                        placeholder=State.t["lease_company"]
                     ),
                     spacing="2",
                     width="100%"
                 ),
                 rx.button(
-                    "Voertuig Toevoegen",
+                    State.t["add_vehicle"],
                     on_click=State.add_vehicle
                 ),
                 
                 # Existing vehicles
                 rx.divider(),
-                rx.text("Bestaande voertuigen:", weight="bold"),
+                rx.text(State.t["existing_vehicles"], weight="bold"),
                 rx.foreach(
                     State.vehicles,
                     lambda vehicle: rx.card(
@@ -990,7 +1299,7 @@ def vehicles_dialog() -> rx.Component:
                 # Close button
                 rx.flex(
                     rx.dialog.close(
-                        rx.button("Sluiten", variant="soft")
+                        rx.button(State.t["close"], variant="soft")
                     ),
                     justify="end"
                 ),
@@ -1006,31 +1315,33 @@ def settings_dialog() -> rx.Component:
     """Settings dialog component"""
     return rx.dialog.root(
         rx.dialog.trigger(
-            rx.button(State.settings_text, variant="soft")
+            rx.button(State.t["settings"], variant="soft")
         ),
         rx.dialog.content(
-            rx.dialog.title(State.settings_text),
+            rx.dialog.title(State.t["settings"]),
             rx.vstack(
-                rx.text("Taal/Locale:"),
+                rx.text(State.t["language"]),
                 rx.select(
                     ["nl_NL", "en_US"],
                     value=State.settings.locale,
                     on_change=State.update_locale
                 ),
                 
-                rx.text("Kilometervergoeding (€)"),
+                rx.text(State.t["mileage_rate"]),
                 rx.input(
                     type="number",
                     step="0.01",
                     value=str(State.settings.mileage_rate),
                     on_change=State.update_mileage_rate,
+                    debounce_timeout=INPUT_DEBOUNCE_MS,
                     placeholder="0.23"
                 ),
                 
-                rx.text("Webhook URL"),
+                rx.text(State.t["webhook_url"]),
                 rx.input(
                     value=State.settings.webhook_url,
                     on_change=State.update_webhook_url,
+                    debounce_timeout=INPUT_DEBOUNCE_MS,
                     placeholder="https://your-webhook-url.com/webhook"
                 ),
                 
@@ -1039,18 +1350,18 @@ def settings_dialog() -> rx.Component:
                         checked=State.settings.webhook_enabled,
                         on_change=State.update_webhook_enabled
                     ),
-                    rx.text("Webhook Ingeschakeld"),
+                    rx.text(State.t["webhook_enabled"]),
                     spacing="2",
                     align="center"
                 ),
                 
                 rx.flex(
                     rx.dialog.close(
-                        rx.button(State.cancel_text, variant="soft")
+                        rx.button(State.t["cancel"], variant="soft")
                     ),
                     rx.dialog.close(
                         rx.button(
-                            "Instellingen Opslaan",
+                            State.t["save_settings"],
                             on_click=State.save_settings
                         )
                     ),
@@ -1071,12 +1382,12 @@ def main_app() -> rx.Component:
         rx.vstack(
             # Header
             rx.flex(
-                rx.heading(f"🚗 {State.app_title}", size="7", color="#1a365d"),
+                rx.heading("🚗 ", State.t["title"], size="7", color="#1a365d"),
                 rx.flex(
                     vehicles_dialog(),
                     settings_dialog(),
                     rx.button(
-                        State.logout_text,
+                        State.t["logout"],
                         on_click=State.logout,
                         variant="soft"
                     ),
@@ -1130,9 +1441,18 @@ def index() -> rx.Component:
     )
 
 app = rx.App(
+    # Keeps trips entered without a connection and syncs them through /api/sync/trips
+    head_components=[rx.script(src="/outbox.js")],
     stylesheets=[
         "https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600;700&display=swap"
-    ]
+    ],
+    # Plain HTTP endpoints (exports) served next to the Reflex backend
+    api_transformer=api
 )
 
+# Migrate when the server starts rather than at import, so builds and tooling stay DDL-free
+app.register_lifespan_task(storage.migrate)
+# Deliver queued webhooks in the background for the lifetime of the backend
+app.register_lifespan_task(webhooks.run_worker)
+
 app.add_page(index, route="/", title="Kilometerregistratie PWA")
\ No newline at end of file
@@ -0,0 +1,109 @@
+from typing import Iterator, List, Optional
+
+from . import db
+
+# Sorts after every real rowid, so a trip that isn't saved yet is placed last on its date
+UNSAVED_ID = 2 ** 63 - 1
+
+def new_issue(kind: str, license_plate: str, trip_id: Optional[int], date: str,
+              expected: Optional[int], found: Optional[int]) -> dict:
+    return {
+        'kind': kind,
+        'license_plate': license_plate,
+        'trip_id': trip_id,
+        'date': date,
+        'expected': expected,
+        'found': found,
+    }
+
+def link_readings(license_plate: str, trip_id: Optional[int], date: str,
+                  previous_end: int, start: int) -> Optional[dict]:
+    """Compare a trip's start reading with the end reading of the trip before it"""
+    if start == previous_end:
+        return None
+    kind = 'overlap' if start < previous_end else 'gap'
+    return new_issue(kind, license_plate, trip_id, date, previous_end, start)
+
+def check_trip(conn, license_plate: str, date: str, trip_id: Optional[int],
+               start_odometer: Optional[int], end_odometer: Optional[int]) -> List[dict]:
+    """Check a trip against its neighbours for the same vehicle
+
+    Both neighbours are single (license_plate, date, id) index seeks, so this
+    stays O(log n) however long the vehicle's history is.
+    """
+    if not license_plate or (start_odometer is None and end_odometer is None):
+        return []
+    issues = []
+    # The stored row of a trip being edited may still sit at its old date; `id != ?` skips it
+    position = (license_plate, date, trip_id or UNSAVED_ID)
+
+    if start_odometer is not None and end_odometer is not None and end_odometer < start_odometer:
+        issues.append(new_issue('rollback', license_plate, trip_id, date, start_odometer, end_odometer))
+
+    if start_odometer is not None:
+        previous = conn.execute('''
+            SELECT end_odometer FROM trips
+            WHERE license_plate = ? AND (date, id) < (?, ?) AND id != ? AND end_odometer IS NOT NULL
+            ORDER BY date DESC, id DESC
+            LIMIT 1
+        ''', position + (position[2],)).fetchone()
+        if previous:
+            issue = link_readings(license_plate, trip_id, date, previous[0], start_odometer)
+            if issue:
+                issues.append(issue)
+
+    if end_odometer is not None:
+        following = conn.execute('''
+            SELECT id, date, start_odometer FROM trips
+            WHERE license_plate = ? AND (date, id) > (?, ?) AND id != ? AND start_odometer IS NOT NULL
+            ORDER BY date, id
+            LIMIT 1
+        ''', position + (position[2],)).fetchone()
+        if following:
+            issue = link_readings(license_plate, following[0], following[1], end_odometer, following[2])
+            if issue:
+                issues.append(issue)
+    return issues
+
+def iter_report(conn, license_plate: Optional[str] = None) -> Iterator[dict]:
+    """Walk every vehicle's history once, yielding gaps, overlaps and rollbacks in order"""
+    where = 'WHERE license_plate = ?' if license_plate else "WHERE license_plate IS NOT NULL AND license_plate != ''"
+    rows = conn.execute(f'''
+        SELECT license_plate, id, date, start_odometer, end_odometer FROM trips
+        {where} AND (start_odometer IS NOT NULL OR end_odometer IS NOT NULL)
+        ORDER BY license_plate, date, id
+    ''', (license_plate,) if license_plate else ())
+
+    current_plate = None
+    previous_end = None
+    for plate, trip_id, date, start, end in rows:
+        if plate != current_plate:
+            current_plate = plate
+            previous_end = None
+        if start is not None and end is not None and end < start:
+            yield new_issue('rollback', plate, trip_id, date, start, end)
+        if start is not None and previous_end is not None:
+            issue = link_readings(plate, trip_id, date, previous_end, start)
+            if issue:
+                yield issue
+        if end is not None:
+            previous_end = end
+
+def describe(issue: dict, texts: dict) -> str:
+    """Short description of an issue for the trip form, using odometer_* catalog entries"""
+    template = texts[f"odometer_{issue['kind']}"]
+    found, expected = issue['found'], issue['expected']
+    return template.format(found=found, expected=expected, missing=found - expected)
+
+if __name__ == '__main__':
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description='Report odometer gaps, overlaps and rollbacks')
+    parser.add_argument('--license-plate')
+    args = parser.parse_args()
+
+    with db.connection() as conn:
+        plate = args.license_plate.upper() if args.license_plate else None
+        for issue in iter_report(conn, plate):
+            print(json.dumps(issue))
@@ -0,0 +1,594 @@
+import asyncio
+import json
+import os
+import re
+import time
+from datetime import date
+from typing import List, Optional, Tuple
+
+from . import db, locations, metrics, odometer, settings_cache, users, webhooks
+from .settings_cache import SETTINGS_COLUMNS, VEHICLE_COLUMNS
+from .storage import TRIP_VALUE_COLUMNS, BatchWebhook, Repository, Webhook
+
+# Pool configuration (overridable through the environment)
+PG_POOL_MIN_SIZE = int(os.getenv("PG_POOL_MIN_SIZE", "2"))
+PG_POOL_SIZE = int(os.getenv("PG_POOL_SIZE", "10"))
+PG_COMMAND_TIMEOUT = float(os.getenv("PG_COMMAND_TIMEOUT", "30"))
+
+# Same columns as storage.TRIP_COLUMNS / TRIP_ROW_COLUMNS, with the DATE column as ISO text
+PG_TRIP_COLUMNS = '''
+    id, to_char(date, 'YYYY-MM-DD'), start_location, end_location, start_odometer, end_odometer,
+    distance_km, purpose, trip_type, license_plate, client_project, notes,
+    fuel_cost, parking_cost, toll_cost
+'''
+
+PG_TRIP_ROW_COLUMNS = '''
+    id, to_char(date, 'YYYY-MM-DD'), start_location, end_location, start_odometer, end_odometer,
+    distance_km, purpose, trip_type, license_plate, client_project,
+    COALESCE(fuel_cost, 0) + COALESCE(parking_cost, 0) + COALESCE(toll_cost, 0)
+'''
+
+# One shared schema; every row carries the user it belongs to (0 for the environment
+# account), and every index leads with user_id so queries stay per-user range scans.
+# Append new steps and never edit released ones, as with db.MIGRATIONS.
+MIGRATIONS = (
+    '''
+    CREATE TABLE IF NOT EXISTS trips (
+        id BIGSERIAL PRIMARY KEY,
+        user_id INTEGER NOT NULL DEFAULT 0,
+        date DATE NOT NULL,
+        start_location TEXT NOT NULL,
+        end_location TEXT NOT NULL,
+        start_odometer INTEGER,
+        end_odometer INTEGER,
+        distance_km INTEGER,
+        purpose TEXT NOT NULL,
+        trip_type TEXT NOT NULL,
+        license_plate TEXT,
+        client_project TEXT,
+        notes TEXT,
+        fuel_cost DOUBLE PRECISION DEFAULT 0,
+        parking_cost DOUBLE PRECISION DEFAULT 0,
+        toll_cost DOUBLE PRECISION DEFAULT 0,
+        created_at TIMESTAMPTZ DEFAULT now(),
+        search TSVECTOR GENERATED ALWAYS AS (to_tsvector('simple',
+            coalesce(start_location, '') || ' ' || coalesce(end_location, '') || ' ' ||
+            coalesce(purpose, '') || ' ' || coalesce(client_project, '') || ' ' ||
+            coalesce(notes, ''))) STORED
+    );
+    CREATE INDEX IF NOT EXISTS idx_trips_user_date_id ON trips (user_id, date, id);
+    CREATE INDEX IF NOT EXISTS idx_trips_user_plate_date ON trips (user_id, license_plate, date, id);
+    CREATE INDEX IF NOT EXISTS idx_trips_user_route ON trips (user_id, lower(start_location), lower(end_location));
+    CREATE INDEX IF NOT EXISTS idx_trips_search ON trips USING GIN (search);
+
+    CREATE TABLE IF NOT EXISTS vehicles (
+        id BIGSERIAL PRIMARY KEY,
+        user_id INTEGER NOT NULL DEFAULT 0,
+        license_plate TEXT NOT NULL,
+        brand TEXT,
+        model TEXT,
+        fuel_type TEXT DEFAULT 'Benzine',
+        lease_company TEXT,
+        active BOOLEAN DEFAULT TRUE,
+        created_at TIMESTAMPTZ DEFAULT now(),
+        UNIQUE (user_id, license_plate)
+    );
+
+    CREATE TABLE IF NOT EXISTS app_settings (
+        user_id INTEGER PRIMARY KEY,
+        webhook_url TEXT,
+        webhook_enabled BOOLEAN DEFAULT FALSE,
+        locale TEXT DEFAULT 'nl_NL',
+        currency TEXT DEFAULT 'EUR',
+        default_vehicle_id BIGINT,
+        mileage_rate DOUBLE PRECISION DEFAULT 0.23,
+        generation BIGINT NOT NULL DEFAULT 0
+    );
+
+    CREATE TABLE IF NOT EXISTS webhook_outbox (
+        id BIGSERIAL PRIMARY KEY,
+        user_id INTEGER NOT NULL DEFAULT 0,
+        url TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at DOUBLE PRECISION NOT NULL,
+        last_error TEXT,
+        created_at TIMESTAMPTZ DEFAULT now()
+    );
+    CREATE INDEX IF NOT EXISTS idx_webhook_outbox_due ON webhook_outbox (status, next_attempt_at);
+    ''',
+    '''
+    ALTER TABLE trips ADD COLUMN IF NOT EXISTS client_id TEXT;
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_trips_user_client_id ON trips (user_id, client_id)
+        WHERE client_id IS NOT NULL;
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS change_log (
+        seq BIGSERIAL PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        entity TEXT NOT NULL,
+        entity_id BIGINT NOT NULL,
+        op TEXT NOT NULL,
+        changed_at TIMESTAMPTZ DEFAULT now()
+    );
+    CREATE INDEX IF NOT EXISTS idx_change_log_user_seq ON change_log (user_id, seq);
+
+    -- Sequence values are handed out before commit, so a reader could see seq 11
+    -- while 10 is still uncommitted and skip it for good. Writers of one user
+    -- therefore take a transaction lock first, making seq order commit order.
+    CREATE OR REPLACE FUNCTION mileway_log_change() RETURNS trigger AS $$
+    DECLARE
+        row_user INTEGER;
+        row_id BIGINT;
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            row_user := OLD.user_id;
+            row_id := OLD.id;
+        ELSE
+            row_user := NEW.user_id;
+            row_id := NEW.id;
+        END IF;
+        PERFORM pg_advisory_xact_lock(1835625573, row_user);
+        INSERT INTO change_log (user_id, entity, entity_id, op)
+        VALUES (row_user, TG_ARGV[0], row_id, lower(TG_OP));
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql;
+
+    CREATE TRIGGER trg_trips_change_log AFTER INSERT OR UPDATE OR DELETE ON trips
+        FOR EACH ROW EXECUTE FUNCTION mileway_log_change('trip');
+    CREATE TRIGGER trg_vehicles_change_log AFTER INSERT OR UPDATE OR DELETE ON vehicles
+        FOR EACH ROW EXECUTE FUNCTION mileway_log_change('vehicle');
+
+    INSERT INTO change_log (user_id, entity, entity_id, op)
+    SELECT user_id, 'vehicle', id, 'insert' FROM vehicles ORDER BY id;
+    INSERT INTO change_log (user_id, entity, entity_id, op)
+    SELECT user_id, 'trip', id, 'insert' FROM trips ORDER BY id;
+    ''',
+    # Trips saved from the form kept surrounding spaces; the SQLite files trim them too
+    '''
+    UPDATE trips SET start_location = btrim(start_location), end_location = btrim(end_location)
+    WHERE start_location != btrim(start_location) OR end_location != btrim(end_location);
+    ''',
+)
+
+# Serializes migrations across backend workers starting at the same time
+MIGRATION_LOCK_ID = 0x6d696c65
+
+def _dsn(url: str) -> str:
+    """asyncpg wants a plain postgresql:// URL; accept SQLAlchemy-style driver suffixes too"""
+    return re.sub(r'^postgres(ql)?(\+\w+)?://', 'postgresql://', url)
+
+async def _query(conn, method: str, sql: str, *args):
+    """Run one statement through asyncpg, recording it like db's SQLite statements"""
+    started = time.perf_counter()
+    try:
+        return await getattr(conn, method)(sql, *args)
+    except Exception:
+        metrics.QUERY_ERRORS.inc(metrics.statement_kind(sql))
+        raise
+    finally:
+        metrics.observe_query(sql, time.perf_counter() - started)
+
+def _tsquery(text: str) -> str:
+    """Prefix-match every word, like db.fts_query does for FTS5"""
+    return ' & '.join(f'{word}:*' for word in re.findall(r'\w+', text.lower()))
+
+async def migrate(conn) -> int:
+    async with conn.transaction():
+        await conn.execute('SELECT pg_advisory_xact_lock($1)', MIGRATION_LOCK_ID)
+        await conn.execute('CREATE TABLE IF NOT EXISTS mileway_schema (version INTEGER NOT NULL)')
+        version = await conn.fetchval('SELECT version FROM mileway_schema')
+        if version is None:
+            await conn.execute('INSERT INTO mileway_schema (version) VALUES (0)')
+            version = 0
+        for number in range(version, len(MIGRATIONS)):
+            await conn.execute(MIGRATIONS[number])
+            await conn.execute('UPDATE mileway_schema SET version = $1', number + 1)
+    return len(MIGRATIONS)
+
+class PostgresRepository(Repository):
+    """PostgreSQL storage with an asyncpg pool; summaries are aggregated by the server"""
+
+    name = 'postgres'
+
+    def __init__(self, url: str):
+        try:
+            import asyncpg
+        except ImportError:
+            raise RuntimeError('A PostgreSQL db_url requires the asyncpg package')
+        self._asyncpg = asyncpg
+        self._dsn = _dsn(url)
+        self._pool_task: Optional[asyncio.Task] = None
+        self._pool_loop = None
+        self._pool_pid: Optional[int] = None
+
+    async def _create_pool(self):
+        pool = await self._asyncpg.create_pool(
+            self._dsn, min_size=PG_POOL_MIN_SIZE, max_size=PG_POOL_SIZE,
+            command_timeout=PG_COMMAND_TIMEOUT
+        )
+        async with pool.acquire() as conn:
+            await migrate(conn)
+        return pool
+
+    async def _pool(self):
+        """The pool of this process and event loop, created and migrated on first use"""
+        loop = asyncio.get_running_loop()
+        # asyncpg pools are bound to the loop they were created on
+        if self._pool_loop is not loop or self._pool_pid != os.getpid():
+            self._pool_loop = loop
+            self._pool_pid = os.getpid()
+            self._pool_task = loop.create_task(self._create_pool())
+        try:
+            return await asyncio.shield(self._pool_task)
+        except Exception:
+            self._pool_loop = None
+            raise
+
+    async def migrate(self):
+        await self._pool()
+
+    @staticmethod
+    def _user() -> int:
+        return users.current_user_id() or 0
+
+    async def _load_config(self, conn, user_id: int) -> settings_cache.Snapshot:
+        async with conn.transaction(isolation='repeatable_read', readonly=True):
+            generation = await _query(conn, 'fetchval',
+                                      'SELECT generation FROM app_settings WHERE user_id = $1', user_id)
+            settings = await _query(conn, 'fetchrow',
+                                    f'SELECT {SETTINGS_COLUMNS} FROM app_settings WHERE user_id = $1', user_id)
+            vehicles = await _query(conn, 'fetch', f'''
+                SELECT {VEHICLE_COLUMNS} FROM vehicles WHERE user_id = $1 AND active ORDER BY id
+            ''', user_id)
+        return settings_cache.Snapshot(
+            generation or 0, tuple(settings) if settings else None, tuple(tuple(v) for v in vehicles)
+        )
+
+    async def _bump_generation(self, conn, user_id: int):
+        """Mark cached settings and vehicles stale for every worker"""
+        await _query(conn, 'execute', '''
+            INSERT INTO app_settings (user_id) VALUES ($1)
+            ON CONFLICT (user_id) DO UPDATE SET generation = app_settings.generation + 1
+        ''', user_id)
+
+    async def config(self) -> settings_cache.Snapshot:
+        cache = settings_cache.get_cache()
+        cached = cache.peek()
+        if cached is not None:
+            return cached
+        user_id = self._user()
+        async with (await self._pool()).acquire() as conn:
+            generation = await _query(conn, 'fetchval',
+                                      'SELECT generation FROM app_settings WHERE user_id = $1', user_id)
+            if generation is None:
+                await _query(conn, 'execute',
+                             'INSERT INTO app_settings (user_id) VALUES ($1) ON CONFLICT DO NOTHING', user_id)
+            current = cache.current()
+            if current is not None and generation is not None and current.generation == generation:
+                return cache.store(current)
+            return cache.store(await self._load_config(conn, user_id))
+
+    async def save_settings(self, values: tuple):
+        user_id = self._user()
+        async with (await self._pool()).acquire() as conn:
+            async with conn.transaction():
+                await self._bump_generation(conn, user_id)
+                await _query(conn, 'execute', '''
+                    UPDATE app_settings
+                    SET webhook_url = $1, webhook_enabled = $2, locale = $3, currency = $4,
+                        default_vehicle_id = $5, mileage_rate = $6
+                    WHERE user_id = $7
+                ''', *values, user_id)
+            settings_cache.get_cache().store(await self._load_config(conn, user_id))
+
+    async def add_vehicle(self, values: tuple):
+        user_id = self._user()
+        async with (await self._pool()).acquire() as conn:
+            async with conn.transaction():
+                await _query(conn, 'execute', '''
+                    INSERT INTO vehicles (user_id, license_plate, brand, model, fuel_type, lease_company)
+                    VALUES ($1, $2, $3, $4, $5, $6)
+                ''', user_id, *values)
+                await self._bump_generation(conn, user_id)
+            settings_cache.get_cache().store(await self._load_config(conn, user_id))
+
+    async def trips_page(self, after: Optional[Tuple[str, int]], limit: int) -> List[tuple]:
+        async with (await self._pool()).acquire() as conn:
+            if after is None:
+                rows = await _query(conn, 'fetch', f'''
+                    SELECT {PG_TRIP_ROW_COLUMNS} FROM trips
+                    WHERE user_id = $1
+                    ORDER BY date DESC, id DESC
+                    LIMIT $2
+                ''', self._user(), limit)
+            else:
+                rows = await _query(conn, 'fetch', f'''
+                    SELECT {PG_TRIP_ROW_COLUMNS} FROM trips
+                    WHERE user_id = $1 AND (date, id) < ($2, $3)
+                    ORDER BY date DESC, id DESC
+                    LIMIT $4
+                ''', self._user(), date.fromisoformat(after[0]), after[1], limit)
+        return [tuple(row) for row in rows]
+
+    async def search_trips(self, query: str, limit: int, offset: int) -> List[tuple]:
+        tsquery = _tsquery(query)
+        if not tsquery:
+            return []
+        async with (await self._pool()).acquire() as conn:
+            rows = await _query(conn, 'fetch', f'''
+                SELECT {PG_TRIP_ROW_COLUMNS} FROM trips
+                WHERE user_id = $1 AND search @@ to_tsquery('simple', $2)
+                ORDER BY ts_rank(search, to_tsquery('simple', $2)) DESC, date DESC, id DESC
+                LIMIT $3 OFFSET $4
+            ''', self._user(), tsquery, limit, offset)
+        return [tuple(row) for row in rows]
+
+    async def get_trip(self, trip_id: int) -> Optional[tuple]:
+        async with (await self._pool()).acquire() as conn:
+            row = await _query(conn, 'fetchrow', f'''
+                SELECT {PG_TRIP_COLUMNS} FROM trips WHERE id = $1 AND user_id = $2
+            ''', trip_id, self._user())
+        return tuple(row) if row else None
+
+    async def find_trips(self, filters: dict, after: Optional[Tuple[str, int]], limit: int) -> List[tuple]:
+        clauses = ['user_id = $1']
+        params = [self._user()]
+
+        def add(clause: str, *values):
+            params.extend(values)
+            clauses.append(clause.format(*(f'${len(params) - len(values) + n}' for n in range(1, len(values) + 1))))
+
+        if filters.get('start'):
+            add('date >= {}', date.fromisoformat(filters['start']))
+        if filters.get('end'):
+            add('date < {}', date.fromisoformat(filters['end']))
+        if filters.get('license_plate'):
+            add('license_plate = {}', filters['license_plate'])
+        if filters.get('trip_type'):
+            add('trip_type = {}', filters['trip_type'])
+        if after:
+            add('(date, id) < ({}, {})', date.fromisoformat(after[0]), after[1])
+        params.append(limit)
+        async with (await self._pool()).acquire() as conn:
+            rows = await _query(conn, 'fetch', f'''
+                SELECT {PG_TRIP_COLUMNS} FROM trips
+                WHERE {' AND '.join(clauses)}
+                ORDER BY date DESC, id DESC
+                LIMIT ${len(params)}
+            ''', *params)
+        return [tuple(row) for row in rows]
+
+    async def save_trip(self, values: tuple, trip_id: Optional[int] = None,
+                        webhook: Optional[Webhook] = None) -> int:
+        user_id = self._user()
+        values = (date.fromisoformat(values[0]),) + tuple(values[1:])
+        count = len(TRIP_VALUE_COLUMNS)
+        async with (await self._pool()).acquire() as conn:
+            async with conn.transaction():
+                if trip_id:
+                    assignments = ', '.join(f'{column} = ${n}' for n, column in enumerate(TRIP_VALUE_COLUMNS, start=1))
+                    saved_id = await _query(conn, 'fetchval', f'''
+                        UPDATE trips SET {assignments}
+                        WHERE id = ${count + 1} AND user_id = ${count + 2}
+                        RETURNING id
+                    ''', *values, trip_id, user_id)
+                    if saved_id is None:
+                        raise LookupError(f'Trip {trip_id} not found')
+                else:
+                    placeholders = ', '.join(f'${n}' for n in range(1, count + 2))
+                    saved_id = await _query(conn, 'fetchval', f'''
+                        INSERT INTO trips ({', '.join(TRIP_VALUE_COLUMNS)}, user_id)
+                        VALUES ({placeholders})
+                        RETURNING id
+                    ''', *values, user_id)
+                if webhook:
+                    url, payload = webhook
+                    await _query(conn, 'execute', '''
+                        INSERT INTO webhook_outbox (user_id, url, payload, next_attempt_at)
+                        VALUES ($1, $2, $3, $4)
+                    ''', user_id, url, json.dumps(payload(saved_id)), time.time())
+        return saved_id
+
+    async def delete_trip(self, trip_id: int):
+        async with (await self._pool()).acquire() as conn:
+            await _query(conn, 'execute', 'DELETE FROM trips WHERE id = $1 AND user_id = $2',
+                         trip_id, self._user())
+
+    async def sync_trips(self, trips: List[Tuple[str, tuple]],
+                         webhook: Optional[BatchWebhook] = None) -> List[Tuple[int, str]]:
+        user_id = self._user()
+        count = len(TRIP_VALUE_COLUMNS)
+        results = []
+        async with (await self._pool()).acquire() as conn:
+            async with conn.transaction():
+                for client_id, values in trips:
+                    stored = (date.fromisoformat(values[0]),) + tuple(values[1:])
+                    existing = await _query(conn, 'fetchrow', f'''
+                        SELECT id, {', '.join(TRIP_VALUE_COLUMNS)} FROM trips
+                        WHERE user_id = $1 AND client_id = $2
+                        FOR UPDATE
+                    ''', user_id, client_id)
+                    if existing and tuple(existing)[1:] == stored:
+                        results.append((existing[0], 'unchanged'))
+                        continue
+                    if existing:
+                        assignments = ', '.join(f'{column} = ${n}' for n, column in enumerate(TRIP_VALUE_COLUMNS, start=1))
+                        await _query(conn, 'execute', f'''
+                            UPDATE trips SET {assignments} WHERE id = ${count + 1}
+                        ''', *stored, existing[0])
+                        trip_id, status = existing[0], 'updated'
+                    else:
+                        placeholders = ', '.join(f'${n}' for n in range(1, count + 3))
+                        trip_id = await _query(conn, 'fetchval', f'''
+                            INSERT INTO trips ({', '.join(TRIP_VALUE_COLUMNS)}, user_id, client_id)
+                            VALUES ({placeholders})
+                            RETURNING id
+                        ''', *stored, user_id, client_id)
+                        status = 'created'
+                    if webhook:
+                        url, payload = webhook
+                        await _query(conn, 'execute', '''
+                            INSERT INTO webhook_outbox (user_id, url, payload, next_attempt_at)
+                            VALUES ($1, $2, $3, $4)
+                        ''', user_id, url, json.dumps(payload(trip_id, values)), time.time())
+                    results.append((trip_id, status))
+        return results
+
+    async def _totals(self, start: date, end: date) -> List[tuple]:
+        async with (await self._pool()).acquire() as conn:
+            rows = await _query(conn, 'fetch', '''
+                SELECT trip_type, license_plate, SUM(distance_km), SUM(fuel_cost),
+                       SUM(parking_cost), SUM(toll_cost)
+                FROM trips
+                WHERE user_id = $1 AND date >= $2 AND date < $3
+                GROUP BY trip_type, license_plate
+            ''', self._user(), start, end)
+        return [tuple(row) for row in rows]
+
+    async def monthly_totals(self, year: int, month: int) -> List[tuple]:
+        start, end = db.month_range(year, month)
+        return await self._totals(date.fromisoformat(start), date.fromisoformat(end))
+
+    async def yearly_totals(self, year: int) -> List[tuple]:
+        return await self._totals(date(year, 1, 1), date(year + 1, 1, 1))
+
+    async def usual_distance(self, origin: str, destination: str) -> Optional[int]:
+        if not origin.strip() or not destination.strip():
+            return None
+        async with (await self._pool()).acquire() as conn:
+            return await _query(conn, 'fetchval', '''
+                SELECT percentile_disc(0.5) WITHIN GROUP (ORDER BY distance_km) FROM trips
+                WHERE user_id = $1 AND lower(start_location) = lower($2)
+                      AND lower(end_location) = lower($3) AND distance_km > 0
+            ''', self._user(), origin.strip(), destination.strip())
+
+    async def odometer_issues(self, license_plate: str, trip_date: str, trip_id: Optional[int],
+                              start_odometer: Optional[int], end_odometer: Optional[int]) -> List[dict]:
+        """Same checks as odometer.check_trip, as index seeks on (user_id, license_plate, date, id)"""
+        if not license_plate or (start_odometer is None and end_odometer is None):
+            return []
+        issues = []
+        position = (self._user(), license_plate, date.fromisoformat(trip_date), trip_id or odometer.UNSAVED_ID)
+
+        if start_odometer is not None and end_odometer is not None and end_odometer < start_odometer:
+            issues.append(odometer.new_issue('rollback', license_plate, trip_id, trip_date, start_odometer, end_odometer))
+
+        async with (await self._pool()).acquire() as conn:
+            if start_odometer is not None:
+                previous = await _query(conn, 'fetchval', '''
+                    SELECT end_odometer FROM trips
+                    WHERE user_id = $1 AND license_plate = $2 AND (date, id) < ($3, $4) AND id != $4
+                          AND end_odometer IS NOT NULL
+                    ORDER BY date DESC, id DESC
+                    LIMIT 1
+                ''', *position)
+                if previous is not None:
+                    issue = odometer.link_readings(license_plate, trip_id, trip_date, previous, start_odometer)
+                    if issue:
+                        issues.append(issue)
+
+            if end_odometer is not None:
+                following = await _query(conn, 'fetchrow', '''
+                    SELECT id, to_char(date, 'YYYY-MM-DD'), start_odometer FROM trips
+                    WHERE user_id = $1 AND license_plate = $2 AND (date, id) > ($3, $4) AND id != $4
+                          AND start_odometer IS NOT NULL
+                    ORDER BY date, id
+                    LIMIT 1
+                ''', *position)
+                if following:
+                    issue = odometer.link_readings(license_plate, following[0], following[1],
+                                                   end_odometer, following[2])
+                    if issue:
+                        issues.append(issue)
+        return issues
+
+    async def location_index(self) -> locations.LocationIndex:
+        index = locations.cached_index()
+        if index.loaded:
+            return index
+        async with (await self._pool()).acquire() as conn:
+            rows = await _query(conn, 'fetch', '''
+                SELECT location, COUNT(*), to_char(MAX(date), 'YYYY-MM-DD') FROM (
+                    SELECT start_location AS location, date FROM trips WHERE user_id = $1
+                    UNION ALL
+                    SELECT end_location, date FROM trips WHERE user_id = $1
+                ) AS uses
+                GROUP BY location
+                ORDER BY MAX(date)
+            ''', self._user())
+        locations.fill(index, [tuple(row) for row in rows])
+        return index
+
+    async def latest_change(self) -> int:
+        async with (await self._pool()).acquire() as conn:
+            return await _query(conn, 'fetchval',
+                                'SELECT COALESCE(MAX(seq), 0) FROM change_log WHERE user_id = $1', self._user())
+
+    async def changes_since(self, since: int, limit: int) -> Tuple[List[tuple], List[tuple], List[tuple]]:
+        user_id = self._user()
+        async with (await self._pool()).acquire() as conn:
+            changes = [tuple(row) for row in await _query(conn, 'fetch', '''
+                SELECT seq, entity, entity_id, op, to_char(changed_at AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS')
+                FROM change_log
+                WHERE user_id = $1 AND seq > $2
+                ORDER BY seq
+                LIMIT $3
+            ''', user_id, since, limit)]
+            rows = []
+            for table, entity, columns in (('trips', 'trip', PG_TRIP_COLUMNS), ('vehicles', 'vehicle', VEHICLE_COLUMNS)):
+                ids = sorted({entity_id for _, kind, entity_id, _, _ in changes if kind == entity})
+                rows.append([tuple(row) for row in await _query(conn, 'fetch', f'''
+                    SELECT {columns} FROM {table} WHERE user_id = $1 AND id = ANY($2::bigint[])
+                ''', user_id, ids)] if ids else [])
+        return changes, rows[0], rows[1]
+
+    async def outboxes_due(self) -> dict:
+        # A single outbox for all users
+        next_due = await self.next_webhook_due()
+        return {} if next_due is None else {None: next_due}
+
+    async def claim_webhooks(self, now: float, limit: int) -> List[tuple]:
+        async with (await self._pool()).acquire() as conn:
+            rows = await _query(conn, 'fetch', '''
+                UPDATE webhook_outbox
+                SET next_attempt_at = $1
+                WHERE id IN (
+                    SELECT id FROM webhook_outbox
+                    WHERE status = 'pending' AND next_attempt_at <= $2
+                    ORDER BY id
+                    LIMIT $3
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id, url, payload, attempts
+            ''', now + webhooks.WEBHOOK_CLAIM_SECONDS, now, limit)
+        return [tuple(row) for row in rows]
+
+    async def webhooks_delivered(self, ids: list):
+        async with (await self._pool()).acquire() as conn:
+            await _query(conn, 'execute', 'DELETE FROM webhook_outbox WHERE id = ANY($1::bigint[])', ids)
+
+    async def webhooks_failed(self, entries: list, error: str):
+        now = time.time()
+        async with (await self._pool()).acquire() as conn:
+            async with conn.transaction():
+                for entry_id, attempts in entries:
+                    attempts += 1
+                    if attempts >= webhooks.WEBHOOK_MAX_ATTEMPTS:
+                        await _query(conn, 'execute', '''
+                            UPDATE webhook_outbox SET status = 'dead', attempts = $1, last_error = $2
+                            WHERE id = $3
+                        ''', attempts, error, entry_id)
+                        metrics.WEBHOOK_ENTRIES.inc('dead')
+                    else:
+                        await _query(conn, 'execute', '''
+                            UPDATE webhook_outbox SET attempts = $1, last_error = $2, next_attempt_at = $3
+                            WHERE id = $4
+                        ''', attempts, error, now + webhooks.backoff(attempts), entry_id)
+
+    async def next_webhook_due(self) -> Optional[float]:
+        async with (await self._pool()).acquire() as conn:
+            return await _query(conn, 'fetchval',
+                                "SELECT MIN(next_attempt_at) FROM webhook_outbox WHERE status = 'pending'")
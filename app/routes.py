@@ -0,0 +1,152 @@
+import csv
+import os
+import statistics
+import string
+import threading
+from collections import OrderedDict
+from itertools import groupby
+from typing import Iterable, Optional
+
+from . import db
+
+# Origin/destination pairs cached in memory per process
+ROUTE_CACHE_SIZE = int(os.getenv("ROUTE_CACHE_SIZE", "2000"))
+# A distance is implausible when it is off by more than this fraction of the usual one...
+ROUTE_TOLERANCE = float(os.getenv("ROUTE_TOLERANCE", "0.5"))
+# ...and by more than this many km, so short trips don't trip the check on small detours
+ROUTE_TOLERANCE_KM = int(os.getenv("ROUTE_TOLERANCE_KM", "5"))
+
+# Fold case the way SQLite's NOCASE collation does (ASCII only), so cache keys match the table
+_NOCASE = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+def route_key(origin: str, destination: str) -> tuple:
+    return origin.strip().translate(_NOCASE), destination.strip().translate(_NOCASE)
+
+def learn_route(conn, origin: str, destination: str):
+    """Recompute the learned distance for one pair as the median of its trips
+
+    Trips store their locations trimmed, so this matches the same rows that
+    rebuild_routes groups under route_key.
+    """
+    origin, destination = origin.strip(), destination.strip()
+    distances = [row[0] for row in conn.execute('''
+        SELECT distance_km FROM trips
+        WHERE start_location = ? COLLATE NOCASE AND end_location = ? COLLATE NOCASE
+              AND distance_km > 0
+    ''', (origin, destination))]
+    if distances:
+        conn.execute('''
+            INSERT OR REPLACE INTO route_distances (origin, destination, distance_km, trip_count, source)
+            VALUES (?, ?, ?, ?, 'learned')
+        ''', (origin, destination, round(statistics.median(distances)), len(distances)))
+    else:
+        conn.execute('''
+            DELETE FROM route_distances WHERE origin = ? AND destination = ? AND source = 'learned'
+        ''', (origin, destination))
+    get_cache().discard(origin, destination)
+
+def rebuild_routes(conn):
+    """Relearn every pair from trips; seeded pairs without trips are kept"""
+    conn.execute("DELETE FROM route_distances WHERE source = 'learned'")
+    rows = conn.execute('''
+        SELECT start_location, end_location, distance_km FROM trips
+        WHERE distance_km > 0
+        ORDER BY start_location COLLATE NOCASE, end_location COLLATE NOCASE
+    ''')
+    for _, group in groupby(rows, key=lambda row: route_key(row[0], row[1])):
+        group = list(group)
+        distances = [row[2] for row in group]
+        conn.execute('''
+            INSERT OR REPLACE INTO route_distances (origin, destination, distance_km, trip_count, source)
+            VALUES (?, ?, ?, ?, 'learned')
+        ''', (group[0][0].strip(), group[0][1].strip(), round(statistics.median(distances)), len(distances)))
+    get_cache().clear()
+
+def seed_routes(conn, rows: Iterable[dict]) -> int:
+    """Load origin,destination,distance_km rows from offline routing data; learned pairs win"""
+    count = 0
+    for row in rows:
+        conn.execute('''
+            INSERT OR IGNORE INTO route_distances (origin, destination, distance_km, trip_count, source)
+            VALUES (?, ?, ?, 0, 'seed')
+        ''', (row['origin'].strip(), row['destination'].strip(), int(float(row['distance_km']))))
+        count += 1
+    get_cache().clear()
+    return count
+
+def is_implausible(distance: int, expected: Optional[int]) -> bool:
+    """Whether a trip distance is far off the usual distance for its route"""
+    if not expected or not distance:
+        return False
+    return abs(distance - expected) > max(expected * ROUTE_TOLERANCE, ROUTE_TOLERANCE_KM)
+
+class RouteCache:
+    """Bounded LRU of origin/destination -> usual distance, backed by route_distances"""
+
+    def __init__(self, max_entries: int = ROUTE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, conn, origin: str, destination: str) -> Optional[int]:
+        key = route_key(origin, destination)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        row = conn.execute('''
+            SELECT distance_km FROM route_distances WHERE origin = ? AND destination = ?
+        ''', (origin.strip(), destination.strip())).fetchone()
+        distance = row[0] if row else None
+        with self._lock:
+            self._entries[key] = distance
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return distance
+
+    def peek(self, origin: str, destination: str):
+        """Cached distance, or the cache itself as a sentinel when the pair isn't cached"""
+        with self._lock:
+            return self._entries.get(route_key(origin, destination), self)
+
+    def discard(self, origin: str, destination: str):
+        with self._lock:
+            self._entries.pop(route_key(origin, destination), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+_caches = db.PerDatabase(RouteCache)
+
+def get_cache() -> RouteCache:
+    """Route cache of the current database"""
+    return _caches.get()
+
+async def usual_distance(origin: str, destination: str) -> Optional[int]:
+    """Usual distance between two locations, from memory when possible"""
+    if not origin.strip() or not destination.strip():
+        return None
+    cache = get_cache()
+    cached = cache.peek(origin, destination)
+    if cached is not cache:
+        return cached
+    return await db.run(cache.get, origin, destination)
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Maintain the route distance cache')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('rebuild', help='relearn all routes from trips')
+    seed = subparsers.add_parser('seed', help='load a CSV with origin,destination,distance_km columns')
+    seed.add_argument('path')
+    args = parser.parse_args()
+
+    with db.connection() as conn:
+        if args.command == 'rebuild':
+            rebuild_routes(conn)
+            print('Routes rebuilt')
+        else:
+            with open(args.path, newline='', encoding='utf-8-sig') as f:
+                print(f'{seed_routes(conn, csv.DictReader(f))} routes seeded')
@@ -3,7 +3,7 @@ import os
 
 config = rx.Config(
     app_name="mileway",
-    db_url="sqlite:////app/data/mileage.db",
+    db_url=os.environ.get("MILEWAY_DB_URL") or "sqlite:///" + os.environ.get("MILEWAY_DB_PATH", "/app/data/mileage.db"),
     env=rx.Env.PROD,
     show_built_with_reflex=False,
     frontend_port=int(os.environ.get("FRONTEND_PORT", "3000")),
@@ -0,0 +1,92 @@
+import os
+import threading
+import time
+from typing import NamedTuple, Optional
+
+from . import db
+
+# Seconds a worker trusts its cached copy before checking whether another worker changed it
+SETTINGS_CACHE_TTL = float(os.getenv("SETTINGS_CACHE_TTL", "5"))
+
+SETTINGS_COLUMNS = 'webhook_url, webhook_enabled, locale, currency, default_vehicle_id, mileage_rate'
+VEHICLE_COLUMNS = 'id, license_plate, brand, model, fuel_type, lease_company, active'
+
+class Snapshot(NamedTuple):
+    generation: int
+    settings: Optional[tuple]   # SETTINGS_COLUMNS of app_settings row 1
+    vehicles: tuple             # VEHICLE_COLUMNS of the active vehicles
+
+def generation(conn) -> int:
+    """Counter bumped by triggers on every write to app_settings or vehicles"""
+    return conn.execute('SELECT generation FROM config_generation WHERE id = 1').fetchone()[0]
+
+def load_snapshot(conn) -> Snapshot:
+    # Generation first: the rows read after it are at least that new
+    current = generation(conn)
+    settings = conn.execute(f'SELECT {SETTINGS_COLUMNS} FROM app_settings WHERE id = 1').fetchone()
+    vehicles = conn.execute(f'SELECT {VEHICLE_COLUMNS} FROM vehicles WHERE active = 1 ORDER BY id').fetchall()
+    return Snapshot(current, settings, tuple(vehicles))
+
+class SettingsCache:
+    """In-memory copy of one database's app settings and active vehicles
+
+    Writes in this process reload it straight away; writes by other workers
+    (or the CLI tools) are noticed through the generation counter, which is
+    checked at most once per `ttl` seconds.
+    """
+
+    def __init__(self, ttl: float = SETTINGS_CACHE_TTL):
+        self.ttl = ttl
+        self._snapshot: Optional[Snapshot] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def peek(self) -> Optional[Snapshot]:
+        """The cached snapshot while it is fresh, without touching the database"""
+        with self._lock:
+            if self._snapshot is not None and time.monotonic() - self._checked_at < self.ttl:
+                return self._snapshot
+        return None
+
+    def current(self) -> Optional[Snapshot]:
+        """The cached snapshot however old it is, to compare generations with"""
+        with self._lock:
+            return self._snapshot
+
+    def store(self, fresh: Snapshot) -> Snapshot:
+        """Keep a freshly validated snapshot and restart the TTL"""
+        with self._lock:
+            # Never replace a newer snapshot stored meanwhile by another thread
+            if self._snapshot is None or fresh.generation >= self._snapshot.generation:
+                self._snapshot = fresh
+                self._checked_at = time.monotonic()
+            return self._snapshot
+
+    def refresh(self, conn, force: bool = False) -> Snapshot:
+        """Revalidate against the generation counter, reloading only when it moved"""
+        snapshot = self.current()
+        if not force and snapshot is not None and generation(conn) == snapshot.generation:
+            return self.store(snapshot)
+        return self.store(load_snapshot(conn))
+
+    def clear(self):
+        with self._lock:
+            self._snapshot = None
+
+_caches = db.PerDatabase(SettingsCache)
+
+def get_cache() -> SettingsCache:
+    """Settings cache of the current database"""
+    return _caches.get()
+
+async def snapshot() -> Snapshot:
+    """Settings and active vehicles, from memory when possible"""
+    cache = get_cache()
+    cached = cache.peek()
+    if cached is not None:
+        return cached
+    return await db.run(cache.refresh)
+
+async def reload() -> Snapshot:
+    """Reload after a committed write to app_settings or vehicles"""
+    return await db.run(get_cache().refresh, force=True)
@@ -0,0 +1,384 @@
+import asyncio
+import os
+from abc import ABC, abstractmethod
+from typing import Callable, List, Optional, Tuple
+
+from . import db, locations, odometer, routes, settings_cache, users, webhooks
+
+# Column order of the rows the repositories return, shared by every backend
+TRIP_COLUMNS = '''
+    id, date, start_location, end_location, start_odometer, end_odometer,
+    distance_km, purpose, trip_type, license_plate, client_project, notes,
+    fuel_cost, parking_cost, toll_cost
+'''
+
+TRIP_ROW_COLUMNS = '''
+    id, date, start_location, end_location, start_odometer, end_odometer,
+    distance_km, purpose, trip_type, license_plate, client_project,
+    COALESCE(fuel_cost, 0) + COALESCE(parking_cost, 0) + COALESCE(toll_cost, 0)
+'''
+
+# Field names of TRIP_COLUMNS and settings_cache.VEHICLE_COLUMNS rows, for JSON output
+TRIP_FIELDS = tuple(column.strip() for column in TRIP_COLUMNS.split(','))
+VEHICLE_FIELDS = tuple(column.strip() for column in settings_cache.VEHICLE_COLUMNS.split(','))
+
+# Values written by save_trip, in this order
+TRIP_VALUE_COLUMNS = (
+    'date', 'start_location', 'end_location', 'start_odometer', 'end_odometer',
+    'distance_km', 'purpose', 'trip_type', 'license_plate', 'client_project', 'notes',
+    'fuel_cost', 'parking_cost', 'toll_cost',
+)
+
+# Webhook to queue with a saved trip: the URL and a function building the payload from the trip id
+Webhook = Tuple[str, Callable[[int], dict]]
+# Same for a batch of synced trips; the payload function also gets the trip's values
+BatchWebhook = Tuple[str, Callable[[int, tuple], dict]]
+
+class Repository(ABC):
+    """Persistence behind the State handlers and the webhook worker
+
+    All methods work on the current user's data (see users.use_account).
+    Trip rows follow TRIP_ROW_COLUMNS, full trips TRIP_COLUMNS, and dates
+    are ISO 'YYYY-MM-DD' strings whatever the engine stores.
+    """
+
+    name = ''
+
+    @abstractmethod
+    async def migrate(self):
+        """Bring the schema up to date; called once when the backend starts"""
+
+    @abstractmethod
+    async def config(self) -> settings_cache.Snapshot:
+        """Settings and active vehicles, cached in memory"""
+
+    @abstractmethod
+    async def save_settings(self, values: tuple):
+        """Write (webhook_url, webhook_enabled, locale, currency, default_vehicle_id, mileage_rate)"""
+
+    @abstractmethod
+    async def add_vehicle(self, values: tuple):
+        """Write (license_plate, brand, model, fuel_type, lease_company)"""
+
+    @abstractmethod
+    async def trips_page(self, after: Optional[Tuple[str, int]], limit: int) -> List[tuple]:
+        """Trips before (date, id) `after`, newest first"""
+
+    @abstractmethod
+    async def search_trips(self, query: str, limit: int, offset: int) -> List[tuple]:
+        """Trips matching a free-text query, best matches first"""
+
+    @abstractmethod
+    async def get_trip(self, trip_id: int) -> Optional[tuple]:
+        ...
+
+    @abstractmethod
+    async def find_trips(self, filters: dict, after: Optional[Tuple[str, int]], limit: int) -> List[tuple]:
+        """Full trips (TRIP_COLUMNS) matching db.trip_filters arguments, before (date, id) `after`, newest first"""
+
+    @abstractmethod
+    async def save_trip(self, values: tuple, trip_id: Optional[int] = None,
+                        webhook: Optional[Webhook] = None) -> int:
+        """Insert or update a trip (TRIP_VALUE_COLUMNS), queueing its webhook in the same transaction"""
+
+    @abstractmethod
+    async def delete_trip(self, trip_id: int):
+        ...
+
+    @abstractmethod
+    async def sync_trips(self, trips: List[Tuple[str, tuple]],
+                         webhook: Optional[BatchWebhook] = None) -> List[Tuple[int, str]]:
+        """Upsert (client_id, values) pairs in one transaction
+
+        Returns (trip_id, status) per pair, status being 'created', 'updated' or
+        'unchanged'; unchanged trips (a batch sent again) queue no webhook.
+        """
+
+    @abstractmethod
+    async def monthly_totals(self, year: int, month: int) -> List[tuple]:
+        """(trip_type, license_plate, km, fuel, parking, toll) per type and vehicle"""
+
+    @abstractmethod
+    async def yearly_totals(self, year: int) -> List[tuple]:
+        """Same rows as monthly_totals, for a whole year"""
+
+    @abstractmethod
+    async def usual_distance(self, origin: str, destination: str) -> Optional[int]:
+        ...
+
+    @abstractmethod
+    async def odometer_issues(self, license_plate: str, date: str, trip_id: Optional[int],
+                              start_odometer: Optional[int], end_odometer: Optional[int]) -> List[dict]:
+        ...
+
+    @abstractmethod
+    async def location_index(self) -> locations.LocationIndex:
+        ...
+
+    @abstractmethod
+    async def latest_change(self) -> int:
+        """Sequence number of the newest change_log entry, 0 when there is none"""
+
+    @abstractmethod
+    async def changes_since(self, since: int, limit: int) -> Tuple[List[tuple], List[tuple], List[tuple]]:
+        """change_log entries after `since`, oldest first, with the current rows they refer to
+
+        Returns ((seq, entity, entity_id, op, changed_at) entries, TRIP_COLUMNS rows,
+        VEHICLE_COLUMNS rows); deleted trips and vehicles have no row.
+        """
+
+    @abstractmethod
+    async def outboxes_due(self) -> dict:
+        """When each outbox's next webhook is due, keyed by the database to pass to db.use_database"""
+
+    @abstractmethod
+    async def claim_webhooks(self, now: float, limit: int) -> List[tuple]:
+        """Claim due (id, url, payload, attempts) entries of the current outbox"""
+
+    @abstractmethod
+    async def webhooks_delivered(self, ids: list):
+        ...
+
+    @abstractmethod
+    async def webhooks_failed(self, entries: list, error: str):
+        ...
+
+    @abstractmethod
+    async def next_webhook_due(self) -> Optional[float]:
+        ...
+
+def _route_of(conn, trip_id: int) -> Optional[Tuple[str, str]]:
+    """(start_location, end_location) a stored trip currently counts towards in route_distances"""
+    return conn.execute('SELECT start_location, end_location FROM trips WHERE id = ?', (trip_id,)).fetchone()
+
+class SQLiteRepository(Repository):
+    """The SQLite files managed by db: triggers keep rollups, search and config generations current"""
+
+    name = 'sqlite'
+
+    async def migrate(self):
+        # Other users' files are migrated when their pool is first opened
+        db.init_db()
+
+    async def config(self) -> settings_cache.Snapshot:
+        return await settings_cache.snapshot()
+
+    async def save_settings(self, values: tuple):
+        await db.execute('''
+            UPDATE app_settings
+            SET webhook_url = ?, webhook_enabled = ?, locale = ?, currency = ?,
+                default_vehicle_id = ?, mileage_rate = ?
+            WHERE id = 1
+        ''', values)
+        await settings_cache.reload()
+
+    async def add_vehicle(self, values: tuple):
+        await db.execute('''
+            INSERT INTO vehicles (license_plate, brand, model, fuel_type, lease_company)
+            VALUES (?, ?, ?, ?, ?)
+        ''', values)
+        await settings_cache.reload()
+
+    async def trips_page(self, after: Optional[Tuple[str, int]], limit: int) -> List[tuple]:
+        if after is None:
+            return await db.fetchall(f'''
+                SELECT {TRIP_ROW_COLUMNS} FROM trips
+                ORDER BY date DESC, id DESC
+                LIMIT ?
+            ''', (limit,))
+        return await db.fetchall(f'''
+            SELECT {TRIP_ROW_COLUMNS} FROM trips
+            WHERE (date, id) < (?, ?)
+            ORDER BY date DESC, id DESC
+            LIMIT ?
+        ''', (*after, limit))
+
+    async def search_trips(self, query: str, limit: int, offset: int) -> List[tuple]:
+        return await db.fetchall(f'''
+            SELECT {TRIP_ROW_COLUMNS} FROM trips
+            JOIN (
+                SELECT rowid, rank FROM trips_fts
+                WHERE trips_fts MATCH ?
+                ORDER BY rank
+                LIMIT ? OFFSET ?
+            ) AS hits ON trips.id = hits.rowid
+            ORDER BY hits.rank
+        ''', (db.fts_query(query), limit, offset))
+
+    async def get_trip(self, trip_id: int) -> Optional[tuple]:
+        return await db.fetchone(f'SELECT {TRIP_COLUMNS} FROM trips WHERE id = ?', (trip_id,))
+
+    async def find_trips(self, filters: dict, after: Optional[Tuple[str, int]], limit: int) -> List[tuple]:
+        where, params = db.trip_filters(**filters)
+        if after:
+            where = f'{where} AND (date, id) < (?, ?)' if where else 'WHERE (date, id) < (?, ?)'
+            params += tuple(after)
+        return await db.fetchall(f'''
+            SELECT {TRIP_COLUMNS} FROM trips
+            {where}
+            ORDER BY date DESC, id DESC
+            LIMIT ?
+        ''', params + (limit,))
+
+    async def save_trip(self, values: tuple, trip_id: Optional[int] = None,
+                        webhook: Optional[Webhook] = None) -> int:
+        def write(conn) -> int:
+            if trip_id:
+                previous_route = _route_of(conn, trip_id)
+                conn.execute(f'''
+                    UPDATE trips
+                    SET {', '.join(f'{column} = ?' for column in TRIP_VALUE_COLUMNS)}
+                    WHERE id = ?
+                ''', values + (trip_id,))
+                saved_id = trip_id
+            else:
+                saved_id = conn.execute(f'''
+                    INSERT INTO trips ({', '.join(TRIP_VALUE_COLUMNS)})
+                    VALUES ({', '.join('?' * len(TRIP_VALUE_COLUMNS))})
+                ''', values).lastrowid
+            if webhook:
+                url, payload = webhook
+                webhooks.enqueue(conn, url, payload(saved_id))
+            routes.learn_route(conn, values[1], values[2])
+            if trip_id and previous_route:
+                routes.learn_route(conn, *previous_route)
+            return saved_id
+        return await db.run(write)
+
+    async def delete_trip(self, trip_id: int):
+        def write(conn):
+            previous_route = _route_of(conn, trip_id)
+            conn.execute('DELETE FROM trips WHERE id = ?', (trip_id,))
+            if previous_route:
+                routes.learn_route(conn, *previous_route)
+        await db.run(write)
+
+    async def sync_trips(self, trips: List[Tuple[str, tuple]],
+                         webhook: Optional[BatchWebhook] = None) -> List[Tuple[int, str]]:
+        def write(conn) -> List[Tuple[int, str]]:
+            results = []
+            routes_to_learn = []
+            for client_id, values in trips:
+                existing = conn.execute(f'''
+                    SELECT id, {', '.join(TRIP_VALUE_COLUMNS)} FROM trips WHERE client_id = ?
+                ''', (client_id,)).fetchone()
+                if existing and tuple(existing[1:]) == tuple(values):
+                    results.append((existing[0], 'unchanged'))
+                    continue
+                if existing:
+                    # TRIP_VALUE_COLUMNS starts with date, start_location, end_location
+                    routes_to_learn.append((existing[2], existing[3]))
+                    conn.execute(f'''
+                        UPDATE trips
+                        SET {', '.join(f'{column} = ?' for column in TRIP_VALUE_COLUMNS)}
+                        WHERE id = ?
+                    ''', tuple(values) + (existing[0],))
+                    trip_id, status = existing[0], 'updated'
+                else:
+                    trip_id = conn.execute(f'''
+                        INSERT INTO trips ({', '.join(TRIP_VALUE_COLUMNS)}, client_id)
+                        VALUES ({', '.join('?' * (len(TRIP_VALUE_COLUMNS) + 1))})
+                    ''', tuple(values) + (client_id,)).lastrowid
+                    status = 'created'
+                if webhook:
+                    url, payload = webhook
+                    webhooks.enqueue(conn, url, payload(trip_id, values))
+                routes.learn_route(conn, values[1], values[2])
+                results.append((trip_id, status))
+            # Pairs that updated trips moved away from
+            for origin, destination in routes_to_learn:
+                routes.learn_route(conn, origin, destination)
+            return results
+        return await db.run(write)
+
+    async def monthly_totals(self, year: int, month: int) -> List[tuple]:
+        # Pre-aggregated by the trip_rollups triggers
+        return await db.fetchall('''
+            SELECT trip_type, license_plate, distance_km, fuel_cost, parking_cost, toll_cost
+            FROM trip_rollups
+            WHERE year = ? AND month = ?
+        ''', (year, month))
+
+    async def yearly_totals(self, year: int) -> List[tuple]:
+        return await db.fetchall('''
+            SELECT trip_type, license_plate, SUM(distance_km), SUM(fuel_cost), SUM(parking_cost), SUM(toll_cost)
+            FROM trip_rollups
+            WHERE year = ?
+            GROUP BY trip_type, license_plate
+        ''', (year,))
+
+    async def usual_distance(self, origin: str, destination: str) -> Optional[int]:
+        return await routes.usual_distance(origin, destination)
+
+    async def odometer_issues(self, license_plate: str, date: str, trip_id: Optional[int],
+                              start_odometer: Optional[int], end_odometer: Optional[int]) -> List[dict]:
+        return await db.run(odometer.check_trip, license_plate, date, trip_id, start_odometer, end_odometer)
+
+    async def location_index(self) -> locations.LocationIndex:
+        return await locations.get_index_async()
+
+    async def latest_change(self) -> int:
+        return (await db.fetchone('SELECT COALESCE(MAX(seq), 0) FROM change_log'))[0]
+
+    async def changes_since(self, since: int, limit: int) -> Tuple[List[tuple], List[tuple], List[tuple]]:
+        def read(conn):
+            changes = conn.execute('''
+                SELECT seq, entity, entity_id, op, changed_at FROM change_log
+                WHERE seq > ?
+                ORDER BY seq
+                LIMIT ?
+            ''', (since, limit)).fetchall()
+            rows = []
+            for table, entity, columns in (('trips', 'trip', TRIP_COLUMNS),
+                                           ('vehicles', 'vehicle', settings_cache.VEHICLE_COLUMNS)):
+                ids = sorted({entity_id for _, kind, entity_id, _, _ in changes if kind == entity})
+                rows.append(conn.execute(
+                    f'SELECT {columns} FROM {table} WHERE id IN ({", ".join("?" * len(ids))})', ids
+                ).fetchall() if ids else [])
+            return changes, rows[0], rows[1]
+        return await db.run(read)
+
+    async def outboxes_due(self) -> dict:
+        # Read straight from every user's file, so idle users' pools aren't opened
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(db.get_executor(), webhooks.scan_due, users.databases())
+
+    async def claim_webhooks(self, now: float, limit: int) -> List[tuple]:
+        return await db.run(webhooks.claim_due, now, limit)
+
+    async def webhooks_delivered(self, ids: list):
+        await db.run(webhooks.mark_delivered, ids)
+
+    async def webhooks_failed(self, entries: list, error: str):
+        await db.run(webhooks.mark_failed, entries, error)
+
+    async def next_webhook_due(self) -> Optional[float]:
+        return await db.run(webhooks.next_due)
+
+def get_db_url() -> str:
+    """Storage URL; MILEWAY_DB_URL selects PostgreSQL, otherwise the SQLite file is used"""
+    return os.getenv("MILEWAY_DB_URL") or f'sqlite:///{db.get_db_path()}'
+
+_repository: Optional[Repository] = None
+
+def get() -> Repository:
+    """The repository for the configured db_url, created on first use"""
+    global _repository
+    if _repository is None:
+        url = get_db_url()
+        if url.split(':', 1)[0].split('+', 1)[0] in ('postgres', 'postgresql'):
+            # Imported here so SQLite deployments don't need asyncpg
+            from .postgres import PostgresRepository
+            _repository = PostgresRepository(url)
+        elif url.startswith('sqlite:'):
+            _repository = SQLiteRepository()
+        else:
+            raise ValueError(f'Unsupported db_url: {url}')
+    return _repository
+
+def is_sqlite() -> bool:
+    return get().name == 'sqlite'
+
+async def migrate():
+    """Lifespan task migrating the configured storage"""
+    await get().migrate()
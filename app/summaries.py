@@ -0,0 +1,38 @@
+from typing import Iterable
+
+def _line(key: str) -> dict:
+    return {'key': key, 'km': 0, 'fuel_cost': 0.0, 'parking_cost': 0.0, 'toll_cost': 0.0, 'total_cost': 0.0}
+
+def fold(rows: Iterable[tuple], mileage_rate: float) -> dict:
+    """Fold (trip_type, license_plate, km, fuel, parking, toll) rows into totals per type and vehicle
+
+    Shared by the monthly overview in the app and the summary API.
+    """
+    totals = _line('')
+    by_type = {}
+    by_vehicle = {}
+    for trip_type, license_plate, km, fuel, parking, toll in rows:
+        km, fuel, parking, toll = km or 0, fuel or 0.0, parking or 0.0, toll or 0.0
+        for line in (by_type.setdefault(trip_type, _line(trip_type)),
+                     by_vehicle.setdefault(license_plate or "", _line(license_plate or "")),
+                     totals):
+            line['km'] += km
+            line['fuel_cost'] += fuel
+            line['parking_cost'] += parking
+            line['toll_cost'] += toll
+            line['total_cost'] += fuel + parking + toll
+
+    business_km = by_type['zakelijk']['km'] if 'zakelijk' in by_type else 0
+    return {
+        'total_km': totals['km'],
+        'business_km': business_km,
+        'private_km': by_type['prive']['km'] if 'prive' in by_type else 0,
+        'commute_km': by_type['woon_werk']['km'] if 'woon_werk' in by_type else 0,
+        'fuel_cost': totals['fuel_cost'],
+        'parking_cost': totals['parking_cost'],
+        'toll_cost': totals['toll_cost'],
+        'total_cost': totals['total_cost'],
+        'reimbursement': business_km * mileage_rate,
+        'by_type': sorted(by_type.values(), key=lambda line: line['key']),
+        'by_vehicle': sorted(by_vehicle.values(), key=lambda line: line['key']),
+    }
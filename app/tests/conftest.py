@@ -0,0 +1,40 @@
+import os
+import sys
+import tempfile
+import types
+
+import pytest
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The Docker image copies these files into a `mileway` package; mirror that layout
+if 'mileway' not in sys.modules:
+    package = types.ModuleType('mileway')
+    package.__path__ = [APP_DIR]
+    sys.modules['mileway'] = package
+
+# Read once at import time, so they have to be set before the modules load
+_data_dir = tempfile.mkdtemp(prefix='mileway-tests-')
+os.environ.setdefault('MILEWAY_DB_PATH', os.path.join(_data_dir, 'mileage.db'))
+os.environ.setdefault('MILEWAY_USERS_DB', os.path.join(_data_dir, 'users.db'))
+os.environ.setdefault('MILEWAY_USER_DATA_DIR', os.path.join(_data_dir, 'users'))
+os.environ.setdefault('MILEWAY_SECRET', 'test-secret')
+
+from mileway import db, storage  # noqa: E402
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """A fresh, migrated SQLite file as the default database"""
+    path = str(tmp_path / 'mileage.db')
+    monkeypatch.setenv('MILEWAY_DB_PATH', path)
+    monkeypatch.delenv('MILEWAY_DB_URL', raising=False)
+    monkeypatch.setattr(storage, '_repository', None)
+    db.init_db()
+    return path
+
+def trip_values(date: str = '2024-03-01', start: str = 'Utrecht', end: str = 'Amsterdam', distance: int = 40,
+                trip_type: str = 'zakelijk', license_plate: str = '', start_odometer=None, end_odometer=None,
+                fuel_cost: float = 0.0) -> tuple:
+    """A row in storage.TRIP_VALUE_COLUMNS order"""
+    return (date, start, end, start_odometer, end_odometer, distance, 'klantbezoek', trip_type, license_plate,
+            '', '', fuel_cost, 0.0, 0.0)
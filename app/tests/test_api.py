@@ -0,0 +1,88 @@
+import base64
+
+import pytest
+from starlette.testclient import TestClient
+
+from mileway import api, db, export, users
+
+@pytest.fixture
+def client(database):
+    return TestClient(api.api)
+
+def basic(username: str, password: str) -> dict:
+    credentials = base64.b64encode(f'{username}:{password}'.encode()).decode()
+    return {'Authorization': f'Basic {credentials}'}
+
+def test_export_requires_credentials(client):
+    assert client.get('/api/export/trips').status_code == 401
+    assert client.get('/api/export/trips', headers=basic('admin', 'wrong')).status_code == 401
+
+    response = client.get('/api/export/trips', headers=basic('admin', 'password123'))
+    assert response.status_code == 200
+    assert response.text.splitlines()[0] == ','.join(export.EXPORT_COLUMNS)
+
+def test_export_does_not_hold_a_pooled_connection(database, monkeypatch):
+    pool = db.get_pool()
+    monkeypatch.setattr(pool, 'timeout', 0.1)
+    held = [pool.acquire() for _ in range(pool.size)]
+    try:
+        chunks = export.iter_csv()
+        assert next(chunks).rstrip() == ','.join(export.EXPORT_COLUMNS)
+        list(chunks)
+    finally:
+        for conn in held:
+            pool.release(conn)
+    assert pool._idle.qsize() == pool.size
+
+def test_export_accepts_non_ascii_credentials(client, monkeypatch):
+    # Wrong non-ASCII credentials are a plain 401, not a TypeError from compare_digest
+    assert client.get('/api/export/trips', headers=basic('José', 'p€ssword')).status_code == 401
+
+    monkeypatch.setenv('AUTH_USERNAME', 'José')
+    monkeypatch.setenv('AUTH_PASSWORD', 'p€ssword')
+    assert client.get('/api/export/trips', headers=basic('José', 'p€ssword')).status_code == 200
+    assert client.get('/api/export/trips', headers=basic('José', 'p€sswore')).status_code == 401
+
+def test_malformed_bearer_token_is_unauthorized(client):
+    headers = [(b'authorization', b'Bearer 1.4102444800.\xe9')]
+    assert client.get('/api/export/trips', headers=headers).status_code == 401
+
+def test_summary_etag_follows_the_default_period(client, monkeypatch):
+    class Today(api.date):
+        value = api.date(2024, 3, 31)
+
+        @classmethod
+        def today(cls):
+            return cls.value
+
+    monkeypatch.setattr(api, 'date', Today)
+    auth = basic('admin', 'password123')
+    march = client.get('/api/summary', headers=auth)
+    assert march.json()['period'] == '2024-03'
+    etag = march.headers['etag']
+    assert client.get('/api/summary', headers={**auth, 'If-None-Match': etag}).status_code == 304
+
+    # No write in between, yet the new month must not be answered with March's totals
+    Today.value = api.date(2024, 4, 1)
+    april = client.get('/api/summary', headers={**auth, 'If-None-Match': etag})
+    assert april.status_code == 200
+    assert april.json()['period'] == '2024-04'
+    assert april.headers['etag'] != etag
+
+def test_polling_with_basic_auth_checks_the_password_once(client, monkeypatch):
+    users.add_user('poller', 'geheim-1')
+    checks = []
+    check_password = users.check_password
+    monkeypatch.setattr(users, 'check_password', lambda *args: checks.append(1) or check_password(*args))
+
+    auth = basic('poller', 'geheim-1')
+    etag = client.get('/api/trips', headers=auth).headers['etag']
+    for _ in range(3):
+        assert client.get('/api/trips', headers={**auth, 'If-None-Match': etag}).status_code == 304
+    assert len(checks) == 1
+    assert client.get('/api/trips', headers=basic('poller', 'geheim-2')).status_code == 401
+
+    # A new password ends the remembered one straight away
+    users.set_password('poller', 'geheim-2')
+    assert client.get('/api/trips', headers=auth).status_code == 401
+    assert client.get('/api/trips', headers=basic('poller', 'geheim-2')).status_code == 200
@@ -0,0 +1,75 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+from mileway import db, storage
+
+def _fill(path: str):
+    """A few years of trips for two vehicles, analyzed so the planner sees a realistic table"""
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.executemany('''
+            INSERT INTO trips (date, start_location, end_location, distance_km, purpose, trip_type, license_plate)
+            VALUES (?, 'Utrecht', 'Amsterdam', 40, '', ?, ?)
+        ''', [
+            (f'{2020 + n % 5}-{n % 12 + 1:02d}-{n % 28 + 1:02d}',
+             ('zakelijk', 'prive', 'woon_werk')[n % 3], ('AB-123-C', 'XY-987-Z')[n % 2])
+            for n in range(5000)
+        ])
+    conn.execute('ANALYZE')
+    conn.close()
+
+def _captured_queries(monkeypatch, calls) -> list:
+    """Run repository calls and return the (sql, params) they sent to db.fetchall"""
+    queries = []
+    fetchall = db.fetchall
+
+    async def recording(sql, params=()):
+        queries.append((sql, params))
+        return await fetchall(sql, params)
+
+    monkeypatch.setattr(db, 'fetchall', recording)
+
+    async def run():
+        repository = storage.get()
+        for call in calls:
+            await call(repository)
+
+    asyncio.run(run())
+    return queries
+
+def _plan(path: str, sql: str, params) -> str:
+    conn = sqlite3.connect(path)
+    try:
+        return '\n'.join(row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params))
+    finally:
+        conn.close()
+
+# Every bounded query must seek into an index (SEARCH). Only the first page of the
+# history may walk idx_trips_date_id from the newest end, stopping at its LIMIT.
+@pytest.mark.parametrize('call, seek', [
+    pytest.param(lambda r: r.find_trips(dict(zip(('start', 'end'), db.month_range(2022, 6))), None, 50),
+                 'SEARCH trips USING INDEX idx_trips_', id='month-range'),
+    pytest.param(lambda r: r.find_trips(dict(zip(('start', 'end'), db.year_range(2022))), None, 50),
+                 'SEARCH trips USING INDEX idx_trips_', id='year-range'),
+    pytest.param(lambda r: r.find_trips({'start': '2022-01-01', 'license_plate': 'AB-123-C'}, None, 50),
+                 'SEARCH trips USING INDEX idx_trips_', id='range-and-vehicle'),
+    pytest.param(lambda r: r.find_trips({'trip_type': 'prive'}, ('2022-06-15', 2000), 50),
+                 'SEARCH trips USING INDEX idx_trips_', id='type-keyset'),
+    pytest.param(lambda r: r.trips_page(None, 51),
+                 'SCAN trips USING INDEX idx_trips_date_id', id='first-page'),
+    pytest.param(lambda r: r.trips_page(('2022-06-15', 2000), 51),
+                 'SEARCH trips USING INDEX idx_trips_date_id', id='keyset-page'),
+    pytest.param(lambda r: r.monthly_totals(2022, 6), 'SEARCH trip_rollups', id='monthly-totals'),
+    pytest.param(lambda r: r.yearly_totals(2022), 'SEARCH trip_rollups', id='yearly-totals'),
+])
+def test_trip_queries_use_an_index(database, monkeypatch, call, seek):
+    _fill(database)
+    queries = _captured_queries(monkeypatch, [call])
+    assert queries
+    for sql, params in queries:
+        plan = _plan(database, sql, params)
+        assert seek in plan, plan
+        assert not [line for line in plan.splitlines() if line.startswith('SCAN trips') and 'INDEX' not in line], plan
+        assert 'USE TEMP B-TREE FOR ORDER BY' not in plan, plan
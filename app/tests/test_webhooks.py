@@ -0,0 +1,121 @@
+import asyncio
+import json
+import threading
+import time
+from typing import Optional
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from conftest import trip_values
+from mileway import db, storage, webhooks
+
+class StubReceiver:
+    """Local HTTP server recording webhook bodies and answering with queued status codes"""
+
+    def __init__(self):
+        self.bodies = []
+        self.statuses = []
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                receiver.bodies.append(json.loads(self.rfile.read(length)))
+                status = receiver.statuses.pop(0) if receiver.statuses else 200
+                self.send_response(status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}/hook'
+        threading.Thread(target=self.server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+@pytest.fixture
+def receiver():
+    stub = StubReceiver()
+    yield stub
+    stub.close()
+
+def queue_trips(url: str, count: int) -> list:
+    """Save trips with a webhook each, the way add_trip does; returns their ids"""
+    async def main():
+        repository = storage.get()
+        webhook = (url, lambda trip_id: webhooks.mileage_entry(trip_id, trip_values(), 0.23))
+        return [await repository.save_trip(trip_values(), webhook=webhook) for _ in range(count)]
+    return asyncio.run(main())
+
+def deliver() -> Optional[float]:
+    return asyncio.run(webhooks.WebhookWorker().run_once())
+
+def outbox() -> list:
+    async def main():
+        return await db.fetchall('SELECT status, attempts, next_attempt_at, last_error FROM webhook_outbox')
+    return asyncio.run(main())
+
+def test_delivers_and_clears_the_outbox(database, receiver):
+    trip_id, = queue_trips(receiver.url, 1)
+    assert deliver() is None
+    assert len(receiver.bodies) == 1
+    body = receiver.bodies[0]
+    assert (body['type'], body['id'], body['reimbursement']) == ('mileage_entry', trip_id, round(40 * 0.23, 2))
+    assert outbox() == []
+
+def test_failed_delivery_backs_off_and_retries(database, receiver):
+    receiver.statuses = [500]
+    queue_trips(receiver.url, 1)
+    started = time.time()
+    next_due = deliver()
+
+    (status, attempts, next_attempt_at, last_error), = outbox()
+    assert (status, attempts) == ('pending', 1)
+    assert '500' in last_error
+    assert next_attempt_at == next_due
+    assert started + webhooks.backoff(1) <= next_attempt_at <= time.time() + webhooks.backoff(1)
+
+    # Not due yet: nothing is sent
+    deliver()
+    assert len(receiver.bodies) == 1
+
+    async def make_due():
+        await db.execute('UPDATE webhook_outbox SET next_attempt_at = 0')
+    asyncio.run(make_due())
+    assert deliver() is None
+    assert len(receiver.bodies) == 2
+    assert outbox() == []
+
+def test_entry_is_dead_after_max_attempts(database, receiver, monkeypatch):
+    monkeypatch.setattr(webhooks, 'WEBHOOK_MAX_ATTEMPTS', 3)
+    # No backoff, so one pass retries until the entry gives up
+    monkeypatch.setattr(webhooks, 'WEBHOOK_BACKOFF_BASE', 0)
+    receiver.statuses = [503] * 5
+    queue_trips(receiver.url, 1)
+    assert deliver() is None
+
+    assert len(receiver.bodies) == 3
+    (status, attempts, _, last_error), = outbox()
+    assert (status, attempts) == ('dead', 3)
+    assert '503' in last_error
+
+    # Dead entries are kept for inspection but never sent again
+    deliver()
+    assert len(receiver.bodies) == 3
+
+def test_entries_for_one_url_are_batched(database, receiver, monkeypatch):
+    monkeypatch.setattr(webhooks, 'WEBHOOK_BATCH_SIZE', 2)
+    ids = queue_trips(receiver.url, 3)
+    deliver()
+
+    # The two POSTs go out concurrently
+    batch, single = sorted(receiver.bodies, key=lambda body: body['type'])
+    assert (batch['type'], single['type']) == ('mileage_batch', 'mileage_entry')
+    assert batch['count'] == 2
+    assert sorted([entry['id'] for entry in batch['entries']] + [single['id']]) == ids
+    assert outbox() == []
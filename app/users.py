@@ -0,0 +1,315 @@
+import asyncio
+import contextvars
+import functools
+import hashlib
+import hmac
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import List, NamedTuple, Optional
+
+from . import db
+
+# Accounts of the drivers; each gets their own database under MILEWAY_USER_DATA_DIR.
+# The AUTH_USERNAME/AUTH_PASSWORD account keeps using the default database.
+USERS_DB_PATH = os.getenv("MILEWAY_USERS_DB", "/app/data/users.db")
+USER_DATA_DIR = os.getenv("MILEWAY_USER_DATA_DIR", "/app/data/users")
+
+# scrypt cost parameters; a check takes a few tens of milliseconds
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+
+# Lifetime of the tokens the browser uses to sync trips captured offline
+TOKEN_TTL = int(os.getenv("MILEWAY_TOKEN_TTL", str(30 * 24 * 3600)))
+
+# Seconds a verified password is remembered, so API clients polling with Basic
+# auth don't pay for scrypt on every request; 0 disables the cache
+AUTH_CACHE_TTL = float(os.getenv("MILEWAY_AUTH_CACHE_TTL", "60"))
+AUTH_CACHE_SIZE = 1024
+
+class Account(NamedTuple):
+    id: Optional[int]   # None for the environment account
+    username: str
+
+def hash_password(password: str) -> str:
+    salt = secrets.token_bytes(16)
+    digest = hashlib.scrypt(password.encode(), salt=salt, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P)
+    return f'scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${salt.hex()}${digest.hex()}'
+
+def check_password(password: str, stored: str) -> bool:
+    try:
+        scheme, n, r, p, salt, digest = stored.split('$')
+    except ValueError:
+        return False
+    if scheme != 'scrypt':
+        return False
+    computed = hashlib.scrypt(password.encode(), salt=bytes.fromhex(salt), n=int(n), r=int(r), p=int(p))
+    return hmac.compare_digest(computed, bytes.fromhex(digest))
+
+class VerifiedPasswords:
+    """Recently verified (username, password) pairs, keyed by an HMAC so no password is kept
+
+    An entry also records the password hash it was checked against, so changing
+    the password or deactivating the account ends it at once.
+    """
+
+    def __init__(self, ttl: float = AUTH_CACHE_TTL, size: int = AUTH_CACHE_SIZE):
+        self.ttl = ttl
+        self.size = size
+        self._key = secrets.token_bytes(32)
+        self._entries = OrderedDict()  # key -> (password_hash, expires)
+        self._lock = threading.Lock()
+
+    def _digest(self, username: str, password: str) -> bytes:
+        return hmac.new(self._key, f'{username}\0{password}'.encode(), hashlib.sha256).digest()
+
+    def check(self, username: str, password: str, password_hash: str) -> bool:
+        key = self._digest(username, password)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False
+            if entry[0] != password_hash or entry[1] < time.monotonic():
+                del self._entries[key]
+                return False
+            return True
+
+    def add(self, username: str, password: str, password_hash: str):
+        if self.ttl <= 0:
+            return
+        key = self._digest(username, password)
+        with self._lock:
+            self._entries[key] = (password_hash, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+_verified = VerifiedPasswords()
+
+# WAL mode and the table persist in the file, so each process sets them up once
+_schema_ready = False
+_schema_lock = threading.Lock()
+
+def _create_schema(conn: sqlite3.Connection):
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL COLLATE NOCASE,
+            password_hash TEXT NOT NULL,
+            active BOOLEAN DEFAULT 1,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+def _connect() -> sqlite3.Connection:
+    """Short-lived connection to the accounts database; logins are rare next to trip queries"""
+    global _schema_ready
+    if _schema_ready:
+        return sqlite3.connect(USERS_DB_PATH, timeout=db.DB_POOL_TIMEOUT)
+    with _schema_lock:
+        if os.path.dirname(USERS_DB_PATH):
+            os.makedirs(os.path.dirname(USERS_DB_PATH), exist_ok=True)
+        conn = sqlite3.connect(USERS_DB_PATH, timeout=db.DB_POOL_TIMEOUT)
+        if not _schema_ready:
+            _create_schema(conn)
+            _schema_ready = True
+        return conn
+
+_current_user: contextvars.ContextVar = contextvars.ContextVar('mileway_user', default=None)
+
+def current_user_id() -> Optional[int]:
+    return _current_user.get()
+
+def use_account(user_id: Optional[int]) -> tuple:
+    """Scope this context's storage to a user: their SQLite file, or their rows in PostgreSQL"""
+    return _current_user.set(user_id), db.use_database(database_path(user_id))
+
+def reset_account(tokens: tuple):
+    user_token, database_token = tokens
+    db.reset_database(database_token)
+    _current_user.reset(user_token)
+
+def database_path(user_id: Optional[int]) -> Optional[str]:
+    """Database file of a user; None (the default database) for the environment account"""
+    if user_id is None:
+        return None
+    return os.path.join(USER_DATA_DIR, f'{int(user_id)}.db')
+
+def databases() -> List[str]:
+    """Every database file that exists: the default one and one per user"""
+    paths = [db.get_db_path()]
+    if os.path.isdir(USER_DATA_DIR):
+        paths.extend(
+            entry.path for entry in os.scandir(USER_DATA_DIR)
+            if entry.name.endswith('.db') and entry.is_file()
+        )
+    return paths
+
+def authenticate(username: str, password: str) -> Optional[Account]:
+    """Check credentials against the environment account first, then the users table"""
+    expected_username = os.getenv("AUTH_USERNAME", "admin")
+    expected_password = os.getenv("AUTH_PASSWORD", "password123")
+    # Bytes, since compare_digest rejects str with non-ASCII characters
+    if (secrets.compare_digest(username.encode(), expected_username.encode())
+            and secrets.compare_digest(password.encode(), expected_password.encode())):
+        return Account(None, username)
+
+    conn = _connect()
+    try:
+        row = conn.execute(
+            'SELECT id, username, password_hash FROM users WHERE username = ? AND active = 1',
+            (username.strip(),)
+        ).fetchone()
+    finally:
+        conn.close()
+    if not row:
+        return None
+    if _verified.check(username, password, row[2]):
+        return Account(row[0], row[1])
+    if check_password(password, row[2]):
+        _verified.add(username, password, row[2])
+        return Account(row[0], row[1])
+    return None
+
+async def authenticate_async(username: str, password: str) -> Optional[Account]:
+    """authenticate() off the event loop, since hashing is deliberately slow"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(db.get_executor(), authenticate, username, password)
+
+_token_secret: Optional[bytes] = None
+
+def token_secret() -> bytes:
+    """Key signing sync tokens: MILEWAY_SECRET, or one generated once and kept with the accounts"""
+    global _token_secret
+    if _token_secret is None:
+        configured = os.getenv("MILEWAY_SECRET")
+        if configured:
+            _token_secret = configured.encode()
+        else:
+            conn = _connect()
+            try:
+                with conn:
+                    conn.execute('''
+                        CREATE TABLE IF NOT EXISTS token_secret (
+                            id INTEGER PRIMARY KEY CHECK (id = 1),
+                            secret TEXT NOT NULL
+                        )
+                    ''')
+                    # Every worker ends up with the secret of whichever one got here first
+                    conn.execute('INSERT OR IGNORE INTO token_secret (id, secret) VALUES (1, ?)',
+                                 (secrets.token_hex(32),))
+                    secret = conn.execute('SELECT secret FROM token_secret').fetchone()[0]
+            finally:
+                conn.close()
+            _token_secret = bytes.fromhex(secret)
+    return _token_secret
+
+def _sign(body: str) -> str:
+    return hmac.new(token_secret(), body.encode(), hashlib.sha256).hexdigest()
+
+def issue_token(user_id: Optional[int]) -> str:
+    """Bearer token for the API, so the browser can sync without keeping the password"""
+    body = f'{"" if user_id is None else user_id}.{int(time.time()) + TOKEN_TTL}'
+    return f'{body}.{_sign(body)}'
+
+def verify_token(token: str) -> Optional[Account]:
+    """The account a token was issued to, if it is genuine, unexpired and still active"""
+    try:
+        user_id, expires, signature = token.split('.')
+        expires = int(expires)
+        user_id = int(user_id) if user_id else None
+    except ValueError:
+        return None
+    body = f'{"" if user_id is None else user_id}.{expires}'
+    # Bytes, since compare_digest rejects str with non-ASCII characters from a forged header
+    if not hmac.compare_digest(signature.encode(), _sign(body).encode()) or expires < time.time():
+        return None
+    if user_id is None:
+        return Account(None, os.getenv("AUTH_USERNAME", "admin"))
+
+    conn = _connect()
+    try:
+        row = conn.execute('SELECT id, username FROM users WHERE id = ? AND active = 1', (user_id,)).fetchone()
+    finally:
+        conn.close()
+    return Account(row[0], row[1]) if row else None
+
+async def verify_token_async(token: str) -> Optional[Account]:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(db.get_executor(), verify_token, token)
+
+def scoped(fn):
+    """Run an async State event handler against the signed-in user's data"""
+    @functools.wraps(fn)
+    async def wrapper(self, *args, **kwargs):
+        tokens = use_account(self._user_id)
+        try:
+            return await fn(self, *args, **kwargs)
+        finally:
+            reset_account(tokens)
+    return wrapper
+
+def add_user(username: str, password: str) -> int:
+    conn = _connect()
+    try:
+        with conn:
+            return conn.execute(
+                'INSERT INTO users (username, password_hash) VALUES (?, ?)',
+                (username.strip(), hash_password(password))
+            ).lastrowid
+    finally:
+        conn.close()
+
+def set_password(username: str, password: str) -> bool:
+    conn = _connect()
+    try:
+        with conn:
+            return conn.execute(
+                'UPDATE users SET password_hash = ? WHERE username = ?',
+                (hash_password(password), username.strip())
+            ).rowcount > 0
+    finally:
+        conn.close()
+
+def set_active(username: str, active: bool) -> bool:
+    conn = _connect()
+    try:
+        with conn:
+            return conn.execute(
+                'UPDATE users SET active = ? WHERE username = ?', (int(active), username.strip())
+            ).rowcount > 0
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    import argparse
+    import getpass
+
+    parser = argparse.ArgumentParser(description='Manage driver accounts')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    for command, help_text in (('add', 'create an account'), ('passwd', 'change a password'),
+                               ('disable', 'block logins'), ('enable', 'allow logins again')):
+        subparsers.add_parser(command, help=help_text).add_argument('username')
+    subparsers.add_parser('list', help='list accounts')
+    args = parser.parse_args()
+
+    if args.command == 'list':
+        conn = _connect()
+        for user_id, username, active in conn.execute('SELECT id, username, active FROM users ORDER BY username'):
+            print(f'{user_id}\t{username}\t{"active" if active else "disabled"}\t{database_path(user_id)}')
+        conn.close()
+    elif args.command in ('add', 'passwd'):
+        password = getpass.getpass('Password: ')
+        if not password or password != getpass.getpass('Repeat password: '):
+            raise SystemExit('Passwords are empty or do not match')
+        if args.command == 'add':
+            print(f'Created user {add_user(args.username, password)}')
+        elif not set_password(args.username, password):
+            raise SystemExit(f'No user {args.username}')
+    elif not set_active(args.username, args.command == 'enable'):
+        raise SystemExit(f'No user {args.username}')
@@ -0,0 +1,40 @@
+from datetime import date
+from typing import Optional, Tuple
+
+TRIP_TYPES = ('zakelijk', 'prive', 'woon_werk')
+
+def parse_int(value) -> Optional[int]:
+    """Parse an optional integer field; empty values become None"""
+    if value is None or value == '':
+        return None
+    return int(value)
+
+def parse_cost(value) -> float:
+    """Parse an optional cost field; empty values become 0"""
+    if value is None or value == '':
+        return 0.0
+    return float(value)
+
+def parse_distance(distance_km, start_odometer, end_odometer) -> Tuple[int, Optional[int], Optional[int]]:
+    """Resolve (distance, start_odometer, end_odometer) the way the trip form does
+
+    An explicit distance wins; otherwise it is the odometer difference when that
+    is positive, and 0 when it can't be determined.
+    """
+    start_odo = parse_int(start_odometer)
+    end_odo = parse_int(end_odometer)
+    distance = parse_int(distance_km)
+    if distance is None:
+        if start_odo is not None and end_odo is not None and end_odo > start_odo:
+            distance = end_odo - start_odo
+        else:
+            distance = 0
+    return distance, start_odo, end_odo
+
+def parse_date(value) -> str:
+    """Validate an ISO date and return it as stored ('YYYY-MM-DD')"""
+    return date.fromisoformat(str(value).strip()).isoformat()
+
+def normalize_plate(value) -> str:
+    """License plates are stored upper-case"""
+    return str(value or '').strip().upper()
@@ -0,0 +1,244 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from . import db, metrics
+
+logger = logging.getLogger(__name__)
+
+# Delivery configuration (overridable through the environment)
+WEBHOOK_TIMEOUT = float(os.getenv("WEBHOOK_TIMEOUT", "10"))
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "8"))
+WEBHOOK_BACKOFF_BASE = float(os.getenv("WEBHOOK_BACKOFF_BASE", "2"))
+WEBHOOK_BACKOFF_MAX = float(os.getenv("WEBHOOK_BACKOFF_MAX", "3600"))
+# Entries per POST; above 1, bursts to the same URL are coalesced into one batch
+WEBHOOK_BATCH_SIZE = int(os.getenv("WEBHOOK_BATCH_SIZE", "1"))
+# Seconds to wait after a wake-up so a burst can be collected into one batch
+WEBHOOK_BATCH_DELAY = float(os.getenv("WEBHOOK_BATCH_DELAY", "0"))
+# How long a claimed entry stays invisible to other workers while it is sent
+WEBHOOK_CLAIM_SECONDS = WEBHOOK_TIMEOUT * 3
+# Longest idle sleep; every database is checked this often, so entries queued
+# by other processes are still picked up
+WEBHOOK_POLL_INTERVAL = float(os.getenv("WEBHOOK_POLL_INTERVAL", "30"))
+
+def enqueue(conn, url: str, payload: dict):
+    """Queue a payload for delivery; call inside the transaction that writes the data"""
+    conn.execute(
+        'INSERT INTO webhook_outbox (url, payload, next_attempt_at) VALUES (?, ?, ?)',
+        (url, json.dumps(payload), time.time())
+    )
+
+def mileage_entry(trip_id: int, values: tuple, mileage_rate: float) -> dict:
+    """Payload for a saved trip, from its values in storage.TRIP_VALUE_COLUMNS order"""
+    (trip_date, start_location, end_location, _, _, distance_km, purpose, trip_type,
+     license_plate) = values[:9]
+    return {
+        'type': 'mileage_entry',
+        'id': trip_id,
+        'date': trip_date,
+        'distance_km': distance_km,
+        'trip_type': trip_type,
+        'start_location': start_location,
+        'end_location': end_location,
+        'purpose': purpose,
+        # Only business trips are reimbursed
+        'reimbursement': round(distance_km * mileage_rate, 2) if trip_type == 'zakelijk' else 0.0,
+        'license_plate': license_plate,
+        'timestamp': datetime.now().isoformat(timespec='seconds')
+    }
+
+def backoff(attempts: int) -> float:
+    """Seconds to wait before the next attempt after `attempts` failures"""
+    return min(WEBHOOK_BACKOFF_BASE ** attempts, WEBHOOK_BACKOFF_MAX)
+
+def claim_due(conn, now: float, limit: int) -> list:
+    """Atomically claim due entries so concurrent workers never send the same one"""
+    return conn.execute('''
+        UPDATE webhook_outbox
+        SET next_attempt_at = ?
+        WHERE id IN (
+            SELECT id FROM webhook_outbox
+            WHERE status = 'pending' AND next_attempt_at <= ?
+            ORDER BY id
+            LIMIT ?
+        )
+        RETURNING id, url, payload, attempts
+    ''', (now + WEBHOOK_CLAIM_SECONDS, now, limit)).fetchall()
+
+def mark_delivered(conn, ids: list):
+    conn.executemany('DELETE FROM webhook_outbox WHERE id = ?', [(i,) for i in ids])
+
+def mark_failed(conn, entries: list, error: str):
+    now = time.time()
+    for entry_id, attempts in entries:
+        attempts += 1
+        if attempts >= WEBHOOK_MAX_ATTEMPTS:
+            conn.execute('''
+                UPDATE webhook_outbox SET status = 'dead', attempts = ?, last_error = ?
+                WHERE id = ?
+            ''', (attempts, error, entry_id))
+            metrics.WEBHOOK_ENTRIES.inc('dead')
+        else:
+            conn.execute('''
+                UPDATE webhook_outbox SET attempts = ?, last_error = ?, next_attempt_at = ?
+                WHERE id = ?
+            ''', (attempts, error, now + backoff(attempts), entry_id))
+
+def next_due(conn) -> Optional[float]:
+    row = conn.execute(
+        "SELECT MIN(next_attempt_at) FROM webhook_outbox WHERE status = 'pending'"
+    ).fetchone()
+    return row[0] if row else None
+
+def scan_due(databases: list) -> dict:
+    """When each database's next pending entry is due, read without going through the pools"""
+    due = {}
+    for path in databases:
+        if not os.path.exists(path):
+            continue
+        try:
+            conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True, timeout=db.DB_POOL_TIMEOUT)
+            try:
+                when = next_due(conn)
+            finally:
+                conn.close()
+        except sqlite3.OperationalError:
+            # Not migrated yet, so it has no outbox
+            continue
+        if when is not None:
+            due[path] = when
+    return due
+
+def batch_body(payloads: list) -> dict:
+    """Body for a coalesced POST of several entries"""
+    return {'type': 'mileage_batch', 'count': len(payloads), 'entries': payloads}
+
+class WebhookWorker:
+    """Background delivery of queued webhook entries"""
+
+    def __init__(self):
+        self._wakeup = asyncio.Event()
+        # Databases with entries queued since the last pass
+        self._queued = set()
+        # HTTP calls get their own threads so they never hold up database work
+        self._http_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='mileway-webhook')
+        self._session = requests.Session()
+        self._session.mount('http://', HTTPAdapter(pool_connections=4, pool_maxsize=4))
+        self._session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=4))
+
+    def notify(self, db_path: Optional[str] = None):
+        """Wake the worker after new entries were queued in a database (the current one by default)"""
+        self._queued.add(db_path or db.current_database())
+        self._wakeup.set()
+
+    def _post(self, url: str, body) -> requests.Response:
+        response = self._session.post(url, json=body, timeout=WEBHOOK_TIMEOUT)
+        response.raise_for_status()
+        return response
+
+    async def _deliver(self, repository, url: str, entries: list):
+        """POST one URL's claimed entries and record the outcome"""
+        loop = asyncio.get_running_loop()
+        payloads = [json.loads(payload) for _, _, payload, _ in entries]
+        body = payloads[0] if len(payloads) == 1 else batch_body(payloads)
+        started = time.perf_counter()
+        try:
+            await loop.run_in_executor(self._http_executor, self._post, url, body)
+        except requests.RequestException as e:
+            metrics.WEBHOOK_SECONDS.observe(time.perf_counter() - started, 'failed')
+            metrics.WEBHOOK_ENTRIES.inc('failed', amount=len(entries))
+            logger.warning('Webhook delivery to %s failed: %s', url, e)
+            failed = [(entry_id, attempts) for entry_id, _, _, attempts in entries]
+            await repository.webhooks_failed(failed, str(e))
+        else:
+            metrics.WEBHOOK_SECONDS.observe(time.perf_counter() - started, 'delivered')
+            metrics.WEBHOOK_ENTRIES.inc('delivered', amount=len(entries))
+            await repository.webhooks_delivered([entry_id for entry_id, _, _, _ in entries])
+
+    async def run_once(self) -> Optional[float]:
+        """Deliver everything due in the current database; returns when its next entry becomes due"""
+        # Imported here because the storage backends queue entries through this module
+        from . import storage
+        repository = storage.get()
+        while True:
+            claimed = await repository.claim_webhooks(time.time(), max(WEBHOOK_BATCH_SIZE, 1) * 16)
+            if not claimed:
+                break
+            by_url = {}
+            for entry in claimed:
+                by_url.setdefault(entry[1], []).append(entry)
+            for url, entries in by_url.items():
+                size = max(WEBHOOK_BATCH_SIZE, 1)
+                await asyncio.gather(*(
+                    self._deliver(repository, url, entries[i:i + size])
+                    for i in range(0, len(entries), size)
+                ))
+        return await repository.next_webhook_due()
+
+    async def run(self):
+        """Deliver queued entries from every database until cancelled"""
+        from . import storage
+        due = {}  # database -> when its next entry is due
+        next_scan = 0.0
+        while True:
+            # Clear first so entries queued while delivering trigger another pass
+            self._wakeup.clear()
+            now = time.time()
+            if now >= next_scan:
+                try:
+                    due.update(await storage.get().outboxes_due())
+                except Exception:
+                    logger.exception('Scanning webhook outboxes failed')
+                next_scan = now + WEBHOOK_POLL_INTERVAL
+            while self._queued:
+                due[self._queued.pop()] = now
+
+            for db_path in [path for path, when in due.items() if when <= now]:
+                token = db.use_database(db_path)
+                try:
+                    next_due = await self.run_once()
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    logger.exception('Webhook worker iteration failed for %s', db_path)
+                    next_due = None
+                finally:
+                    db.reset_database(token)
+                if next_due is None:
+                    due.pop(db_path, None)
+                else:
+                    due[db_path] = next_due
+
+            delay = max(min([next_scan, *due.values()]) - time.time(), 0)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                if WEBHOOK_BATCH_DELAY:
+                    await asyncio.sleep(WEBHOOK_BATCH_DELAY)
+            except asyncio.TimeoutError:
+                pass
+
+_worker: Optional[WebhookWorker] = None
+
+def get_worker() -> WebhookWorker:
+    """Get the process-wide webhook worker"""
+    global _worker
+    if _worker is None:
+        _worker = WebhookWorker()
+    return _worker
+
+async def run_worker():
+    """Lifespan task that runs the webhook worker for the backend's lifetime"""
+    await get_worker().run()
+
+def notify():
+    """Wake the worker after new entries were queued in the current database"""
+    get_worker().notify()